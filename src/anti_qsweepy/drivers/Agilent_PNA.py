@@ -1,10 +1,10 @@
 # Network alnalyzer
 from numpy import *
-from .instrument_base_classes import VisaInstrument
+from .instrument_base_classes import VisaInstrument, SegmentedSweepMixin
 import time
 
 
-class NetworkAnalyzer(VisaInstrument):
+class NetworkAnalyzer(SegmentedSweepMixin, VisaInstrument):
 
     def __init__(self, *args):
         VisaInstrument.__init__(self, *args)
@@ -14,6 +14,8 @@ class NetworkAnalyzer(VisaInstrument):
         self._abort = False
         self._ch = 0
         self._soft_trig = False
+        # Number of points in each segment of the loaded segment table
+        self._seg_points = []
 
     def channel(self, val=None):
         """Set active channel. There is only one channel 0 on this device."""
@@ -144,6 +146,7 @@ class NetworkAnalyzer(VisaInstrument):
             self.instr.write("SENS:SEGM{:d}:FREQ:STOP {:f}".format(n, seg['stop']))
             self.instr.write("SENS:SEGM{:d}:SWE:POIN {:d}".format(n, seg['points']))
             self.instr.write("SENS:SEGM{:d} ON".format(n))
+        self._seg_points = [int(seg['points']) for seg in seg_tab]
 
     # self.instr.write("SENS1:SEGM:LIST SSTOP,"+SegTable)
 
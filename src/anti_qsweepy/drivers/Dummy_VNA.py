@@ -4,8 +4,9 @@ import numpy.typing as npt
 import time
 from typing import Any
 import scipy.constants as sc
+from .instrument_base_classes import SegmentedSweepMixin
 
-class NetworkAnalyzer:
+class NetworkAnalyzer(SegmentedSweepMixin):
 
     def __init__(self, *args):
         self._n_ch = 4
@@ -21,6 +22,8 @@ class NetworkAnalyzer:
         self._period = 0.5e9
         self._output = False
         self._sw_type = 'LIN'
+        self._seg_tab = []
+        self._seg_points = []
         self._attr = 0
         # Abort flag to use when
         # read_data method is executed as a separate thread
@@ -65,7 +68,10 @@ class NetworkAnalyzer:
 
     def read_data(self) -> np.ndarray:
         self._abort = False
-        t = self._points / self._bandwidth
+        if self._sw_type == 'SEGM':
+            t = sum([seg['points'] / seg['bandwidth'] for seg in self._seg_tab])
+        else:
+            t = self._points / self._bandwidth
         tslp = 0.01
         while t>0:
             if self._abort:
@@ -115,6 +121,9 @@ class NetworkAnalyzer:
         return self._output
 
     def freq_points(self) -> npt.NDArray[float]:
+        if self._sw_type == 'SEGM':
+            return np.concatenate([np.linspace(seg['start'], seg['stop'], int(seg['points']))
+                                   for seg in self._seg_tab])
         f_points = np.linspace(self._center - self._span / 2,
                                self._center + self._span / 2,
                                self._points)
@@ -128,9 +137,11 @@ class NetworkAnalyzer:
             self._sw_type = val
         return self._sw_type
 
-    def seg_tab(self, seg_tab):
-        #TODO implement segment table support
-        pass
+    def seg_tab(self, seg_tab: list[dict]) -> None:
+        # Segment description format:
+        # {'start':0, 'stop':0, 'points':0, 'power':0,'bandwidth':0}
+        self._seg_tab = [dict(seg) for seg in seg_tab]
+        self._seg_points = [int(seg['points']) for seg in seg_tab]
 
     def averaging(self, val:int = None) -> int:
         return self._query_or_write('averaging', val)
@@ -1,14 +1,16 @@
 # Network analyzer
 from numpy import *
-from .instrument_base_classes import VisaInstrument
+from .instrument_base_classes import VisaInstrument, SegmentedSweepMixin
 import time
 
 
-class NetworkAnalyzer(VisaInstrument):
+class NetworkAnalyzer(SegmentedSweepMixin, VisaInstrument):
 
     def __init__(self, *args):
         VisaInstrument.__init__(self, *args)
         self.instr.write('FORM REAL,32; FORM:BORD SWAP;')
+        # Number of points in each segment of the loaded segment table
+        self._seg_points = []
 
     def s_parameter(self, val=None):
         # Mtype = "S11"|"S21"|"S22"|"S12"
@@ -93,6 +95,21 @@ class NetworkAnalyzer(VisaInstrument):
     def num_of_points(self, val=None):
         return float(self.write_or_query("SENS1:SWE:POIN", int(val), "{:d}"))
 
+    def seg_tab(self, seg_tab):
+        # Segment description format:
+        # {'start':0, 'stop':0, 'points':0, 'power':0,'bandwidth':0}
+        # Segment time 0 means automatic sweep time
+        self.instr.write("SENS1:SEGM:CLE")
+        for i, seg in enumerate(seg_tab):
+            n = i + 1
+            self.instr.write("SENS1:SEGM{:d}:INS {:e},{:e},{:d},{:f},0,0,{:e}".format(n,
+                                                                                     seg['start'],
+                                                                                     seg['stop'],
+                                                                                     int(seg['points']),
+                                                                                     seg['power'],
+                                                                                     seg['bandwidth']))
+        self._seg_points = [int(seg['points']) for seg in seg_tab]
+
     def averaging(self, val=None):
         if val is not None:
             if val > 1:
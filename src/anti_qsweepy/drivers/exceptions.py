@@ -7,3 +7,9 @@ class UnableToConnectError(Exception):
 class ChIndexOutOfRange(Exception):
     def __init__(self, msg: str):
         self.msg = msg
+
+
+class SegmentedSweepError(Exception):
+    def __init__(self, msg: str):
+        self.msg = msg
+        super().__init__(msg)
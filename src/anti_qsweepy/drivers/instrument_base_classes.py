@@ -1,4 +1,5 @@
 import pyvisa as visa
+import numpy as np
 from typing import Any
 from . import exceptions
 
@@ -20,6 +21,23 @@ class Instrument:
         return val
 
 
+class SegmentedSweepMixin:
+    """Common part of the segmented sweep support of the VNAs. The driver's seg_tab()
+    loads the segment table into the instrument and stores the number of points of each
+    segment in _seg_points."""
+    _seg_points: list[int] = []
+
+    def read_segmented_data(self) -> list[np.ndarray]:
+        """Read a segmented sweep and split it into a list of arrays,
+        one per segment of the table loaded with seg_tab()"""
+        data = self.read_data()
+        if len(data) != sum(self._seg_points):
+            raise exceptions.SegmentedSweepError(
+                "Segmented sweep returned {:d} points, {:d} expected from the segment table".format(
+                    len(data), int(sum(self._seg_points))))
+        return np.split(data, np.cumsum(self._seg_points)[:-1])
+
+
 class VisaInstrument(Instrument):
     """Base class for VISA instruments that use SCPI-style syntax."""
     def __init__(self, address, term_chars=None):
@@ -0,0 +1,55 @@
+"""
+Performance benchmarks of the routines
+
+Usage:
+    python -m anti_qsweepy.routines.benchmarks
+
+Runs the differential evolution generation benchmark and the data storage benchmark
+(data_mgmt.benchmark_storage) in a temporary directory.
+"""
+import time
+import tempfile
+import numpy as np
+from anti_qsweepy.routines.differential_evolution import DifferentialEvolutionSolver
+from anti_qsweepy.routines.data_mgmt import benchmark_storage
+
+
+def benchmark_generation(popsizes=(10, 20, 50, 100, 200, 500), n_gen=5, seed=1):
+    """Compares time per generation of the per-candidate ('immediate') and
+    batched ('deferred') trial generation for a cheap vectorized cost function."""
+
+    def func(x):
+        return np.sum(np.atleast_2d(x) ** 2, axis=-1)
+
+    bounds = [(-5, 5), (-5, 5)]
+    print("{:>8s}{:>16s}{:>16s}{:>10s}".format('popsize', 'immediate, ms', 'deferred, ms', 'speedup'))
+    for popsize in popsizes:
+        t_gen = {}
+        for updating in ('immediate', 'deferred'):
+            solver = DifferentialEvolutionSolver(func, bounds, popsize=popsize, minpopsize=popsize,
+                                                 threshold=np.inf, seed=seed, updating=updating)
+            next(solver)  # initial population energies
+            t0 = time.perf_counter()
+            for i in range(n_gen):
+                next(solver)
+            t_gen[updating] = (time.perf_counter() - t0) / n_gen
+        # deferred mode must be repeatable for a fixed seed
+        res = [DifferentialEvolutionSolver(func, bounds, popsize=popsize, minpopsize=popsize, threshold=np.inf,
+                                           seed=seed, updating='deferred', maxiter=n_gen).solve().x
+               for i in range(2)]
+        assert np.array_equal(res[0], res[1])
+        print("{:>8d}{:>16.3f}{:>16.3f}{:>10.1f}".format(popsize,
+                                                          t_gen['immediate'] * 1e3,
+                                                          t_gen['deferred'] * 1e3,
+                                                          t_gen['immediate'] / t_gen['deferred']))
+
+
+def benchmarks_main():
+    """Runs all benchmarks"""
+    benchmark_generation()
+    with tempfile.TemporaryDirectory() as path:
+        benchmark_storage(path)
+
+
+if __name__ == '__main__':
+    benchmarks_main()
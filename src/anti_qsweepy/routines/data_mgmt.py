@@ -2,6 +2,11 @@ import os
 import shutil
 import datetime
 import pathlib
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
 import tables
 from numpy.typing import ArrayLike
 from ruamel.yaml import YAML
@@ -9,6 +14,56 @@ import platformdirs
 
 from .. import global_defs
 
+# Storage defaults of the extendable arrays created by this module. Both can be
+# overridden per call. Compression is off by default: noisy complex VNA data shrinks
+# only by ~20% while every flush of a partially filled chunk recompresses it, see
+# benchmark_storage(). Chunks of a few rows keep per-row flushes of live sweeps cheap.
+default_filters = tables.Filters(complevel=0)
+default_chunk_size = 2**18  # Target chunk size, bytes
+
+def compression_filters(complib:str|None = 'blosc2:zstd', complevel:int = 5,
+						shuffle:bool = True) -> tables.Filters:
+	"""tables.Filters for the compression library complib, no compression if complib is None.
+	Falls back to zlib if complib is not available in this PyTables build."""
+	if complib is None or complevel == 0:
+		return tables.Filters(complevel=0)
+	if complib not in tables.filters.all_complibs or \
+			tables.which_lib_version(complib.split(':')[0]) is None:
+		print('Compression library {:s} is not available, using zlib'.format(complib))
+		complib = 'zlib'
+	return tables.Filters(complevel=complevel, complib=complib, shuffle=shuffle)
+
+def chunkshape_2d(row_len:int, itemsize:int, expected_rows:int|None = None,
+				  chunk_size:int|None = None) -> tuple[int, int]:
+	"""Chunk shape for an extendable array of rows of row_len items.
+
+	Chunks hold whole rows, as many as fit into chunk_size bytes but not more than
+	expected_rows, so appending and reading a row touches a single chunk and reading
+	a column touches few of them. Rows longer than chunk_size are split.
+	"""
+	if chunk_size is None:
+		chunk_size = default_chunk_size
+	row_bytes = max(row_len, 1)*itemsize
+	if row_bytes > chunk_size:
+		return 1, max(chunk_size//itemsize, 1)
+	rows = chunk_size//row_bytes
+	if expected_rows is not None:
+		rows = min(rows, max(int(expected_rows), 1))
+	return rows, max(row_len, 1)
+
+def create_earray_2d(file:tables.File, where:tables.Group|str, name:str, atom:tables.Atom, row_len:int,
+					 title:str = '', filters:tables.Filters|None = None,
+					 chunkshape:tuple[int, int]|None = None,
+					 expected_rows:int|None = None) -> tables.EArray:
+	"""Extendable array of rows of row_len items with the module storage defaults."""
+	if filters is None:
+		filters = default_filters
+	if chunkshape is None:
+		chunkshape = chunkshape_2d(row_len, atom.itemsize, expected_rows)
+	return file.create_earray(where, name, atom, (0, row_len), title, filters=filters,
+							  expectedrows=expected_rows if expected_rows is not None else 1000,
+							  chunkshape=chunkshape)
+
 def default_save_path(root, time=True, name=None):
 
 	now = datetime.datetime.now()
@@ -30,7 +85,10 @@ def default_save_path(root, time=True, name=None):
 def extendable_2d(path:str, column_coordinate:ArrayLike, dtype:type = complex,
 				  data_name:str = "Complex S-parameter",
 				  column_name:str = "Frequency, Hz",
-				  row_name:str = "Power, dBm"):
+				  row_name:str = "Power, dBm",
+				  filters:tables.Filters|None = None,
+				  chunkshape:tuple[int, int]|None = None,
+				  expected_rows:int|None = None):
 	# Create HDF5 data file
 	f = tables.open_file(path+'\\data.h5', mode='w')
 	f.close()
@@ -38,23 +96,201 @@ def extendable_2d(path:str, column_coordinate:ArrayLike, dtype:type = complex,
 	d_atom = tables.ComplexAtom(itemsize = 16 )
 	rc_atom = tables.Float64Atom() #coordinates dtype
 	if dtype is complex:
-		d_array = f.create_earray(f.root, 'data', d_atom, (0, len(column_coordinate)), data_name)
+		d_array = create_earray_2d(f, f.root, 'data', d_atom, len(column_coordinate), data_name,
+								   filters=filters, chunkshape=chunkshape, expected_rows=expected_rows)
 	elif dtype is float:
-		d_array = f.create_earray(f.root, 'data', rc_atom, (0, len(column_coordinate)), data_name)
+		d_array = create_earray_2d(f, f.root, 'data', rc_atom, len(column_coordinate), data_name,
+								   filters=filters, chunkshape=chunkshape, expected_rows=expected_rows)
 	else:
 		raise TypeError
 	f.create_array(f.root, 'column_coordinate', column_coordinate, column_name)
-	r_array = f.create_earray(f.root, 'row_coordinate', rc_atom, (0,), row_name)
+	r_array = f.create_earray(f.root, 'row_coordinate', rc_atom, (0,), row_name,
+							  expectedrows=expected_rows if expected_rows is not None else 1000)
 	f.flush()
 	return f, d_array, r_array
 
+class HDF5Writer:
+	"""Writes to an HDF5 file from a dedicated thread.
+
+	The writer thread owns the file: acquisition code only enqueues requests and
+	must not touch the file's nodes itself until the writer is closed. Appends queued
+	meanwhile are written as one batch per array and the file is flushed every
+	flush_interval seconds or flush_rows appended rows, whichever comes first.
+	A full queue blocks the producer, so a stalled disk slows acquisition down
+	instead of exhausting memory. close() always writes everything queued so far,
+	flushes and closes the file; use the writer as a context manager to get this
+	on abort or error too. Exceptions raised in the writer thread are re-raised
+	in the producer by the next request.
+
+	Args:
+		file: Open file. Ownership is passed to the writer.
+		max_queue: Maximum number of pending requests.
+		flush_interval: Maximum time between flushes, s.
+		flush_rows: Maximum number of rows appended between flushes.
+	"""
+	def __init__(self, file: tables.File, max_queue: int = 256, flush_interval: float = 1.,
+				 flush_rows: int = 1000):
+		self.file = file
+		self.flush_interval = flush_interval
+		self.flush_rows = flush_rows
+		self._queue = queue.Queue(maxsize=max_queue)
+		self._error: BaseException | None = None
+		self._closed = False
+		self._rows = 0
+		self._last_flush = time.time()
+		self._thread = threading.Thread(target=self._run, name='HDF5Writer', daemon=True)
+		self._thread.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+	def _raise_error(self) -> None:
+		if self._error is not None:
+			err, self._error = self._error, None
+			raise err
+
+	def _put(self, item: tuple) -> None:
+		self._raise_error()
+		if self._closed:
+			raise ValueError('HDF5 writer is closed')
+		self._queue.put(item)
+
+	def append(self, node: tables.EArray | tables.Table, data: ArrayLike) -> None:
+		"""Appends data to an extendable array or rows to a table."""
+		self._put(('append', node, data))
+
+	def append_row(self, table: tables.Table, row: dict) -> None:
+		"""Appends a table row given as a column name to value mapping."""
+		self._put(('row', table, row))
+
+	def sink(self, node: tables.EArray | tables.Table) -> 'HDF5WriterSink':
+		"""Drop-in replacement of node for code which only appends to it."""
+		return HDF5WriterSink(self, node)
+
+	def submit(self, func, *args, **kwargs) -> Future:
+		"""Calls func(*args, **kwargs) in the writer thread after the requests queued before."""
+		future = Future()
+		self._put(('call', future, func, args, kwargs))
+		return future
+
+	def flush(self) -> None:
+		"""Blocks until all queued requests are written and the file is flushed.
+		Raises the error of the writer thread instead, if any."""
+		self._raise_error()
+		self.submit(self.file.flush).result()
+
+	def close(self) -> None:
+		"""Writes the queued requests, flushes and closes the file."""
+		if self._closed:
+			return
+		self._closed = True
+		self._queue.put(('close',))
+		self._thread.join()
+		self._raise_error()
+
+	def _run(self) -> None:
+		# Appends waiting to be written, grouped by node
+		pending: dict[int, tuple] = {}
+		n_pending = 0
+		while True:
+			timeout = max(self._last_flush + self.flush_interval - time.time(), 0.)
+			try:
+				item = self._queue.get(timeout=timeout if self._rows else None)
+			except queue.Empty:
+				item = None
+			try:
+				if item is not None and item[0] == 'append':
+					pending.setdefault(id(item[1]), (item[1], []))[1].append(item[2])
+					n_pending += 1
+					if not self._queue.empty() and n_pending < self._queue.maxsize:
+						continue
+				# Write the batch when the queue is drained or before any other request
+				for node, chunks in pending.values():
+					self._write(node, chunks)
+				pending = {}
+				n_pending = 0
+				if item is None:
+					self._flush()
+					continue
+				if item[0] == 'row':
+					row = item[1].row
+					for key, val in item[2].items():
+						row[key] = val
+					row.append()
+					self._rows += 1
+				elif item[0] == 'call':
+					future, func, args, kwargs = item[1:]
+					try:
+						future.set_result(func(*args, **kwargs))
+					except BaseException as err:
+						future.set_exception(err)
+				elif item[0] == 'close':
+					self._flush()
+					self.file.close()
+					return
+				if self._rows >= self.flush_rows or time.time() - self._last_flush >= self.flush_interval:
+					self._flush()
+			except BaseException as err:
+				pending = {}
+				n_pending = 0
+				# The requests queued behind the failure are dropped, the callers waiting for
+				# the current and the queued calls get the error. Keep consuming the queue,
+				# so the producer never blocks on a dead writer.
+				failed = [] if item is None else [item]
+				try:
+					while True:
+						failed.append(self._queue.get_nowait())
+				except queue.Empty:
+					pass
+				delivered = False
+				for failed_item in failed:
+					if failed_item[0] == 'call' and not failed_item[1].done():
+						failed_item[1].set_exception(err)
+						delivered = True
+				if not delivered:
+					self._error = err
+				if any(failed_item[0] == 'close' for failed_item in failed):
+					if self.file.isopen:
+						self.file.close()
+					return
+
+	def _write(self, node: tables.EArray | tables.Table, chunks: list) -> None:
+		if isinstance(node, tables.Table):
+			data = np.concatenate([np.asarray(c, dtype=node.dtype).reshape(-1) for c in chunks])
+		else:
+			data = np.concatenate([np.asarray(c).reshape((-1,) + node.shape[1:]) for c in chunks])
+		node.append(data)
+		self._rows += len(data)
+
+	def _flush(self) -> None:
+		if self._rows:
+			self.file.flush()
+		self._rows = 0
+		self._last_flush = time.time()
+
+
+class HDF5WriterSink:
+	"""Queues appends to a node through an HDF5Writer."""
+	def __init__(self, writer: HDF5Writer, node: tables.EArray | tables.Table):
+		self.writer = writer
+		self.node = node
+
+	def append(self, data: ArrayLike) -> None:
+		self.writer.append(self.node, data)
+
+
 def add_extandable_1d(file: tables.File,
 						meas_name: str,
 						metadata: dict|None = None,
 						x_label: str = 'x',
 						y_label: str = 'y',
 						x_dtype: type = float,
-						y_dtype: type = float) -> tuple[tables.EArray, tables.EArray]:
+						y_dtype: type = float,
+						filters: tables.Filters|None = None,
+						expected_rows: int|None = None) -> tuple[tables.EArray, tables.EArray]:
 	group = file.create_group(file.root, meas_name, meas_name)
 
 	if x_dtype is complex:
@@ -71,8 +307,11 @@ def add_extandable_1d(file: tables.File,
 	else:
 		raise TypeError
 
-	x_array = file.create_earray(group, 'x', x_atom, (0,), x_label)
-	y_array = file.create_earray(group, 'y', y_atom, (0,), y_label)
+	if filters is None:
+		filters = default_filters
+	expected_rows = expected_rows if expected_rows is not None else 1000
+	x_array = file.create_earray(group, 'x', x_atom, (0,), x_label, filters=filters, expectedrows=expected_rows)
+	y_array = file.create_earray(group, 'y', y_atom, (0,), y_label, filters=filters, expectedrows=expected_rows)
 
 	# Set metadata for the group
 	if metadata is not None:
@@ -147,7 +386,8 @@ def add_sa_description(file: tables.File, metadata: dict) -> None:
     s_table.append()
     
 
-def impa_tuning_results(f_points:int, save_path:str):
+def impa_tuning_results(f_points:int, save_path:str, filters:tables.Filters|None = None,
+						expected_rows:int|None = None):
 	"""Creates HDF5 file to store IMPA tuning results"""
 	class Thumbnail(tables.IsDescription):
 		Fp = tables.Float64Col()
@@ -162,15 +402,15 @@ def impa_tuning_results(f_points:int, save_path:str):
 	thumbnail = f.create_table(f.root, 'thumbnail', Thumbnail, "thumbnail").row
 	complex_atom = tables.ComplexAtom(itemsize=16)
 	float_atom = tables.Float64Atom()
-	s21_on = f.create_earray(f.root, 's21_on', complex_atom, (0, f_points * 2), "S21-on")
-	s21_off = f.create_earray(f.root, 's21_off', complex_atom, (0, f_points * 2), "S21-off")
-	s21_on_snr = f.create_earray(f.root, 's21_on_snr', complex_atom, (0, f_points * 2),
-								 "mean(S21-on-snr)")
-	s21_off_snr = f.create_earray(f.root, 's21_off_snr', complex_atom, (0, f_points * 2),
-								  "mean(S21-off-snr)")
-	s21_freq = f.create_earray(f.root, 's21_frequency', float_atom, (0, f_points * 2), "S21 frequency")
-	snr_gain = f.create_earray(f.root, 'snr_gain', float_atom, (0, f_points * 2), "SNR gain")
-	snr_freq = f.create_earray(f.root, 'snr_freq', float_atom, (0, f_points * 2), "SNR frequency")
+	earray = lambda name, atom, title: create_earray_2d(f, f.root, name, atom, f_points * 2, title,
+														 filters=filters, expected_rows=expected_rows)
+	s21_on = earray('s21_on', complex_atom, "S21-on")
+	s21_off = earray('s21_off', complex_atom, "S21-off")
+	s21_on_snr = earray('s21_on_snr', complex_atom, "mean(S21-on-snr)")
+	s21_off_snr = earray('s21_off_snr', complex_atom, "mean(S21-off-snr)")
+	s21_freq = earray('s21_frequency', float_atom, "S21 frequency")
+	snr_gain = earray('snr_gain', float_atom, "SNR gain")
+	snr_freq = earray('snr_freq', float_atom, "SNR frequency")
 	return {'thumbnail': thumbnail,
 			's21_on': s21_on,
 			's21_off': s21_off,
@@ -179,4 +419,77 @@ def impa_tuning_results(f_points:int, save_path:str):
 			's21_freq': s21_freq,
 			'snr_gain': snr_gain,
 			'snr_freq': snr_freq,
-			'file': f}
\ No newline at end of file
+			'file': f}
+
+
+def benchmark_storage(path:str, rows:int = 500, row_len:int = 1601,
+					  filters:dict[str, tables.Filters]|None = None,
+					  chunk_sizes:tuple = (None,),
+					  flush_rows:int = 1) -> list[dict]:
+	"""Writes and reads back a synthetic 2D sweep of complex S-parameters with several
+	storage settings, prints and returns write rate, file size and read times.
+
+	The data resembles a bias sweep: a resonance moving with the row index plus noise.
+
+	Args:
+		path: Directory for the temporary files.
+		rows: Number of sweep rows.
+		row_len: Number of points per row.
+		filters: Storage settings to compare by name. No compression, zlib and
+				 blosc2:zstd if None.
+		chunk_sizes: Target chunk sizes in bytes, None for default_chunk_size.
+		flush_rows: Rows between flushes. 1 corresponds to a live sweep flushed per row,
+					larger values to the batched flushes of HDF5Writer.
+	"""
+	if filters is None:
+		filters = {'none': tables.Filters(complevel=0),
+				   'zlib-5': compression_filters('zlib', 5),
+				   'blosc2:zstd-5': compression_filters('blosc2:zstd', 5)}
+	rng = np.random.default_rng(0)
+	freq = np.linspace(6e9, 7e9, row_len)
+	results = []
+	for name, flt in filters.items():
+		for chunk_size in chunk_sizes:
+			chunkshape = chunkshape_2d(row_len, 16, rows, chunk_size)
+			fname = os.path.join(path, 'benchmark.h5')
+			f = tables.open_file(fname, mode='w')
+			d_array = create_earray_2d(f, f.root, 'data', tables.ComplexAtom(itemsize=16), row_len,
+									   filters=flt, chunkshape=chunkshape, expected_rows=rows)
+			t_write = 0.
+			for i in range(rows):
+				f0 = 6e9 + 1e9*i/rows
+				row = 1 - 0.9/(1 + 2j*(freq - f0)/5e6) + 1e-3*(rng.standard_normal(row_len)
+																+ 1j*rng.standard_normal(row_len))
+				t0 = time.perf_counter()
+				d_array.append(row.reshape(1, row_len))
+				if (i + 1) % flush_rows == 0:
+					f.flush()
+				t_write += time.perf_counter() - t0
+			t0 = time.perf_counter()
+			f.close()
+			t_write += time.perf_counter() - t0
+			size = os.path.getsize(fname)
+			with tables.open_file(fname, mode='r') as f:
+				t0 = time.perf_counter()
+				f.root.data.read()
+				t_read = time.perf_counter() - t0
+				t0 = time.perf_counter()
+				for i in range(0, rows, max(rows//50, 1)):
+					f.root.data[i]
+				t_row = (time.perf_counter() - t0)/len(range(0, rows, max(rows//50, 1)))
+				t0 = time.perf_counter()
+				f.root.data[:, row_len//2]
+				t_col = time.perf_counter() - t0
+			os.remove(fname)
+			results += [{'filters': name,
+						 'chunkshape': chunkshape,
+						 'write_rows_per_s': rows/t_write,
+						 'size_MB': size/2**20,
+						 'ratio': rows*row_len*16/size,
+						 'read_all_s': t_read,
+						 'read_row_s': t_row,
+						 'read_column_s': t_col}]
+			print('{filters:>14s} chunk {chunkshape!s:>12s}: write {write_rows_per_s:8.0f} rows/s, '
+				  '{size_MB:7.1f} MB (x{ratio:.2f}), read all {read_all_s:.3f} s, '
+				  'row {read_row_s:.5f} s, column {read_column_s:.3f} s'.format(**results[-1]))
+	return results
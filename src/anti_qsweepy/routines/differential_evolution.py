@@ -35,6 +35,7 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 Modified version of differential evolution global optimization algorithm from Numpy
 """
 import warnings
+import time
 import numpy as np
 from scipy.optimize import OptimizeResult, minimize
 from scipy.optimize._constraints import (Bounds, new_bounds_to_old,
@@ -52,7 +53,9 @@ def differential_evolution(func, bounds, args=(), strategy='best1bin',
                            callback=None, disp=False, polish=True,
                            init='latinhypercube', atol=0,
                            constraints=(), x0=None, *,
-                           integrality=None):
+                           integrality=None, prescreen=None, prescreen_tol=0.5,
+                           uncertainty=None, remeasure=None, noise_k=1., max_remeasure=3,
+                           updating='immediate'):
     """Finds the global minimum of a multivariate function.
     Differential Evolution is stochastic in nature (does not use gradient
     methods) to find the minimum, and can search large areas of candidate
@@ -192,6 +195,39 @@ def differential_evolution(func, bounds, args=(), strategy='best1bin',
         If there are no integer values lying between the bounds then a
         `ValueError` is raised.
         .. versionadded:: 1.9.0
+    prescreen : callable, optional
+        A cheap approximation of `func` in the form ``prescreen(x)``. If
+        given, every trial vector is scored with it first and the full
+        objective function is evaluated only if the trial could beat its
+        parent in the greedy selection, i.e. if
+        ``prescreen(x) <= (1 + prescreen_tol) * f(parent)``. The pre-screen
+        value should not overestimate `func` by more than `prescreen_tol`,
+        otherwise good trials are lost.
+    prescreen_tol : float, optional
+        Relative rejection threshold of the pre-screen stage.
+    uncertainty : callable, optional
+        Noise-adaptive selection. ``uncertainty(x)`` returns the standard
+        deviation of the last evaluated or re-measured value of `func` at `x`.
+        Requires `remeasure`.
+    remeasure : callable, optional
+        ``remeasure(x)`` evaluates `func` at `x` again with more averaging and
+        returns the refined value. If a trial and its parent differ by less
+        than `noise_k` combined uncertainties both are re-measured, up to
+        `max_remeasure` times, before the selection.
+    noise_k : float, optional
+        Significance of the difference between trial and parent energies in
+        units of their combined uncertainty.
+    max_remeasure : int, optional
+        Maximum number of re-measurements per selection.
+    updating : {'immediate', 'deferred'}, optional
+        If ``'immediate'``, the best solution vector is continuously updated
+        within a single generation, trial vectors are built one candidate at a
+        time. With ``'deferred'``, all trial vectors of a generation are
+        generated at once by array operations, evaluated by a single call of
+        `func` with a 2-D array and the best solution vector is updated once
+        per generation. The latter is much faster if the objective function is
+        cheap, e.g. a simulator or a surrogate model. Both modes give
+        repeatable results for a fixed `seed`, but not the same ones.
     Returns
     -------
     res : OptimizeResult
@@ -223,7 +259,14 @@ def differential_evolution(func, bounds, args=(), strategy='best1bin',
                                      disp=disp, init=init, atol=atol,
                                      constraints=constraints,
                                      x0=x0,
-                                     integrality=integrality) as solver:
+                                     integrality=integrality,
+                                     prescreen=prescreen,
+                                     prescreen_tol=prescreen_tol,
+                                     uncertainty=uncertainty,
+                                     remeasure=remeasure,
+                                     noise_k=noise_k,
+                                     max_remeasure=max_remeasure,
+                                     updating=updating) as solver:
         ret = solver.solve()
 
     return ret
@@ -274,7 +317,14 @@ class DifferentialEvolutionSolver:
                        atol=0,
                        constraints=(),
                        x0=None,
-                       integrality=None):
+                       integrality=None,
+                       prescreen=None,
+                       prescreen_tol=0.5,
+                       uncertainty=None,
+                       remeasure=None,
+                       noise_k=1.,
+                       max_remeasure=3,
+                       updating='immediate'):
         if strategy in self._binomial:
             self.mutation_func = getattr(self, self._binomial[strategy])
         elif strategy in self._exponential:
@@ -305,9 +355,34 @@ class DifferentialEvolutionSolver:
             self.dither.sort()
 
         self.cross_over_probability = recombination
-        self.func = func
+        # Telemetry: time spent in the cost functions and per generation records
+        self.generation = 0
+        self.generation_log = []
+        self._t_func = 0.
+        self.func = self._timed(func)
         self.args = args
 
+        # Optional cheap cost function used to reject hopeless trial vectors
+        # before the full cost function evaluation
+        self.prescreen = None if prescreen is None else self._timed(prescreen)
+        self.prescreen_tol = prescreen_tol
+        self._nfev_prescreen = 0
+        self._nrejected = 0
+
+        # Optional re-measurement of trials and parents with statistically
+        # insignificant energy difference
+        if (uncertainty is None) != (remeasure is None):
+            raise ValueError("uncertainty and remeasure must be given together")
+        self.uncertainty = uncertainty
+        self.remeasure = None if remeasure is None else self._timed(remeasure)
+        self.noise_k = noise_k
+        self.max_remeasure = max_remeasure
+        self._nremeasured = 0
+
+        if updating not in ('immediate', 'deferred'):
+            raise ValueError("updating must be either 'immediate' or 'deferred'")
+        self._updating = updating
+
         # convert tuple of lower and upper bounds to limits
         # [(low_0, high_0), ..., (low_n, high_n]
         #	 -> [[low_0, ..., low_n], [high_0, ..., high_n]]
@@ -628,11 +703,13 @@ class DifferentialEvolutionSolver:
 
             # only work out population energies for feasible solutions
             print("Preparing initial population...")
+            t0, t_func0, nfev0 = time.time(), self._t_func, self._nfev
             self.population_energies[self.feasible] = (
                 self._calculate_population_energies(
                     self.population[self.feasible]))
 
             self._promote_lowest_energy()
+            self._log_generation(t0, t_func0, nfev0)
 
         # do the optimization.
         iter_cnt = 0
@@ -649,11 +726,15 @@ class DifferentialEvolutionSolver:
                 break
             except AbortException:
                 status_message = 'Process aborted.'
+                warning_flag = True
+                break
 
             std_en = np.std(self.population_energies)
             if self.disp:
-                print("Differential evolution step %d: f(x)= %g, std = %g, Np = %d"
-                      % (nit, self.population_energies[0], std_en, self.num_population_members))
+                gen = self.generation_log[-1]
+                print("Differential evolution step %d: f(x)= %g, std = %g, Np = %d, t = %.2f s (overhead %.3f s)"
+                      % (nit, self.population_energies[0], std_en, self.num_population_members,
+                         gen['t_total'], gen['t_overhead']))
 
             if self.callback:
                 c = self.tol / (self.convergence + _MACHEPS)
@@ -694,6 +775,9 @@ class DifferentialEvolutionSolver:
             x=self.x,
             fun=self.population_energies[0],
             nfev=self._nfev,
+            nfev_prescreen=self._nfev_prescreen,
+            nrejected=self._nrejected,
+            nremeasured=self._nremeasured,
             nit=nit,
             message=status_message,
             success=(warning_flag is not True))
@@ -903,7 +987,47 @@ class DifferentialEvolutionSolver:
 
         return False
 
+    def _timed(self, func):
+        """Wraps a cost function to accumulate the time spent in it."""
+        def wrapper(*args, **kwargs):
+            t0 = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._t_func += time.time() - t0
+        return wrapper
+
+    def _log_generation(self, t0, t_func0, nfev0):
+        """Appends the telemetry record of the generation started at t0."""
+        t_total = time.time() - t0
+        t_func = self._t_func - t_func0
+        self.generation_log.append({'generation': self.generation,
+                                    'nfev': self._nfev,
+                                    'nfev_generation': self._nfev - nfev0,
+                                    'popsize': self.num_population_members,
+                                    'best_energy': float(self.population_energies[0]),
+                                    't_total': t_total,
+                                    't_func': t_func,
+                                    't_overhead': t_total - t_func})
+
     def __next__(self):
+        """
+        Evolve the population by a single generation and record its telemetry
+        Returns
+        -------
+        x : ndarray
+            The best solution from the solver.
+        fun : float
+            Value of objective function obtained from the best solution.
+        """
+        self.generation += 1
+        t0, t_func0, nfev0 = time.time(), self._t_func, self._nfev
+        try:
+            return self._next_generation()
+        finally:
+            self._log_generation(t0, t_func0, nfev0)
+
+    def _next_generation(self):
         """
         Evolve the population by a single generation
         Returns
@@ -934,6 +1058,11 @@ class DifferentialEvolutionSolver:
             self.scale = self.random_number_generator.uniform(self.dither[0],
                                                               self.dither[1])
 
+        if self._updating == 'deferred':
+            self._evolve_deferred()
+            self._reduce_population()
+            return self.x, self.population_energies[0]
+
         # update best solution immediately
         for candidate in range(self.num_population_members):
             if self._nfev > self.maxfun:
@@ -948,6 +1077,10 @@ class DifferentialEvolutionSolver:
             # scale from [0, 1) to the actual parameter value
             parameters = self._scale_parameters(trial)
 
+            # reject the trial by a cheap estimate if it can't beat the parent
+            if self.prescreen is not None and not self._prescreen_trial(parameters, candidate):
+                continue
+
             # determine the energy of the objective function
             if self._wrapped_constraints:
                 cv = self._constraint_violation_fn(parameters)
@@ -964,6 +1097,9 @@ class DifferentialEvolutionSolver:
                 energy = self.func(parameters)
                 self._nfev += 1
 
+            if feasible and self.remeasure is not None:
+                energy = self._resolve_tie(parameters, energy, candidate)
+
             # compare trial and population member
             if self._accept_trial(energy, feasible, cv,
                                   self.population_energies[candidate],
@@ -991,6 +1127,137 @@ class DifferentialEvolutionSolver:
 
         return self.x, self.population_energies[0]
 
+    def _prescreen_trial(self, parameters, candidate):
+        """
+        Scores the trial with the pre-screen function. Returns False if the
+        trial has no chance to replace its parent and should be rejected
+        without the full evaluation.
+        """
+        if not (self.feasible[candidate] and
+                np.isfinite(self.population_energies[candidate])):
+            return True
+        energy = np.squeeze(self.prescreen(parameters))
+        self._nfev_prescreen += 1
+        limit = (1 + self.prescreen_tol) * self.population_energies[candidate]
+        if energy > limit:
+            self._nrejected += 1
+            return False
+        return True
+
+    def _resolve_tie(self, parameters, energy, candidate):
+        """
+        Re-measures the trial and its parent while their energies differ by
+        less than `noise_k` combined uncertainties. The parent energy is
+        updated in place. Returns the refined trial energy.
+        """
+        energy = np.squeeze(energy)
+        if not (self.feasible[candidate] and
+                np.isfinite(self.population_energies[candidate]) and
+                np.isfinite(energy)):
+            return energy
+        parent = self._scale_parameters(self.population[candidate])
+        for i in range(self.max_remeasure):
+            sigma = np.hypot(self.uncertainty(parameters), self.uncertainty(parent))
+            if abs(energy - self.population_energies[candidate]) > self.noise_k * sigma:
+                break
+            energy = np.squeeze(self.remeasure(parameters))
+            self.population_energies[candidate] = np.squeeze(self.remeasure(parent))
+            self._nremeasured += 2
+        return energy
+
+    def _evolve_deferred(self):
+        """
+        Evolve the population by a single generation with all the trial
+        vectors created, evaluated and selected at once.
+        """
+        if self._nfev > self.maxfun:
+            raise StopIteration
+
+        candidates = np.arange(self.num_population_members)
+        trials = self._mutate_many(candidates)
+        self._ensure_constraint(trials)
+        parameters = self._scale_parameters(trials)
+
+        feasible, cv = self._calculate_population_feasibilities(trials)
+        evaluate = np.copy(feasible)
+        if self.prescreen is not None:
+            for candidate in candidates[feasible]:
+                evaluate[candidate] = self._prescreen_trial(parameters[candidate], candidate)
+
+        energies = np.full(self.num_population_members, np.inf)
+        if np.any(evaluate):
+            energies[evaluate] = self._calculate_population_energies(trials[evaluate])
+        if self.remeasure is not None:
+            for candidate in candidates[evaluate]:
+                energies[candidate] = self._resolve_tie(parameters[candidate], energies[candidate], candidate)
+
+        loc = self._accept_trials(energies, feasible, cv)
+        self.population = np.where(loc[:, np.newaxis], trials, self.population)
+        self.population_energies = np.where(loc, energies, self.population_energies)
+        self.feasible = np.where(loc, feasible, self.feasible)
+        self.constraint_violation = np.where(loc[:, np.newaxis], cv, self.constraint_violation)
+
+        self._promote_lowest_energy()
+
+    def _accept_trials(self, energy_trial, feasible_trial, cv_trial):
+        """
+        Vectorized version of `_accept_trial` comparing the whole population
+        with its trial vectors. Returns boolean array of accepted trials.
+        """
+        feasible_orig = self.feasible
+        both_feasible = feasible_trial & feasible_orig
+        accepted = both_feasible & (energy_trial <= self.population_energies)
+        accepted |= feasible_trial & ~feasible_orig
+        accepted |= ~feasible_trial & np.all(cv_trial <= self.constraint_violation, axis=1)
+        return accepted
+
+    def _mutate_many(self, candidates):
+        """Create trial vectors for all candidates based on a mutation strategy."""
+        rng = self.random_number_generator
+        num_trials = len(candidates)
+        trial = np.copy(self.population[candidates])
+
+        fill_point = rng.randint(0, self.parameter_count, num_trials)
+        # samples have shape (number_samples, num_trials) so that the
+        # per-candidate mutation functions work on whole columns
+        samples = self._select_samples_many(candidates, 5).T
+
+        if self.strategy in ['currenttobest1exp', 'currenttobest1bin']:
+            bprime = self.mutation_func(candidates, samples)
+        else:
+            bprime = self.mutation_func(samples)
+
+        crossovers = rng.uniform(size=(num_trials, self.parameter_count))
+        crossovers = crossovers < self.cross_over_probability
+        if self.strategy in self._binomial:
+            crossovers[np.arange(num_trials), fill_point] = True
+            return np.where(crossovers, bprime, trial)
+
+        elif self.strategy in self._exponential:
+            # number of consecutive parameters taken from bprime starting at
+            # fill_point equals the number of leading True crossovers
+            n_fill = np.where(np.all(crossovers, axis=1),
+                              self.parameter_count,
+                              np.argmin(crossovers, axis=1))
+            offset = (np.arange(self.parameter_count)[np.newaxis, :] -
+                      fill_point[:, np.newaxis]) % self.parameter_count
+            return np.where(offset < n_fill[:, np.newaxis], bprime, trial)
+
+    def _select_samples_many(self, candidates, number_samples):
+        """
+        obtain random integers from range(self.num_population_members),
+        without replacement, for each of the candidates at once. The
+        candidate itself is excluded. Returns array of shape
+        (len(candidates), number_samples).
+        """
+        number_samples = min(number_samples, self.num_population_members - 1)
+        keys = self.random_number_generator.uniform(
+            size=(len(candidates), self.num_population_members))
+        keys[np.arange(len(candidates)), candidates] = np.inf
+        idxs = np.argpartition(keys, number_samples - 1, axis=1)[:, :number_samples]
+        order = np.argsort(np.take_along_axis(keys, idxs, axis=1), axis=1)
+        return np.take_along_axis(idxs, order, axis=1)
+
     def _scale_parameters(self, trial):
         """Scale from a number between 0 and 1 to parameters."""
         # trial either has shape (N, ) or (L, N), where L is the number of
@@ -1224,3 +1491,4 @@ class _ConstraintWrapper:
         excess_ub = np.maximum(ev - self.bounds[1], 0)
 
         return excess_lb + excess_ub
+
@@ -1,4 +1,5 @@
 import numpy as np
+import contextlib
 from dataclasses import dataclass
 from concurrent.futures import Future
 import multiprocessing as mp
@@ -6,6 +7,7 @@ import multiprocessing as mp
 from .. import data_mgmt
 from ..helper_functions import *
 from .phy_devices import PhyDevice
+from .resource_manager import ResourceManager
 
 min_plot_update_interval = 1
 
@@ -33,6 +35,10 @@ class BiasSweep:
         self.bias_source = bias_source
         self.params: BiasSweepParameters = params
         self.future: Future | None = None
+        # Leases on the devices are taken for each step if set
+        self.resources: ResourceManager | None = None
+        # FairRLock.n_grants of the VNA lock at the last lease
+        self._vna_grants: int | None = None
         self._abort: bool = False
         self.params.save_path = data_mgmt.default_save_path(self.params.save_path, name="SvsBias")
 
@@ -40,6 +46,30 @@ class BiasSweep:
         self._abort = True
         self.vna.dev_inst.abort()
 
+    def _lease(self):
+        """Lease on the VNA and the bias source"""
+        if self.resources is None:
+            return contextlib.nullcontext()
+        return self.resources.lease((self.vna.driver_name, self.vna.addr),
+                                    (self.bias_source.driver_name, self.bias_source.addr))
+
+    def _vna_taken_over(self, lease) -> bool:
+        """The VNA has been leased to another routine since the last lease of the sweep"""
+        if lease is None:
+            return False
+        grants = lease.grants[(self.vna.driver_name, self.vna.addr)]
+        taken_over = self._vna_grants is not None and grants != self._vna_grants + 1
+        self._vna_grants = grants
+        return taken_over
+
+    def _setup_vna(self) -> None:
+        vna = self.vna.dev_inst
+        vna.num_of_points(self.params.vna_points)
+        vna.freq_start_stop((self.params.vna_start, self.params.vna_stop))
+        vna.bandwidth(self.params.vna_bandwidth)
+        vna.power(self.params.vna_power)
+        vna.sweep_type("LIN")
+
     def sweep(self):
         self._abort = False
         bias_vals = np.arange(self.params.bias_start,
@@ -51,48 +81,65 @@ class BiasSweep:
 
         vna = self.vna.dev_inst
         bias_source = self.bias_source.dev_inst
-        # Set physical channels
-        vna.channel(self.vna.chan)
-        bias_source.channel(self.bias_source.chan)
-        # Setup VNA
-        vna.num_of_points(self.params.vna_points)
-        vna.freq_start_stop((self.params.vna_start, self.params.vna_stop))
-        vna.bandwidth(self.params.vna_bandwidth)
-        vna.power(self.params.vna_power)
-        vna.sweep_type("LIN")
+        self._vna_grants = None
+        with self._lease() as lease:
+            self._vna_taken_over(lease)
+            # Set physical channels
+            vna.channel(self.vna.chan)
+            bias_source.channel(self.bias_source.chan)
+            self._setup_vna()
+            Fna = vna.freq_points()
         # Create data file
-        Fna = vna.freq_points()
-        f, d_array, r_array = data_mgmt.extendable_2d(self.params.save_path, Fna, row_name=row_descr)
+        f, d_array, r_array = data_mgmt.extendable_2d(self.params.save_path, Fna, row_name=row_descr,
+                                                      expected_rows=len(bias_vals))
         # Report to UI process
         self.q.put({'op': 'open_bias_sweep_file', 'args': (self.params.save_path+r'\data.h5', self.params.ch_id)})
         # Spawn auxiliary plotting script in the data dir
         data_mgmt.spawn_plotting_script(self.params.save_path, plotting_script)
         # Start sweep
-        vna.output(True)
-        bias_source.output(True)
-        vna.soft_trig_arm()
+        with self._lease() as lease:
+            vna.channel(self.vna.chan)
+            bias_source.channel(self.bias_source.chan)
+            if self._vna_taken_over(lease):
+                self._setup_vna()
+            vna.output(True)
+            bias_source.output(True)
+            vna.soft_trig_arm()
         progress = 0
         t_start = time.time()
-        for bias_val in bias_vals:
-            # Perform measurement
-            bias_source.setpoint(bias_val)
-            S = vna.read_data()
-            # Handle thread abort signal
-            if self._abort:
-                self._abort = False
-                break
-            # Save data
-            d_array.append(S.reshape(1, len(S)))
-            r_array.append(array([bias_val]))
-            f.flush()
-            # Report progress and update plot
-            progress += progress_percent_step
-            self.q.put({'op': 'bias_sweep_progress', 'args': (progress, self.params.ch_id)})
-            if time.time()-t_start > min_plot_update_interval:
-                self.q.put({'op': 'update_bias_sweep_plot', 'args': (self.params.ch_id,)})
-                t_start = time.time()
-        bias_source.output(False)
-        vna.soft_trig_abort()
-        f.close()
+        # Data is written by a separate thread, so disk stalls don't hold the sweep.
+        # The file is flushed at least as often as the plot is updated.
+        with data_mgmt.HDF5Writer(f, flush_interval=min_plot_update_interval) as writer:
+            for bias_val in bias_vals:
+                # Perform measurement. The channels are selected again since
+                # the devices may have been used by other routines in between,
+                # which may have changed the VNA settings too.
+                with self._lease() as lease:
+                    vna.channel(self.vna.chan)
+                    bias_source.channel(self.bias_source.chan)
+                    if self._vna_taken_over(lease):
+                        self._setup_vna()
+                        vna.output(True)
+                        vna.soft_trig_arm()
+                    bias_source.setpoint(bias_val)
+                    S = vna.read_data()
+                # Handle thread abort signal
+                if self._abort:
+                    self._abort = False
+                    break
+                # Save data
+                writer.append(d_array, S.reshape(1, len(S)))
+                writer.append(r_array, array([bias_val]))
+                # Report progress and update plot
+                progress += progress_percent_step
+                self.q.put({'op': 'bias_sweep_progress', 'args': (progress, self.params.ch_id)})
+                if time.time()-t_start > min_plot_update_interval:
+                    self.q.put({'op': 'update_bias_sweep_plot', 'args': (self.params.ch_id,)})
+                    t_start = time.time()
+            with self._lease():
+                bias_source.channel(self.bias_source.chan)
+                bias_source.output(False)
+                vna.channel(self.vna.chan)
+                vna.soft_trig_abort()
         # Report sweep completion to the UI process
         self.q.put({'op': 'stop_bias_sweep', 'args': (self.params.ch_id,)})
\ No newline at end of file
@@ -0,0 +1,126 @@
+import multiprocessing as mp
+import queue
+
+from . import latency_trace
+
+# Commands executed before the other pending ones
+priority_ops = ('terminate', 'abort_optimization', 'abort_bias_sweep', 'stop_tracking')
+# Output setters are prioritized when they switch an output off
+output_ops = ('set_pump_output', 'set_bias_output')
+# Commands executed only when nothing else is pending
+background_ops = ('get_vna_data',)
+# Routine start commands and the commands stopping the routines. A stop cancels
+# the start of the routine of the same UI channel still pending.
+start_stop_ops = {'start_bias_sweep': 'abort_bias_sweep',
+                  'start_optimization': 'abort_optimization',
+                  'start_tracking': 'stop_tracking'}
+# Device connection commands. Commands queued after them are never moved ahead,
+# since they may address the device being connected.
+connection_ops = ('connect_pump_source', 'disconnect_pump_source',
+                  'connect_bias_source', 'disconnect_bias_source',
+                  'connect_vna', 'disconnect_vna')
+
+
+def command_ch_id(command: dict) -> int | None:
+    """UI channel of the command, the last argument or its ch_id for the start commands"""
+    args = command.get('args', ())
+    if not len(args):
+        return None
+    if isinstance(args[-1], dict):
+        return args[-1].get('ch_id')
+    return args[-1]
+
+
+class CommandScheduler:
+    """Picks the next command of the hardware process from all the queued ones.
+
+    Setters queued for the same parameter and UI channel are collapsed to the latest
+    value, and repeated data requests to one, so a held increment button drives the
+    instrument to the current value instead of replaying every step. Aborts and
+    switching outputs off go before the other pending commands, data requests after them,
+    but never before a routine start pending for the same UI channel. A routine stop
+    cancels the pending start of the routine instead.
+
+    Attributes:
+        n_executed (int): Number of commands returned by next().
+        n_dropped (int): Number of superseded commands dropped.
+        n_cancelled (int): Number of routine starts cancelled by a stop.
+    """
+    def __init__(self, q: mp.Queue):
+        self.q = q
+        self._pending: list[dict] = []
+        self.n_executed = 0
+        self.n_dropped = 0
+        self.n_cancelled = 0
+
+    @staticmethod
+    def _key(command: dict) -> tuple | None:
+        """Commands with the same key supersede each other."""
+        op = command['op']
+        if (op.startswith('set_') or op in background_ops) and len(command['args']):
+            return op, command['args'][-1]
+        return None
+
+    def _cancel_starts(self) -> None:
+        """Drops the routine starts followed by the stop of the routine"""
+        stops = {}
+        for i, command in enumerate(self._pending):
+            if command['op'] in start_stop_ops.values():
+                stops[(command['op'], command_ch_id(command))] = i
+        pending = []
+        for i, command in enumerate(self._pending):
+            stop = start_stop_ops.get(command['op'])
+            if stop is not None and stops.get((stop, command_ch_id(command)), -1) > i:
+                self.n_cancelled += 1
+                continue
+            pending.append(command)
+        self._pending = pending
+
+    @staticmethod
+    def _is_priority(command: dict) -> bool:
+        if command['op'] in priority_ops:
+            return True
+        return command['op'] in output_ops and not command['args'][0]
+
+    def _drain(self) -> None:
+        if not self._pending:
+            self._pending.append(self.q.get(block=True))
+            latency_trace.stamp(self._pending[-1], 't_dequeue')
+        try:
+            while True:
+                self._pending.append(self.q.get_nowait())
+                latency_trace.stamp(self._pending[-1], 't_dequeue')
+        except queue.Empty:
+            pass
+        latest = {}
+        for i, command in enumerate(self._pending):
+            key = self._key(command)
+            if key is not None:
+                latest[key] = i
+        pending = [command for i, command in enumerate(self._pending)
+                   if self._key(command) is None or latest[self._key(command)] == i]
+        self.n_dropped += len(self._pending) - len(pending)
+        self._pending = pending
+        self._cancel_starts()
+
+    def stats(self) -> tuple[int, int]:
+        """Numbers of the commands dropped and cancelled"""
+        return self.n_dropped, self.n_cancelled
+
+    def next(self) -> dict:
+        """Blocks until a command is available and returns the one to be executed next."""
+        self._drain()
+        i_next = None
+        starts = set()
+        for i, command in enumerate(self._pending):
+            if self._is_priority(command) and command_ch_id(command) not in starts:
+                i_next = i
+                break
+            if command['op'] in connection_ops:
+                break
+            if command['op'] in start_stop_ops:
+                starts.add(command_ch_id(command))
+        if i_next is None:
+            i_next = next((i for i, command in enumerate(self._pending) if command['op'] not in background_ops), 0)
+        self.n_executed += 1
+        return self._pending.pop(i_next)
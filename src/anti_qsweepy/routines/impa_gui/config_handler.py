@@ -60,6 +60,8 @@ class DefaultConfigFiles:
     bias_sweep_schema: Path = path/"bias_sweep_config_schema.json"
     optimization: Path = path/'optimization_config.yml'
     optimization_schema: Path = path/'optimization_config_schema.json'
+    tracking: Path = path/'tracking_config.yml'
+    tracking_schema: Path = path/'tracking_config_schema.json'
 
 
 @dataclass
@@ -68,6 +70,7 @@ class UserConfigFiles:
     config: Path
     bias_sweep: Path
     optimization: Path
+    tracking: Path
 
 
 class ConfigHandler:
@@ -81,12 +84,14 @@ class ConfigHandler:
         self.user_config_files = UserConfigFiles(path=pth,
                                                  config=pth/self.default_config_files.config.parts[-1],
                                                  bias_sweep=pth/self.default_config_files.bias_sweep.parts[-1],
-                                                 optimization=pth/self.default_config_files.optimization.parts[-1])
+                                                 optimization=pth/self.default_config_files.optimization.parts[-1],
+                                                 tracking=pth/self.default_config_files.tracking.parts[-1])
         if not pth.exists():
             pth.mkdir(parents=True)
             self._create_initial_config(pth)
             shutil.copy(self.default_config_files.bias_sweep, pth)
             shutil.copy(self.default_config_files.optimization, pth)
+            shutil.copy(self.default_config_files.tracking, pth)
             return
 
         if not self.user_config_files.config.exists():
@@ -98,6 +103,9 @@ class ConfigHandler:
         if not self.user_config_files.optimization.exists():
             shutil.copy(self.default_config_files.optimization, pth)
 
+        if not self.user_config_files.tracking.exists():
+            shutil.copy(self.default_config_files.tracking, pth)
+
     def _create_initial_config(self, pth: Path) -> None:
         shutil.copy(self.default_config_files.config, pth)
         yaml_inst = yaml.YAML()
@@ -128,6 +136,7 @@ class ConfigHandler:
         f_sch.close()
         self.load_bias_sweep_config()
         self.load_optimization_config()
+        self.load_tracking_config()
 
     def load_bias_sweep_config(self) -> None:
         yaml_inst = yaml.YAML()
@@ -183,11 +192,39 @@ class ConfigHandler:
             fill_map_from_object(optimization, optimization_config['channels'][ch_id]['parameters'])
         yaml_inst.dump(optimization_config, self.user_config_files.optimization)
 
+    def load_tracking_config(self) -> None:
+        yaml_inst = yaml.YAML()
+        config = yaml_inst.load(self.user_config_files.tracking)
+        f_sch = open(self.default_config_files.tracking_schema)
+        schema = json.load(f_sch)
+        validate(config, schema)
+        for ch_data in config['channels']:
+            try:
+                ch_id = self.ui_objects.channel_name_id[ch_data['name']]
+            except KeyError:
+                continue
+            tracking = self.ui_objects.channel_tabs[ch_id].chan.tracking
+            config_obj_from_dict(tracking, ch_data['parameters'])
+        f_sch.close()
+
+    def save_tracking_config(self) -> None:
+        yaml_inst = yaml.YAML()
+        tracking_config = yaml_inst.load(self.default_config_files.tracking)
+        n_ch = len(self.ui_objects.channel_tabs)
+        for ch_id in range(n_ch):
+            if ch_id:
+                tracking_config['channels'].append(copy.deepcopy(tracking_config['channels'][0]))
+            tracking = self.ui_objects.channel_tabs[ch_id].chan.tracking
+            tracking_config['channels'][ch_id]['name'] = self.ui_objects.channel_tabs[ch_id].chan.name
+            fill_map_from_object(tracking, tracking_config['channels'][ch_id]['parameters'])
+        yaml_inst.dump(tracking_config, self.user_config_files.tracking)
+
     def save_config(self) -> None:
         yaml_inst = yaml.YAML()
         config = yaml_inst.load(self.default_config_files.config)
         bias_sweep_config = yaml_inst.load(self.default_config_files.bias_sweep)
         optimization_config = yaml_inst.load(self.default_config_files.optimization)
+        tracking_config = yaml_inst.load(self.default_config_files.tracking)
         n_ch = len(self.ui_objects.channel_tabs)
         config['data_dir'] = self.ui_objects.data_folder
         config['tcp_ip_port'] = self.ui_objects.tcp_ip_port
@@ -196,6 +233,7 @@ class ConfigHandler:
                 config['channels'].append(copy.deepcopy(config['channels'][0]))
                 bias_sweep_config['channels'].append(copy.deepcopy(bias_sweep_config['channels'][0]))
                 optimization_config['channels'].append(copy.deepcopy(optimization_config['channels'][0]))
+                tracking_config['channels'].append(copy.deepcopy(tracking_config['channels'][0]))
             chan = self.ui_objects.channel_tabs[ch_id].chan
             fill_map_from_object(chan, config['channels'][ch_id])
             bias_sweep = self.ui_objects.channel_tabs[ch_id].chan.bias_sweep
@@ -204,6 +242,10 @@ class ConfigHandler:
             optimization = self.ui_objects.channel_tabs[ch_id].chan.optimization
             optimization_config['channels'][ch_id]['name'] = self.ui_objects.channel_tabs[ch_id].chan.name
             fill_map_from_object(optimization, optimization_config['channels'][ch_id]['parameters'])
+            tracking = self.ui_objects.channel_tabs[ch_id].chan.tracking
+            tracking_config['channels'][ch_id]['name'] = chan.name
+            fill_map_from_object(tracking, tracking_config['channels'][ch_id]['parameters'])
         yaml_inst.dump(config, self.user_config_files.config)
         yaml_inst.dump(bias_sweep_config, self.user_config_files.bias_sweep)
         yaml_inst.dump(optimization_config, self.user_config_files.optimization)
+        yaml_inst.dump(tracking_config, self.user_config_files.tracking)
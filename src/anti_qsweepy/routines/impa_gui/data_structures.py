@@ -5,9 +5,12 @@ from numpy.typing import ArrayLike
 import numpy as np
 import enum
 import re
+import copy
 
 from . import hdf5_gain
 from . import hdf5_bias_sweep
+from . import plot_updates
+from ..operating_point_store import OperatingPointStore
 
 
 @dataclass
@@ -295,6 +298,11 @@ class VNA(Device):
                                                                       value=False,
                                                                       enabled=True,
                                                                       instrumental=False))
+    live_view: BoolUIParameter = field(default_factory=
+                                       lambda: BoolUIParameter(name='Live view',
+                                                               value=True,
+                                                               enabled=True,
+                                                               instrumental=False))
     ref_data: np.ndarray[float, 2] | None = None
     normalize: BoolUIParameter = field(default_factory=
                                               lambda: BoolUIParameter(name='Normalize',
@@ -686,6 +694,156 @@ class Optimization(Routine):
                   min=0,
                   max=1000
               ))
+    # Two-stage evaluation with a fast pre-screen sweep
+    prescreen: BoolUIParameter = \
+        field(default_factory=
+              lambda: BoolUIParameter(
+                  name='Pre-screen',
+                  tooltip='Score trial vectors by a fast sweep first'
+              ))
+    prescreen_points: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Pre-scr. points',
+                  precision=1,
+                  unit=1,
+                  str_fmt='{:.0f}',
+                  min=3,
+                  max=10000,
+                  value=51
+              ))
+    prescreen_bandwidth: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Pre-scr. bw., Hz',
+                  precision=1,
+                  unit=1,
+                  str_fmt='{:.0f}',
+                  min=1,
+                  max=1000000,
+                  value=50000
+              ))
+    prescreen_tol: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Pre-scr. tol.',
+                  tooltip='Trial is rejected if its pre-screen cost exceeds (1 + tol) * parent cost',
+                  precision=0.01,
+                  unit=1,
+                  str_fmt='{:.2f}',
+                  min=0,
+                  max=1000,
+                  value=0.5
+              ))
+    segmented_sweep: BoolUIParameter = \
+        field(default_factory=
+              lambda: BoolUIParameter(
+                  name='Segmented sweep',
+                  tooltip='Measure gain and SNR within a single segmented sweep'
+              ))
+    settle_time: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Settle time, s',
+                  tooltip='Delay after setting bias and pump, the VNA sweeps other channels meanwhile',
+                  precision=0.001,
+                  unit=1,
+                  str_fmt='{:.3f}',
+                  min=0,
+                  max=100,
+                  value=0
+              ))
+    # SNR gain measurement at the found operating point
+    snr_rtol: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='SNR rel. tol.',
+                  tooltip='Stop averaging once the per point SNR gain relative error is below the tolerance, 0 to disable',
+                  precision=0.001,
+                  unit=1,
+                  str_fmt='{:.3f}',
+                  min=0,
+                  max=1,
+                  value=0
+              ))
+    spool_snr_traces: BoolUIParameter = \
+        field(default_factory=
+              lambda: BoolUIParameter(
+                  name='Save SNR traces',
+                  tooltip='Save raw SNR measurement traces to the data file'
+              ))
+    # Coarse gain map before the refinement
+    gain_map: BoolUIParameter = \
+        field(default_factory=
+              lambda: BoolUIParameter(
+                  name='Gain map',
+                  tooltip='Acquire a coarse bias x pump gain map first and optimize only in its best basins'
+              ))
+    map_bias_points: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Map bias points',
+                  precision=1,
+                  unit=1,
+                  str_fmt='{:.0f}',
+                  min=2,
+                  max=1000,
+                  value=21
+              ))
+    map_pump_points: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Map pump points',
+                  precision=1,
+                  unit=1,
+                  str_fmt='{:.0f}',
+                  min=2,
+                  max=1000,
+                  value=21
+              ))
+    map_basins: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Map basins',
+                  tooltip='Number of the best map basins to refine',
+                  precision=1,
+                  unit=1,
+                  str_fmt='{:.0f}',
+                  min=1,
+                  max=100,
+                  value=3
+              ))
+    # Noise-adaptive averaging of competing candidates
+    adaptive_averaging: BoolUIParameter = \
+        field(default_factory=
+              lambda: BoolUIParameter(
+                  name='Adaptive avg.',
+                  tooltip='Re-measure a trial and its parent with more averaging '
+                          'when their costs differ by less than the measurement noise'
+              ))
+    max_averages: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Max. averages',
+                  precision=1,
+                  unit=1,
+                  str_fmt='{:.0f}',
+                  min=1,
+                  max=1000,
+                  value=8
+              ))
+    noise_k: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Noise sigmas',
+                  tooltip='Cost difference below this number of standard deviations triggers re-measurement',
+                  precision=0.1,
+                  unit=1,
+                  str_fmt='{:.1f}',
+                  min=0,
+                  max=100,
+                  value=1
+              ))
 
     def target_frequency_mode_change(self) -> None:
         """on_change callback for target_frequency_mode selector.
@@ -702,6 +860,68 @@ class Optimization(Routine):
             self.target_frequency_step.enabled = True
 
 
+@dataclass
+class Tracking(Routine):
+    interval: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Interval, s',
+                  tooltip='Gain check interval',
+                  precision=0.1,
+                  unit=1,
+                  str_fmt='{:.1f}',
+                  min=0,
+                  max=100000,
+                  value=10
+              ))
+    gain_tol: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Gain tol., dB',
+                  tooltip='Operating point is corrected if RMS gain deviation exceeds the tolerance',
+                  precision=0.01,
+                  unit=1,
+                  str_fmt='{:.2f}',
+                  min=0.01,
+                  max=100,
+                  value=0.5
+              ))
+    bias_step: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Bias step, uA',
+                  precision=0.001,
+                  unit=1e-6,
+                  str_fmt='{:.3f}',
+                  min=0,
+                  max=1000,
+                  value=1e-6
+              ))
+    pump_step: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Pump step, dB',
+                  precision=0.001,
+                  unit=1,
+                  str_fmt='{:.3f}',
+                  min=0,
+                  max=10,
+                  value=0.05
+              ))
+    max_evals: FloatUIParam = \
+        field(default_factory=
+              lambda: FloatUIParam(
+                  name='Max. sweeps',
+                  tooltip='Maximum number of sweeps per correction',
+                  precision=1,
+                  unit=1,
+                  str_fmt='{:.0f}',
+                  min=1,
+                  max=1000,
+                  value=30
+              ))
+
+
 @dataclass
 class Channel:
     """Channel related data"""
@@ -711,6 +931,7 @@ class Channel:
     pump_source:    PumpSource = field(default_factory=lambda: PumpSource())
     bias_sweep:     BiasSweep = field(default_factory=lambda: BiasSweep())
     optimization:   Optimization = field(default_factory=lambda: Optimization())
+    tracking:       Tracking = field(default_factory=lambda: Tracking())
 
 
 @dataclass
@@ -852,13 +1073,20 @@ class ChannelTab:
     tab:               ui.tab = None
     gain_plot:         ui.plotly = None
     gain_file:         hdf5_gain.HDF5GainFile = None
-    gain_fig:          dict = field(default_factory=lambda: dict(default_gain_fig) )
+    gain_fig:          dict = field(default_factory=lambda: copy.deepcopy(default_gain_fig))
     gain_file_toolbar_enabled: bool = False
+    # Record of the gain file shown, see HDF5GainFile.get_data()
+    gain_file_data:    dict = None
+    # The file is being read
+    gain_file_loading: bool = False
     gain_plot_autoscale: bool = True
     bias_sweep_file:   hdf5_bias_sweep.HDF5BiasSweepFile = None
     bias_sweep_plot:   ui.plotly = None
-    bias_sweep_fig:    dict = field(default_factory=lambda: dict(default_bias_sweep_fig) )
+    bias_sweep_fig:    dict = field(default_factory=lambda: copy.deepcopy(default_bias_sweep_fig))
+    # Sends only the new columns of a growing sweep to the plot
+    bias_sweep_stream: plot_updates.HeatmapStream = field(default_factory=lambda: plot_updates.HeatmapStream())
     bias_sweep_file_toolbar_enabled:bool = False
+    bias_sweep_file_loading: bool = False
     bias_sweep_cb_min: FloatUIParam = field(default_factory=lambda: FloatUIParam(
         name='Colorbar min',
         precision=None,
@@ -875,6 +1103,19 @@ class ChannelTab:
         min=None,
         max=None
     ))
+    # Operating points database of the channel loaded for lookups
+    op_store:          OperatingPointStore = None
+    op_store_mtime:    float = 0
+    op_lookup_frequency: FloatUIParam = field(default_factory=lambda: FloatUIParam(
+        name='Fs, GHz',
+        tooltip='Set the operating point found for this signal frequency',
+        precision=1e-6,
+        unit=1e9,
+        str_fmt='{:.6f}',
+        min=0,
+        max=None,
+        value=6e9
+    ))
     chan:              Channel = field(default_factory=lambda: Channel())
     log:               ui.log = None
 
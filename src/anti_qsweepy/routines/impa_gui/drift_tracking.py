@@ -0,0 +1,156 @@
+import numpy as np
+import time
+import datetime
+import multiprocessing as mp
+from dataclasses import dataclass
+from pathlib import Path
+
+from .phy_devices import PhyDevice
+
+
+@dataclass
+class TrackingParameters:
+    ch_id: int
+    interval: float  # s
+    gain_tol: float  # dB
+    bias_step: float  # A
+    pump_step: float  # dB
+    max_evals: int
+    save_path: str
+
+
+class DriftTracker:
+    """Keeps an amplifier at its operating point.
+
+    The gain profile measured when tracking starts is the target. Every interval seconds
+    the gain is checked, using a live view sweep if one is due or a sweep of its own, and
+    if its RMS deviation from the target exceeds gain_tol a coordinate search with shrinking
+    steps is done around the current bias current and pump power.
+    """
+    def __init__(self, bias_source: PhyDevice,
+                 pump_source: PhyDevice,
+                 vna: PhyDevice,
+                 q: mp.Queue,
+                 params: TrackingParameters):
+        self.q = q
+        self.vna = vna
+        self.bias_source = bias_source
+        self.pump_source = pump_source
+        self.params = params
+        self.log_path = Path(params.save_path)/'tracking_log.txt'
+        self._ref: np.ndarray | None = None
+        self._freq: np.ndarray | None = None
+        self._target: np.ndarray | None = None
+        self._last_check = 0.
+
+    def reset(self) -> None:
+        """Forget the reference and the target, e.g. when the VNA settings have changed."""
+        self._ref = None
+        self._target = None
+
+    def reset_target(self) -> None:
+        """Take the next measured gain as the new target, e.g. after manual adjustment."""
+        self._target = None
+
+    def due(self) -> bool:
+        return time.time() - self._last_check >= self.params.interval
+
+    def _log(self, msg: str) -> None:
+        self.q.put({'op': 'log_push', 'args': (msg, self.params.ch_id)})
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.log_path, 'a') as f:
+            f.write(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + '\t' + msg + '\n')
+
+    def _read(self) -> np.ndarray:
+        vna = self.vna.dev_inst
+        vna.channel(self.vna.chan)
+        return vna.read_data()
+
+    def _measure_ref(self) -> None:
+        pump = self.pump_source.dev_inst
+        pump.channel(self.pump_source.chan)
+        pump.output(False)
+        self._ref = self._read()
+        pump.output(True)
+        self._freq = self.vna.dev_inst.freq_points()
+        self._target = None
+
+    def _gain(self, data: np.ndarray) -> np.ndarray:
+        return 20*np.log10(np.abs(data/self._ref))
+
+    def _deviation(self, data: np.ndarray) -> float:
+        return float(np.sqrt(np.mean((self._gain(data) - self._target)**2)))
+
+    def _set_point(self, bias: float, pump_power: float) -> None:
+        self.bias_source.dev_inst.channel(self.bias_source.chan)
+        self.bias_source.dev_inst.setpoint(bias)
+        self.pump_source.dev_inst.channel(self.pump_source.chan)
+        self.pump_source.dev_inst.power(pump_power)
+
+    def _evaluate(self, x: np.ndarray) -> float:
+        self._set_point(x[0], x[1])
+        return self._deviation(self._read())
+
+    def check(self, freq: np.ndarray | None = None, data: np.ndarray | None = None) -> None:
+        """Checks the gain and corrects the operating point if needed.
+
+        Args:
+            freq: Frequency points of a live view sweep taken at the current operating point.
+            data: Complex S21 of that sweep. A new sweep is done if None.
+        """
+        self._last_check = time.time()
+        if freq is None or data is None:
+            self.vna.dev_inst.channel(self.vna.chan)
+            freq = self.vna.dev_inst.freq_points()
+            data = self._read()
+        if self._ref is None or len(freq) != len(self._freq) or np.any(freq != self._freq):
+            self._measure_ref()
+            self._log("Tracking: pump off reference measured")
+            return
+        if len(data) != len(self._ref):
+            return
+        if self._target is None:
+            self._target = self._gain(data)
+            self._log("Tracking: target gain {:.2f} dB".format(np.mean(self._target)))
+            return
+        dev = self._deviation(data)
+        if dev <= self.params.gain_tol:
+            return
+        self._correct(dev)
+
+    def _correct(self, dev: float) -> None:
+        self.bias_source.dev_inst.channel(self.bias_source.chan)
+        self.pump_source.dev_inst.channel(self.pump_source.chan)
+        x0 = np.array([self.bias_source.dev_inst.setpoint(), self.pump_source.dev_inst.power()])
+        x = x0.copy()
+        step = np.array([self.params.bias_step, self.params.pump_step])
+        cost = dev
+        n_evals = 0
+        t0 = time.time()
+        # Coordinate search, steps are halved when no move improves the deviation
+        while n_evals < self.params.max_evals and cost > self.params.gain_tol/2:
+            improved = False
+            for i in range(len(x)):
+                for sign in (1, -1):
+                    trial = x.copy()
+                    trial[i] += sign*step[i]
+                    trial_cost = self._evaluate(trial)
+                    n_evals += 1
+                    if trial_cost < cost:
+                        x, cost = trial, trial_cost
+                        improved = True
+                        break
+                    if n_evals >= self.params.max_evals:
+                        break
+                if n_evals >= self.params.max_evals:
+                    break
+            if not improved:
+                step /= 2
+        if cost >= dev:
+            x, cost = x0, dev
+        self._set_point(x[0], x[1])
+        self._log("Tracking: gain deviation {:.2f} dB -> {:.2f} dB in {:d} sweeps, {:.1f} s. "
+                  "I: {:.4f} -> {:.4f} mA, Pp: {:.2f} -> {:.2f} dBm".format(dev, cost, n_evals, time.time() - t0,
+                                                                              x0[0]/1e-3, x[0]/1e-3, x0[1], x[1]))
+        self.q.put({'op': 'set_bias_current', 'args': (float(x[0]), self.params.ch_id)})
+        self.q.put({'op': 'set_pump_power', 'args': (float(x[1]), self.params.ch_id)})
@@ -1,23 +1,80 @@
 import multiprocessing as mp
 import traceback as tb
+import queue
+import time
 import numpy.typing as nt
 from typing import Any
 import numpy as np
-from dataclasses import fields
+from dataclasses import dataclass, fields
+
+from nicegui import background_tasks
 
 from . import data_structures as ds
 from . import ui_callbacks as ui_cb
+from .trace_ring import TraceRing
+from . import plot_updates
+
+
+# Feedback superseded by a later message of the same kind for the same UI channel
+coalesced_ops = ('update_gain_plot',
+                 'update_gain_plot_from_ring',
+                 'bias_sweep_progress',
+                 'update_bias_sweep_plot')
+
+
+@dataclass
+class FeedbackMetrics:
+    queue_depth: int = 0  # Messages waiting after the last tick, in the queue and the backlog
+    max_queue_depth: int = 0
+    batch_size: int = 0  # Messages taken by the last tick, with the backlog
+    max_batch_size: int = 0
+    n_ticks: int = 0
+    n_overruns: int = 0  # Ticks exceeding the time budget
+    n_processed: int = 0
+    n_coalesced: int = 0  # Dropped superseded messages and merged log lines
+    tick_time: float = 0.  # Processing time of the last tick, s
+    # Time from sending to processing, exponential moving average, s. Measured on the
+    # trace spans, i.e. while latency tracing is enabled.
+    latency: float = 0.
+    max_latency: float = 0.
+    # HW process command scheduler counts, see CommandScheduler
+    hw_dropped: int = 0
+    hw_cancelled: int = 0
+
+    def summary(self) -> str:
+        return ("Feedback: {:d} processed, {:d} coalesced, queue {:d} (max {:d}), batch {:d} (max {:d}), "
+                "{:d} of {:d} ticks over budget, latency {:.1f} ms (max {:.1f} ms)".format(
+                    self.n_processed, self.n_coalesced, self.queue_depth, self.max_queue_depth,
+                    self.batch_size, self.max_batch_size, self.n_overruns, self.n_ticks,
+                    self.latency*1e3, self.max_latency*1e3))
+
+    def scheduler_summary(self) -> str:
+        return "HW commands: {:d} superseded dropped, {:d} routine starts cancelled".format(
+            self.hw_dropped, self.hw_cancelled)
 
 
 class FeedbackProcessor:
+    # Time budget of a check_queue() call, s
+    tick_budget = 0.005
+    # Maximum number of messages taken from the queue per call
+    max_batch = 1000
+    # Live trace decimation for display, see plot_updates.decimate()
+    gain_plot_points = plot_updates.default_trace_points
+    gain_plot_decimation = 'minmax'
+
     def __init__(self, q_feedback: mp.Queue,
                  q_command: mp.Queue,
                  ui_objects: ds.UiObjects,
-                 cb: ui_cb.UiCallbacks):
+                 cb: ui_cb.UiCallbacks,
+                 trace_ring: TraceRing | None = None):
         self.ui_objects = ui_objects
+        self.trace_ring = trace_ring
         self.q_command = q_command
         self.q_feedback = q_feedback
         self.cb = cb
+        self.metrics = FeedbackMetrics()
+        # Messages taken from the queue but not processed within the time budget
+        self._backlog: list[dict] = []
 
     @staticmethod
     def _connect_device(dev: ds.Device) -> None:
@@ -87,6 +144,19 @@ class FeedbackProcessor:
                 ch.bias_sweep.is_running.enabled = not val
                 ch.optimization.is_running.enabled = not val
 
+    def _update_optimization_ui_lock(self) -> None:
+        """Locks devices while any optimization is running. Optimizations at the other channels
+        can still be started since they share devices through the measurement scheduler,
+        unless they use the same bias or pump source channel, see UiCallbacks.start_stop_optimization."""
+        running = [ch_id for ch_id, tab in enumerate(self.ui_objects.channel_tabs)
+                   if tab.chan.optimization.is_running.value]
+        if len(running):
+            self._set_global_ui_lock(True, running[0])
+            for tab in self.ui_objects.channel_tabs:
+                tab.chan.optimization.is_running.enabled = True
+        else:
+            self._set_global_ui_lock(False, -1)
+
     def set_vna_measurement_type(self, val: str, ch_id: int) -> None:
         self._update_param(self.ui_objects.channel_tabs[ch_id].chan.vna.measurement_type, val)
 
@@ -122,13 +192,16 @@ class FeedbackProcessor:
                 data[1] = data[1]-ref
         else:
             vna.ref_data = data
-        fig = tab.gain_fig
-        trace_id = self.ui_objects.gain_plot_traces.vna_s21
-        fig['data'][trace_id]['x'] = list(data[0]/1e9)
-        fig['data'][trace_id]['y'] = list(data[1])
-        fig['data'][trace_id]['name'] = 'VNA S21'
-        #tab.gain_plot.run_method('Plotly.restyle', (str(tab.gain_plot.id), {}))
-        tab.gain_plot.update()
+        # Only the decimated live trace is sent to the browser
+        x, y = plot_updates.decimate(data[0]/1e9, data[1], self.gain_plot_points, self.gain_plot_decimation)
+        plot_updates.update_trace(tab.gain_plot, tab.gain_fig, self.ui_objects.gain_plot_traces.vna_s21,
+                                  x, y, 'VNA S21')
+
+    def update_gain_plot_from_ring(self, slot: int, seq: int, ch_id: int) -> None:
+        data = self.trace_ring.read(slot, seq)
+        # The slot is overwritten if the UI falls behind, then the frame is dropped
+        if data is not None:
+            self.update_gain_plot(data, ch_id)
 
     def start_bias_sweep(self, ch_id: int) -> None:
         ch = self.ui_objects.channel_tabs[ch_id].chan
@@ -144,10 +217,11 @@ class FeedbackProcessor:
         ch.bias_sweep.progress = np.round(val)
 
     def update_bias_sweep_plot(self, ch_id: int) -> None:
-        self.cb.update_bias_sweep_plot_from_file(ch_id)
+        # The file is read off the event loop
+        background_tasks.create(self.cb.update_bias_sweep_plot_from_file(ch_id))
 
     def open_bias_sweep_file(self, path: str, ch_id: int) -> None:
-        self.cb.open_bias_sweep_file(path, ch_id)
+        background_tasks.create(self.cb.open_bias_sweep_file(path, ch_id))
 
     def stop_bias_sweep(self, ch_id: int) -> None:
         ch = self.ui_objects.channel_tabs[ch_id].chan
@@ -175,7 +249,7 @@ class FeedbackProcessor:
         ch.optimization.set_parameters_enable(False)
         ch.bias_sweep.is_running.enabled = False
         ch.bias_sweep.set_parameters_enable(False)
-        self._set_global_ui_lock(True, ch_id)
+        self._update_optimization_ui_lock()
         log.push("Optimization started at {:s}".format(ch.name))
 
     def stop_optimization(self, ch_id: int) -> None:
@@ -187,9 +261,25 @@ class FeedbackProcessor:
         ch.bias_sweep.is_running.enabled = True
         ch.bias_sweep.set_parameters_enable(True)
         # TODO add devices settings download from the instruments
-        self._set_global_ui_lock(False, ch_id)
+        self._update_optimization_ui_lock()
         log.push("Optimization stopped at {:s}".format(ch.name))
 
+    def start_tracking(self, ch_id: int) -> None:
+        ch = self.ui_objects.channel_tabs[ch_id].chan
+        log = self.ui_objects.channel_tabs[ch_id].log
+        ch.tracking.is_running.update(True)
+        ch.tracking.is_running.enabled = True
+        ch.tracking.set_parameters_enable(False)
+        log.push("Tracking started at {:s}".format(ch.name))
+
+    def stop_tracking(self, ch_id: int) -> None:
+        ch = self.ui_objects.channel_tabs[ch_id].chan
+        log = self.ui_objects.channel_tabs[ch_id].log
+        ch.tracking.is_running.update(False)
+        ch.tracking.is_running.enabled = True
+        ch.tracking.set_parameters_enable(True)
+        log.push("Tracking stopped at {:s}".format(ch.name))
+
     @staticmethod
     def _update_param(p: ds.UIParameter, val: Any):
         p.update(val)
@@ -203,17 +293,81 @@ class FeedbackProcessor:
                 self.cb.setup_devices()
                 self.ui_objects.app_state = ds.AppState.initialization_done
 
-        if not self.q_feedback.empty():
-            command = self.q_feedback.get()
-            if command['op'] != "update_gain_plot":
-                print("Main process got feedback: ", command['op'],command['args'])
-            else:
-                pass
-                #print("Main process got feedback: ", command['op'])
-            try:
-                getattr(self, command['op'])(*command['args'])
-            except Exception as err:
-                tb.print_exc()
+        t0 = time.time()
+        batch = self._backlog
+        try:
+            while len(batch) < self.max_batch:
+                batch.append(self.q_feedback.get_nowait())
+        except queue.Empty:
+            pass
+        self.metrics.batch_size = len(batch)
+        self.metrics.max_batch_size = max(self.metrics.max_batch_size, len(batch))
+        try:
+            batch = self._coalesce(batch)
+        except Exception:
+            # Processed as they are rather than stuck in the backlog
+            tb.print_exc()
+        n = 0
+        try:
+            for command in batch:
+                if n and time.time() - t0 > self.tick_budget:
+                    break
+                n += 1
+                if command['op'] not in coalesced_ops and command['op'] not in ('trace_span', 'scheduler_stats'):
+                    print("Main process got feedback: ", command['op'],command['args'])
+                try:
+                    getattr(self, command['op'])(*command['args'])
+                except Exception:
+                    tb.print_exc()
+        finally:
+            # The backlog advances past the messages taken whatever happens
+            for command in batch[:n]:
+                if 't' in command:
+                    latency = time.time() - command['t']
+                    self.metrics.latency += 0.1*(latency - self.metrics.latency)
+                    self.metrics.max_latency = max(self.metrics.max_latency, latency)
+            self._backlog = batch[n:]
+        self.metrics.n_processed += n
+        self.metrics.tick_time = time.time() - t0
+        self.metrics.n_ticks += 1
+        if self.metrics.tick_time > self.tick_budget:
+            self.metrics.n_overruns += 1
+        try:
+            depth = self.q_feedback.qsize()
+        except NotImplementedError:
+            depth = 0
+        self.metrics.queue_depth = depth + len(self._backlog)
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, self.metrics.queue_depth)
+
+    def _coalesce(self, batch: list[dict]) -> list[dict]:
+        """Drops messages superseded by a later one of the same kind for the same channel
+        and merges consecutive log lines of a channel."""
+        latest = {}
+        for i, command in enumerate(batch):
+            if command['op'] in coalesced_ops:
+                latest[(command['op'], command['args'][-1])] = i
+        res = []
+        for i, command in enumerate(batch):
+            if command['op'] in coalesced_ops and latest[(command['op'], command['args'][-1])] != i:
+                continue
+            if command['op'] == 'log_push' and res and res[-1]['op'] == 'log_push' and \
+                    res[-1]['args'][1] == command['args'][1] and \
+                    isinstance(res[-1]['args'][0], str) and isinstance(command['args'][0], str):
+                msg = res[-1]['args'][0]
+                if not msg.endswith('\n'):
+                    msg += '\n'
+                res[-1] = dict(res[-1], args=(msg + command['args'][0], command['args'][1]))
+                continue
+            res.append(command)
+        self.metrics.n_coalesced += len(batch) - len(res)
+        return res
+
+    def scheduler_stats(self, n_dropped: int, n_cancelled: int) -> None:
+        self.metrics.hw_dropped = n_dropped
+        self.metrics.hw_cancelled = n_cancelled
+
+    def trace_span(self, op: str, ui_ch: int | None, trace: dict) -> None:
+        self.cb.tracer.add(op, ui_ch, trace)
 
     def log_push(self, msg: str, ch_id):
         log = self.ui_objects.channel_tabs[ch_id].log
@@ -16,13 +16,50 @@ class HDF5BiasSweepFile(tables.File):
         self.i_unit = 1e-3
         #Time unit is ns
         self.t_unit = 1e-9
-        
+        # Rows processed so far. A file growing during a sweep is read incrementally:
+        # delay is computed row by row, so only the new rows are read and processed.
+        self._rows_read = 0
+        self._c_coord: np.ndarray | None = None
+        self._current = np.zeros(0)
+        self._delay = np.zeros((0, 0))
+
+    def adopt_cache(self, other: 'HDF5BiasSweepFile') -> None:
+        """Takes over the rows already processed by another instance of the same file,
+        which is reopened to see the rows appended since."""
+        if other.filename != self.filename or other._c_coord is None:
+            return
+        self._rows_read = other._rows_read
+        self._c_coord = other._c_coord
+        self._current = other._current
+        self._delay = other._delay
+
+    def _append_rows(self, current: np.ndarray, delay: np.ndarray) -> None:
+        n = self._rows_read + len(current)
+        if n > len(self._current):
+            # Grow the buffers geometrically to keep appends amortized O(1) per row
+            capacity = max(n, 2*len(self._current), 16)
+            self._current = np.resize(self._current, capacity)
+            old_delay = self._delay
+            self._delay = np.zeros((capacity, delay.shape[1]))
+            if self._rows_read:
+                self._delay[:self._rows_read] = old_delay[:self._rows_read]
+        self._current[self._rows_read:n] = current
+        self._delay[self._rows_read:n] = delay
+        self._rows_read = n
+
     def get_data(self) -> dict:
         try:
             root = self.root
-            data_2d = np.array(root.data[:])
-            c_coord = np.array(root.column_coordinate[:])
-            r_coord = np.array(root.row_coordinate[:])
+            # Rows and their coordinates are appended separately
+            n_rows = min(root.data.nrows, root.row_coordinate.nrows)
+            if n_rows < self._rows_read:
+                # File was rewritten
+                self._rows_read = 0
+                self._c_coord = None
+            if self._c_coord is None:
+                self._c_coord = np.array(root.column_coordinate[:])
+            data_2d = np.array(root.data[self._rows_read:n_rows])
+            r_coord = np.array(root.row_coordinate[self._rows_read:n_rows])
         except tables.exceptions.NoSuchNodeError as err:
             traceback.print_exc()
             return {'frequency': None,
@@ -31,14 +68,16 @@ class HDF5BiasSweepFile(tables.File):
                     'status': False,
                     'message': 'Wrong file structure!'}
         else:
+            c_coord = self._c_coord
             if len(r_coord):
-                data_2d_norm = data_2d/data_2d[0]
                 uPh = np.unwrap(np.angle(data_2d))
                 uPh_filt = ss.savgol_filter(uPh, self.savgol_filt_wind, self.savgol_filt_order)
                 delay = -np.diff(uPh_filt)/((c_coord[1]-c_coord[0])*2.*np.pi)
+                self._append_rows(r_coord, delay)
+            if self._rows_read:
                 return {'frequency': c_coord[:-1] / self.f_unit,
-                        'current': r_coord / self.i_unit,
-                        'delay': (delay / self.t_unit).T,
+                        'current': self._current[:self._rows_read] / self.i_unit,
+                        'delay': (self._delay[:self._rows_read] / self.t_unit).T,
                         'status': True,
                         'message': 'Success!'}
             else:
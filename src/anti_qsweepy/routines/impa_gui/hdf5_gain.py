@@ -1,11 +1,20 @@
 from tables import File, exceptions
 import numpy as np
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, Future
 
 db = lambda x: 20*np.log10(x)
 
 
 class HDF5GainFile(File):
-    def __init__(self, *args, **kwargs) -> None:
+    """Tuning results file browsed record by record.
+
+    Only the displayed record is read from the file. Decoded records are kept in a
+    small LRU cache and the neighbours of the displayed record are read in background,
+    so browsing forward and backward doesn't wait for the disk.
+    """
+    def __init__(self, *args, cache_size: int = 16, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.n_records = 0
         try:
@@ -20,17 +29,62 @@ class HDF5GainFile(File):
         self.Pp = 0
         self.Ib = 0
         self.Gsnr = 0
-    
+        self._thumbnail: np.ndarray | None = None
+        self.cache_size = cache_size
+        self._cache: collections.OrderedDict[int, tuple] = collections.OrderedDict()
+        # The file isn't thread safe, reads of the displayed and prefetched records are serialized
+        self._lock = threading.Lock()
+        self._prefetch: dict[int, Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def close(self) -> None:
+        # Also called by PyTables if the file fails to open
+        if hasattr(self, '_executor'):
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        super().close()
+
+    def thumbnail(self) -> np.ndarray:
+        """Operating points of all the records. Read once, the file is opened for reading."""
+        if self._thumbnail is None:
+            with self._lock:
+                self._thumbnail = self.root.thumbnail.read()
+        return self._thumbnail
+
+    def _read_record(self, n: int) -> tuple:
+        """Reads the arrays of the record n, row by row."""
+        with self._lock:
+            row = self.root.thumbnail[n]
+            return (self.root.s21_on[n],
+                    self.root.s21_off_snr[n],
+                    self.root.snr_gain[n],
+                    self.root.snr_freq[n],
+                    row['Fs'], row['Pp'], row['I'], row['Gsnr'])
+
+    def _get_record(self, n: int) -> tuple:
+        if n in self._cache:
+            self._cache.move_to_end(n)
+            return self._cache[n]
+        future = self._prefetch.pop(n, None)
+        record = future.result() if future is not None else self._read_record(n)
+        self._cache[n] = record
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return record
+
+    def _prefetch_neighbours(self, group_n: int) -> None:
+        # Forget finished prefetches the user browsed away from
+        for n in [n for n, f in self._prefetch.items() if f.done() and abs(n - group_n) > 1]:
+            del self._prefetch[n]
+        for n in (group_n + 1, group_n - 1):
+            if 0 <= n < self.n_records and n not in self._cache and n not in self._prefetch:
+                self._prefetch[n] = self._executor.submit(self._read_record, n)
+
     def get_data(self) -> dict:
+        # The record may be browsed while this one is read in another thread
+        group_n = self.group_n
         try:
-            s21_on = np.array(self.root.s21_on)[self.group_n]
-            s21_off_snr = np.array(self.root.s21_off_snr)[self.group_n]
-            snr_gain = np.array(self.root.snr_gain)[self.group_n]
-            snr_freq = np.array(self.root.snr_freq)[self.group_n]
-            self.Fs = self.root.thumbnail[self.group_n]['Fs']
-            self.Pp = self.root.thumbnail[self.group_n]['Pp']
-            self.Ib = self.root.thumbnail[self.group_n]['I']
-            self.Gsnr = self.root.thumbnail[self.group_n]['Gsnr']
+            s21_on, s21_off_snr, snr_gain, snr_freq, self.Fs, self.Pp, self.Ib, self.Gsnr = \
+                self._get_record(group_n)
         except (exceptions.NoSuchNodeError, IndexError) as err:
             # traceback.print_exc()
             return {'Fs': None,
@@ -45,12 +99,13 @@ class HDF5GainFile(File):
                     'message': 'File is empty or has wrong structure! Node {0} is missing.'.format(err.args[0])}
 
         info_string = ("{:d}:Fc={:.4f}GHz Pp={:.2f}dBm I={:.4f}mA".
-                       format(self.group_n,
+                       format(group_n,
                               self.Fs/self.f_unit,
                               self.Pp,
                               self.Ib/self.i_unit,
                               self.Gsnr))
 
+        self._prefetch_neighbours(group_n)
         gain = abs(s21_on/s21_off_snr)
         return {'Fs': self.Fs/self.f_unit,
                 'Pp': self.Pp,
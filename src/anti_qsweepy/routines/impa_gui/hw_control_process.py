@@ -1,4 +1,5 @@
 import multiprocessing as mp
+import threading
 import time
 import traceback as tb
 import numpy as np
@@ -10,50 +11,102 @@ from typing import Any
 from ... import drivers as drv
 from .bias_sweep import BiasSweepParameters, BiasSweep
 from .optimization import OptimizationParameters, Optimization
+from .measurement_scheduler import ScheduledDevice, vna_state_methods
+from .resource_manager import ResourceManager, Lease
+from .drift_tracking import TrackingParameters, DriftTracker
 from .phy_devices import PhyDevice, BiasSource, PumpSource, VNA
+from .trace_ring import TraceRing
+from .command_scheduler import CommandScheduler, command_ch_id
+from .live_view import LiveViewStreamer
+from . import latency_trace
 
 
-def hw_process(q_command: mp.Queue, q_feedback: mp.Queue) -> None:
+def hw_process(q_command: mp.Queue, q_feedback: mp.Queue, trace_ring_name: str | None = None) -> None:
     """ Hardware control process
     """
-    hwcp = HWCommandProcessor(q_feedback)
+    hwcp = HWCommandProcessor(q_feedback, trace_ring_name)
+    scheduler = CommandScheduler(q_command)
     print("HW process started")
+    # Scheduler counts last reported to the UI, sent when commands are dropped or cancelled
+    reported = scheduler.stats()
     try:
         while True:
-            command = q_command.get(block=True)
+            command = scheduler.next()
+            if scheduler.stats() != reported:
+                reported = scheduler.stats()
+                hwcp.q.put({'op': 'scheduler_stats', 'args': reported})
             if command['op'] != 'get_vna_data':
                 print("HW process got command: ", command['op'], command['args'])
             if command['op'] == 'terminate':
                 break
+            latency_trace.stamp(command, 't_start')
+            result = None
             try:
-                getattr(hwcp, command['op'])(*command['args'])
+                result = getattr(hwcp, command['op'])(*command['args'])
             except Exception as err:
                 tb.print_exc()
+            if 'trace' in command:
+                if isinstance(result, Future):
+                    # Command handed over to a worker thread, executed until the future is done
+                    result.add_done_callback(lambda future, command=command: _end_trace_span(hwcp.q, command))
+                else:
+                    _end_trace_span(hwcp.q, command)
     except KeyboardInterrupt:
         pass
+    hwcp.stop_live_view()
+    hwcp.stop_tracking_timer()
+    if hwcp.trace_ring is not None:
+        hwcp.trace_ring.close()
     print("HW process terminated")
 
 
-@dataclass
-class VNAReadDataFuture:
-    """VNA data acquisition thread future
-    """
-    future: Future
-    ui_ch: int
+def _end_trace_span(q: 'FeedbackQueue', command: dict) -> None:
+    """Stamps the end of the execution of a traced command and sends its time span to the UI"""
+    command['trace']['t_end'] = time.time()
+    q.put({'op': 'trace_span', 'args': (command['op'], command_ch_id(command), command['trace'])})
+
+
+class FeedbackQueue:
+    """Feedback queue stamping the messages carrying a trace with the time they are sent.
+    Trace spans are sent only while latency tracing is enabled, see LatencyTracer."""
+    def __init__(self, q: mp.Queue):
+        self._q = q
+
+    def put(self, msg: dict, *args, **kwargs) -> None:
+        if msg['op'] == 'trace_span':
+            msg['t'] = time.time()
+        self._q.put(msg, *args, **kwargs)
 
 
 class HWCommandProcessor:
-    def __init__(self, q_feedback: mp.Queue):
-        self.q = q_feedback
+    # Interval of the drift tracking due checks, s
+    tracking_poll_interval = 0.5
+
+    def __init__(self, q_feedback: mp.Queue, trace_ring_name: str | None = None):
+        self.q = FeedbackQueue(q_feedback)
+        # Shared memory for the live view traces, created by the UI process
+        self.trace_ring: TraceRing | None = None if trace_ring_name is None else TraceRing(trace_ring_name)
         # Physical devices bind to a particular UI channel identified by int channel id keys
         self.vna: dict[int, VNA] = {}
         self.bias_source: dict[int, BiasSource] = {}
         self.pump_source: dict[int, PumpSource] = {}
         # Executor for multiple threads
         self.executor = ThreadPoolExecutor(max_workers=10)
-        self.vna_read_data_future: Future | None = None  # VNA data acquisition thread
+        self.vna_read_data_future: Future | None = None  # Single VNA data acquisition thread
+        # Live view state of the UI channels and continuous acquisition workers
+        # of the physical VNAs, keyed by driver name and address
+        self.live_view: dict[int, bool] = {}
+        self.streamers: dict[tuple[str, str], LiveViewStreamer] = {}
         self.bias_sweeps: dict[int, BiasSweep] = {}
         self.optimization: dict[int, Optimization] = {}
+        # Leases on the physical devices, keyed by driver name and address
+        self.resources = ResourceManager()
+        self.trackers: dict[int, DriftTracker] = {}
+        # Trackers waiting for a routine using their devices to finish
+        self._trackers_paused: set[int] = set()
+        self._tracking_stop = threading.Event()
+        self._tracking_thread = threading.Thread(target=self._tracking_loop, name='DriftTracking', daemon=True)
+        self._tracking_thread.start()
 
     def _connect_device(self, device_dict: dict[int, PhyDevice],
                         driver_name: str,
@@ -161,12 +214,50 @@ class HWCommandProcessor:
                             tb.print_exc()
         return ui_ch_list
 
-    def _stop_read_data_if_running(self, ui_ch: int):
-        phy_dev = self.vna[ui_ch]
-        """Check vna.read_data thread and stop if running"""
-        if self.vna_read_data_future is not None:
-            if self.vna_read_data_future.running():
-                phy_dev.dev_inst.abort()
+    def _shared_device(self, phy_dev: PhyDevice, state_methods: tuple = ()) -> ScheduledDevice:
+        """Returns a proxy to a physical device which can be used concurrently with other routines"""
+        return self.resources.scheduler(self._key(phy_dev), phy_dev.dev_inst, state_methods).client(phy_dev.chan)
+
+    @staticmethod
+    def _key(phy_dev: PhyDevice) -> tuple[str, str]:
+        return phy_dev.driver_name, phy_dev.addr
+
+    def _lease(self, *phy_devs: PhyDevice) -> Lease:
+        """Lease on the physical devices, held while calling them directly"""
+        return self.resources.lease(*[self._key(phy_dev) for phy_dev in phy_devs])
+
+    def _reset_tracking(self, ui_ch_list: list[int]) -> None:
+        """Invalidate drift tracking reference after VNA settings change"""
+        for ui_ch in ui_ch_list:
+            if ui_ch in self.trackers.keys():
+                self.trackers[ui_ch].reset()
+
+    def _reset_tracking_target(self, ui_ch: int) -> None:
+        """Track the operating point set manually"""
+        if ui_ch in self.trackers.keys():
+            self.trackers[ui_ch].reset_target()
+
+    def _vna_access(self, phy_dev: PhyDevice) -> Lease:
+        """Lease on the VNA taken without waiting for the live view sweep in progress"""
+        streamer = self.streamers.get(self._key(phy_dev))
+        if streamer is not None:
+            streamer.interrupt()
+        return self._lease(phy_dev)
+
+    def _live_view_paused(self, *phy_devs: PhyDevice) -> Lease:
+        """Lease on the devices of a measurement routine while it starts, the live view
+        sweeps in progress on them are interrupted. The other VNAs keep streaming."""
+        for phy_dev in phy_devs:
+            streamer = self.streamers.get(self._key(phy_dev))
+            if streamer is not None:
+                streamer.interrupt()
+        return self._lease(*phy_devs)
+
+    def _measurement_running(self, key: tuple[str, str]) -> bool:
+        """Live view of the VNA identified by key is suspended while a bias sweep
+        or an optimization uses it"""
+        routines = list(self.bias_sweeps.values()) + list(self.optimization.values())
+        return any(not r.future.done() and self._key(r.vna) == key for r in routines)
 
     def connect_pump_source(self, driver_name: str, class_name: str, address: str, ch: int, ui_ch: int) -> None:
         status, ui_ch_list = self._connect_device(self.pump_source, driver_name, class_name, address, ch, ui_ch)
@@ -184,21 +275,26 @@ class HWCommandProcessor:
 
     def set_pump_output(self,val: bool, ui_ch: int) -> None:
         phy_dev = self.pump_source[ui_ch]
-        phy_dev.dev_inst.channel(phy_dev.chan)
-        val = phy_dev.dev_inst.output(val)
+        with self._lease(phy_dev):
+            phy_dev.dev_inst.channel(phy_dev.chan)
+            val = phy_dev.dev_inst.output(val)
         self.q.put({'op': 'set_pump_output', 'args': (val, ui_ch)})
 
     def set_pump_power(self, val:float, ui_ch: int) -> None:
         phy_dev = self.pump_source[ui_ch]
-        phy_dev.dev_inst.channel(phy_dev.chan)
-        val = phy_dev.dev_inst.power(val)
+        with self._lease(phy_dev):
+            phy_dev.dev_inst.channel(phy_dev.chan)
+            val = phy_dev.dev_inst.power(val)
         self.q.put({'op': 'set_pump_power', 'args': (val, ui_ch)})
+        self._reset_tracking_target(ui_ch)
 
     def set_pump_frequency(self, val:float, ui_ch: int) -> None:
         phy_dev = self.pump_source[ui_ch]
-        phy_dev.dev_inst.channel(phy_dev.chan)
-        val = phy_dev.dev_inst.freq(val)
+        with self._lease(phy_dev):
+            phy_dev.dev_inst.channel(phy_dev.chan)
+            val = phy_dev.dev_inst.freq(val)
         self.q.put({'op': 'set_pump_frequency', 'args': (val, ui_ch)})
+        self._reset_tracking_target(ui_ch)
 
     def connect_bias_source(self, driver_name: str, class_name: str, address: str, ch: int, ui_ch: int) -> None:
         status, ui_ch_list = self._connect_device( self.bias_source, driver_name, class_name, address, ch, ui_ch)
@@ -216,20 +312,24 @@ class HWCommandProcessor:
 
     def set_bias_current(self, val: float, ui_ch: int) -> None:
         phy_dev = self.bias_source[ui_ch]
-        phy_dev.dev_inst.channel(phy_dev.chan)
-        val = phy_dev.dev_inst.setpoint(val)
+        with self._lease(phy_dev):
+            phy_dev.dev_inst.channel(phy_dev.chan)
+            val = phy_dev.dev_inst.setpoint(val)
         self.q.put({'op': 'set_bias_current', 'args': (val, ui_ch)})
+        self._reset_tracking_target(ui_ch)
 
     def set_bias_limit(self, val: float, ui_ch: int) -> None:
         phy_dev = self.bias_source[ui_ch]
-        phy_dev.dev_inst.channel(phy_dev.chan)
-        val = phy_dev.dev_inst.limit(val)
+        with self._lease(phy_dev):
+            phy_dev.dev_inst.channel(phy_dev.chan)
+            val = phy_dev.dev_inst.limit(val)
         self.q.put({'op': 'set_bias_limit', 'args': (val, ui_ch)})
 
     def set_bias_output(self, val: bool,  ui_ch: int) -> None:
         phy_dev = self.bias_source[ui_ch]
-        phy_dev.dev_inst.channel(phy_dev.chan)
-        val = phy_dev.dev_inst.output(val)
+        with self._lease(phy_dev):
+            phy_dev.dev_inst.channel(phy_dev.chan)
+            val = phy_dev.dev_inst.output(val)
         self.q.put({'op': 'set_bias_output', 'args': (val, ui_ch)})
 
     def connect_vna(self, driver_name: str, class_name: str, address: str, ch: int, ui_ch: int):
@@ -239,23 +339,30 @@ class HWCommandProcessor:
                 self.q.put({'op': 'connect_vna', 'args': (ui_ch,)})
             else:
                 self.q.put({'op': 'disconnect_vna', 'args': (ui_ch,)})
+        self._update_live_view()
 
     def disconnect_vna(self, ui_ch: int) -> None:
+        if ui_ch in self.vna.keys():
+            # The devices are closed by the driver name
+            self.stop_live_view(self.vna[ui_ch].driver_name)
         ui_ch_list = self._disconnect_device(self.vna, ui_ch)
+        self._update_live_view()
         for ui_ch in ui_ch_list:
             self.q.put({'op': 'disconnect_vna', 'args': (ui_ch,)})
 
     def vna_preset(self, ui_ch: int) -> None:
         if ui_ch in self.vna.keys():
             phy_dev = self.vna[ui_ch]
-            phy_dev.dev_inst.preset()
+            with self._vna_access(phy_dev):
+                phy_dev.dev_inst.preset()
 
     def set_vna_measurement_type(self, val: str, ui_ch: int) -> None:
         if ui_ch in self.vna.keys():
             phy_dev = self.vna[ui_ch]
-            phy_dev.dev_inst.channel(phy_dev.chan)
             try:
-                val = phy_dev.dev_inst.measurement_type(val)
+                with self._vna_access(phy_dev):
+                    phy_dev.dev_inst.channel(phy_dev.chan)
+                    val = phy_dev.dev_inst.measurement_type(val)
             except Exception as err:
                 tb.print_exc()
                 self.q.put({'op': 'log_push', 'args': ('Failed to set VNA measurement type {:s}!\n'
@@ -265,77 +372,202 @@ class HWCommandProcessor:
                 return
             for ui_ch in phy_dev.similar_ui_ch:
                 self.q.put({'op': 'set_vna_measurement_type', 'args': (val, ui_ch)})
+            self._reset_tracking(phy_dev.similar_ui_ch)
 
     def set_vna_power(self, val: float, ui_ch: int) -> None:
         if ui_ch in self.vna.keys():
             phy_dev = self.vna[ui_ch]
-            self._stop_read_data_if_running(ui_ch)
-            phy_dev.dev_inst.channel(phy_dev.chan)
-            phy_dev.dev_inst.power(val)
+            with self._vna_access(phy_dev):
+                phy_dev.dev_inst.channel(phy_dev.chan)
+                phy_dev.dev_inst.power(val)
             for ui_ch in phy_dev.similar_ui_ch:
                 self.q.put({'op': 'set_vna_power', 'args': (val, ui_ch)})
+            self._reset_tracking(phy_dev.similar_ui_ch)
 
     def set_vna_bandwidth(self, val: float, ui_ch: int) -> None:
         if ui_ch in self.vna.keys():
             phy_dev = self.vna[ui_ch]
-            self._stop_read_data_if_running(ui_ch)
-            phy_dev.dev_inst.channel(phy_dev.chan)
-            phy_dev.dev_inst.bandwidth(val)
+            with self._vna_access(phy_dev):
+                phy_dev.dev_inst.channel(phy_dev.chan)
+                phy_dev.dev_inst.bandwidth(val)
             for ui_ch in phy_dev.similar_ui_ch:
                 self.q.put({'op': 'set_vna_bandwidth', 'args': (val, ui_ch)})
+            self._reset_tracking(phy_dev.similar_ui_ch)
 
     def set_vna_points(self, val: int, ui_ch: int) -> None:
         if ui_ch in self.vna.keys():
             phy_dev = self.vna[ui_ch]
-            self._stop_read_data_if_running(ui_ch)
-            phy_dev.dev_inst.channel(phy_dev.chan)
-            phy_dev.dev_inst.num_of_points(val)
+            with self._vna_access(phy_dev):
+                phy_dev.dev_inst.channel(phy_dev.chan)
+                phy_dev.dev_inst.num_of_points(val)
             for ui_ch in phy_dev.similar_ui_ch:
                 self.q.put({'op': 'set_vna_points', 'args': (val, ui_ch)})
+            self._reset_tracking(phy_dev.similar_ui_ch)
 
     def set_vna_center(self, val: float, ui_ch: int) -> None:
         if ui_ch in self.vna.keys():
             phy_dev = self.vna[ui_ch]
-            self._stop_read_data_if_running(ui_ch)
-            phy_dev.dev_inst.channel(phy_dev.chan)
-            center, span = phy_dev.dev_inst.freq_center_span()
-            phy_dev.dev_inst.freq_center_span( (val,span ) )
+            with self._vna_access(phy_dev):
+                phy_dev.dev_inst.channel(phy_dev.chan)
+                center, span = phy_dev.dev_inst.freq_center_span()
+                phy_dev.dev_inst.freq_center_span( (val,span ) )
             for ui_ch in phy_dev.similar_ui_ch:
                 self.q.put({'op': 'set_vna_center', 'args': (val, ui_ch)})
+            self._reset_tracking(phy_dev.similar_ui_ch)
 
     def set_vna_span(self, val: float, ui_ch: int) -> None:
         if ui_ch in self.vna.keys():
             phy_dev = self.vna[ui_ch]
-            self._stop_read_data_if_running(ui_ch)
-            phy_dev.dev_inst.channel(phy_dev.chan)
-            center, span = phy_dev.dev_inst.freq_center_span()
-            phy_dev.dev_inst.freq_center_span((center, val))
+            with self._vna_access(phy_dev):
+                phy_dev.dev_inst.channel(phy_dev.chan)
+                center, span = phy_dev.dev_inst.freq_center_span()
+                phy_dev.dev_inst.freq_center_span((center, val))
             for ui_ch in phy_dev.similar_ui_ch:
                 self.q.put({'op': 'set_vna_span', 'args': (val, ui_ch)})
+            self._reset_tracking(phy_dev.similar_ui_ch)
+
+    def _push_trace(self, ui_ch_list: list[int], freq_points: np.ndarray, s21: np.ndarray) -> None:
+        S21 = 20*np.log10(np.abs(s21))
+        slot = None if self.trace_ring is None else self.trace_ring.write(freq_points, S21)
+        for ui_ch in ui_ch_list:
+            if slot is not None:
+                self.q.put({'op': 'update_gain_plot_from_ring', 'args': (*slot, ui_ch)})
+            else:
+                data = np.vstack((freq_points, S21))
+                self.q.put({'op': 'update_gain_plot', 'args': (data, ui_ch)})
 
     def _get_vna_data(self, ui_ch):
         if ui_ch in self.vna.keys():
             phy_dev = self.vna[ui_ch]
-            freq_points = phy_dev.dev_inst.freq_points()
-            S21 = 20*np.log10(np.abs(phy_dev.dev_inst.read_data()))
-            data = np.vstack((freq_points, S21))
-            self.q.put({'op': 'update_gain_plot', 'args': (data, ui_ch)})
-
-    def get_vna_data(self, ui_ch) -> None:
+            with self._lease(phy_dev):
+                phy_dev.dev_inst.channel(phy_dev.chan)
+                freq_points = phy_dev.dev_inst.freq_points()
+                s21 = phy_dev.dev_inst.read_data()
+            self._push_trace([ui_ch], freq_points, s21)
+            self._check_tracking(self._key(phy_dev), [ui_ch], freq_points, s21)
+
+    def _check_tracking(self, key: tuple[str, str], ui_ch_list: list[int],
+                        freq_points: np.ndarray, s21: np.ndarray) -> None:
+        """Drift tracking gain checks of the channels a sweep of the VNA identified by key
+        has been taken for, using the sweep instead of a sweep of their own"""
+        for tr_ch, tracker in list(self.trackers.items()):
+            if tr_ch in ui_ch_list and self._key(tracker.vna) == key and tracker.due():
+                self._run_tracker(tr_ch, tracker, freq_points, s21)
+
+    def _run_tracker(self, tr_ch: int, tracker: DriftTracker,
+                     freq_points: np.ndarray | None = None, s21: np.ndarray | None = None) -> None:
+        if self._tracker_blocked(tracker):
+            if tr_ch not in self._trackers_paused:
+                self._trackers_paused.add(tr_ch)
+                self.q.put({'op': 'log_push',
+                            'args': ('Tracking paused while a routine uses the devices', tr_ch)})
+            return
+        if tr_ch in self._trackers_paused:
+            self._trackers_paused.discard(tr_ch)
+            self.q.put({'op': 'log_push', 'args': ('Tracking resumed', tr_ch)})
+        try:
+            with self._lease(tracker.vna, tracker.bias_source, tracker.pump_source):
+                # Checked by the timer or another sweep meanwhile, or stopped
+                if self.trackers.get(tr_ch) is not tracker or not tracker.due():
+                    return
+                tracker.check(freq_points, s21)
+        except Exception as err:
+            tb.print_exc()
+            self.q.put({'op': 'log_push', 'args': ('Tracking error: {}'.format(err.args), tr_ch)})
+
+    def _tracker_blocked(self, tracker: DriftTracker) -> bool:
+        """A bias sweep or an optimization is running on a device of the tracker"""
+        keys = {self._key(tracker.vna), self._key(tracker.bias_source), self._key(tracker.pump_source)}
+        for r in list(self.bias_sweeps.values()) + list(self.optimization.values()):
+            if r.future.done():
+                continue
+            devices = [getattr(r, name, None) for name in ('vna', 'bias_source', 'pump_source')]
+            if any(d is not None and self._key(d) in keys for d in devices):
+                return True
+        return False
+
+    def _tracking_loop(self) -> None:
+        """Runs the due gain checks of the trackers not served by a live view sweep"""
+        while not self._tracking_stop.wait(self.tracking_poll_interval):
+            for tr_ch, tracker in list(self.trackers.items()):
+                if tracker.due():
+                    self._run_tracker(tr_ch, tracker)
+
+    def stop_tracking_timer(self) -> None:
+        self._tracking_stop.set()
+        self._tracking_thread.join()
+
+    def get_vna_data(self, ui_ch) -> Future | None:
+        """Single sweep, for the clients without live view. Returns the future of the sweep
+        submitted, None if a sweep is already running."""
         if ui_ch in self.vna.keys():
-            if self.vna_read_data_future is None:
-                self.vna_read_data_future = self.executor.submit(self._get_vna_data, ui_ch)
-            elif not self.vna_read_data_future.running():
+            if self.vna_read_data_future is None or not self.vna_read_data_future.running():
                 self.vna_read_data_future = self.executor.submit(self._get_vna_data, ui_ch)
+                return self.vna_read_data_future
+        return None
+
+    def _on_live_view_trace(self, key: tuple[str, str], ui_ch_list: list[int],
+                            freq_points: np.ndarray, s21: np.ndarray) -> None:
+        """Called by the streamer of the VNA identified by key after each sweep"""
+        self._push_trace(ui_ch_list, freq_points, s21)
+        self._check_tracking(key, ui_ch_list, freq_points, s21)
+
+    def _on_live_view_error(self, err: Exception, ui_ch_list: list[int]) -> None:
+        for ui_ch in ui_ch_list:
+            self.q.put({'op': 'log_push', 'args': ('Live view error: {}'.format(err.args), ui_ch)})
+
+    def _update_live_view(self) -> None:
+        """Starts, reconfigures and stops the streamers of the physical VNAs after the live view
+        state or the connected devices have changed. UI channels sharing a physical channel
+        of a VNA get the traces of the same sweep."""
+        channels: dict[tuple[str, str], dict[int, list[int]]] = {}
+        dev_inst: dict[tuple[str, str], Any] = {}
+        for ui_ch, enabled in self.live_view.items():
+            if not enabled or ui_ch not in self.vna.keys() or self.vna[ui_ch].dev_inst is None:
+                continue
+            phy_dev = self.vna[ui_ch]
+            key = self._key(phy_dev)
+            channels.setdefault(key, {}).setdefault(phy_dev.chan, []).append(ui_ch)
+            dev_inst[key] = phy_dev.dev_inst
+        for key in list(self.streamers.keys()):
+            # Stop the streamers of the reconnected devices too
+            if key not in channels or self.streamers[key].dev_inst is not dev_inst[key]:
+                self.streamers.pop(key).stop()
+        for key, chan_dict in channels.items():
+            if key not in self.streamers:
+                on_trace = lambda ui_ch_list, freq_points, s21, key=key: \
+                    self._on_live_view_trace(key, ui_ch_list, freq_points, s21)
+                lease = lambda key=key: self.resources.lease(key)
+                streamer = LiveViewStreamer(dev_inst[key], lease, on_trace, self._on_live_view_error,
+                                            lambda key=key: self._measurement_running(key))
+                self.streamers.update({key: streamer})
+                streamer.set_channels(chan_dict)
+                streamer.start()
+            else:
+                self.streamers[key].set_channels(chan_dict)
+
+    def stop_live_view(self, driver_name: str | None = None) -> None:
+        """Stops the streamers of all the VNAs, or of the ones of the given driver"""
+        for key in list(self.streamers.keys()):
+            if driver_name is None or key[0] == driver_name:
+                self.streamers.pop(key).stop()
+
+    def set_live_view(self, val: bool, ui_ch: int) -> None:
+        self.live_view.update({ui_ch: bool(val)})
+        self._update_live_view()
 
     def start_bias_sweep(self, data: dict) -> None:
         if data['ch_id'] in self.bias_sweeps.keys():
             if self.bias_sweeps[data['ch_id']].future.running():
                 return
         parameters = BiasSweepParameters(**data)
+        self._reset_tracking(list(self.trackers.keys()))
         bs = BiasSweep(self.bias_source[data['ch_id']], self.vna[data['ch_id']], self.q, parameters)
-        bs.future = self.executor.submit(bs.sweep)
-        self.bias_sweeps.update({data['ch_id']: bs})
+        bs.resources = self.resources
+        # Live view of the VNA used is suspended until the sweep is done
+        with self._live_view_paused(bs.vna, bs.bias_source):
+            bs.future = self.executor.submit(bs.sweep)
+            self.bias_sweeps.update({data['ch_id']: bs})
         self.q.put({'op': 'start_bias_sweep', 'args': (data['ch_id'],)})
 
     def abort_bias_sweep(self, ch_id) -> None:
@@ -344,18 +576,51 @@ class HWCommandProcessor:
                 self.bias_sweeps[ch_id].abort()
         self.q.put({'op': 'stop_bias_sweep', 'args': (ch_id,)})
 
+    def _source_in_use(self, ch_id: int) -> tuple[str, int] | None:
+        """Finds a routine running at another UI channel on the same physical bias or pump
+        source channel as the UI channel ch_id. The source schedulers don't restore set points
+        per lease, unlike the VNA one.
+
+        Returns:
+            Name of the source and UI channel of the routine, None if there is none.
+        """
+        sources = (('bias source', self.bias_source.get(ch_id)), ('pump source', self.pump_source.get(ch_id)))
+        for r_ch, r in list(self.bias_sweeps.items()) + list(self.optimization.items()):
+            if r_ch == ch_id or r.future.done():
+                continue
+            for name, phy_dev in sources:
+                if phy_dev is None:
+                    continue
+                for r_dev in (getattr(r, 'bias_source', None), getattr(r, 'pump_source', None)):
+                    if r_dev is not None and (self._key(r_dev), r_dev.chan) == (self._key(phy_dev), phy_dev.chan):
+                        return name, r_ch
+        return None
+
     def start_optimization(self, data: dict) -> None:
         if data['ch_id'] in self.optimization.keys():
             if self.optimization[data['ch_id']].future.running():
                 return
+        in_use = self._source_in_use(data['ch_id'])
+        if in_use is not None:
+            self.q.put({'op': 'log_push',
+                        'args': ('Unable to start optimization, the {:s} channel is used by '
+                                 'the routine of UI channel {:d}'.format(*in_use), data['ch_id'])})
+            self.q.put({'op': 'stop_optimization', 'args': (data['ch_id'],)})
+            return
         parameters = OptimizationParameters(**data)
+        self._reset_tracking(list(self.trackers.keys()))
         op = Optimization(self.bias_source[data['ch_id']],
                           self.pump_source[data['ch_id']],
                           self.vna[data['ch_id']],
                           self.q,
                           parameters)
-        op.future = self.executor.submit(op.start)
-        self.optimization.update({data['ch_id']: op})
+        op.shared_vna = self._shared_device(self.vna[data['ch_id']], vna_state_methods)
+        op.shared_bias_source = self._shared_device(self.bias_source[data['ch_id']])
+        op.shared_pump_source = self._shared_device(self.pump_source[data['ch_id']])
+        # Live view of the VNA used is suspended until the optimization is done
+        with self._live_view_paused(op.vna, op.bias_source, op.pump_source):
+            op.future = self.executor.submit(op.start)
+            self.optimization.update({data['ch_id']: op})
         self.q.put({'op': 'start_optimization', 'args': (data['ch_id'],)})
 
     def abort_optimization(self, ch_id) -> None:
@@ -368,4 +633,31 @@ class HWCommandProcessor:
                     time.sleep(0.01)
                     if time.time() - t0 > timeout:
                         break
-        self.q.put({'op': 'stop_optimization', 'args': (ch_id,)})
\ No newline at end of file
+        self.q.put({'op': 'stop_optimization', 'args': (ch_id,)})
+
+    def start_tracking(self, data: dict) -> None:
+        ch_id = data['ch_id']
+        missing = [name for name, devices in (('VNA', self.vna),
+                                              ('bias source', self.bias_source),
+                                              ('pump source', self.pump_source))
+                   if ch_id not in devices.keys() or devices[ch_id].dev_inst is None]
+        if len(missing):
+            self.q.put({'op': 'log_push',
+                        'args': ('Unable to start tracking, not connected: ' + ', '.join(missing), ch_id)})
+            self.q.put({'op': 'stop_tracking', 'args': (ch_id,)})
+            return
+        parameters = TrackingParameters(**data)
+        parameters.max_evals = int(parameters.max_evals)
+        tracker = DriftTracker(self.bias_source[data['ch_id']],
+                               self.pump_source[data['ch_id']],
+                               self.vna[data['ch_id']],
+                               self.q,
+                               parameters)
+        self.trackers.update({data['ch_id']: tracker})
+        self.q.put({'op': 'start_tracking', 'args': (data['ch_id'],)})
+
+    def stop_tracking(self, ch_id: int) -> None:
+        if ch_id in self.trackers.keys():
+            del self.trackers[ch_id]
+        self._trackers_paused.discard(ch_id)
+        self.q.put({'op': 'stop_tracking', 'args': (ch_id,)})
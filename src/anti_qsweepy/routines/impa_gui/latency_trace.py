@@ -0,0 +1,113 @@
+import csv
+import time
+import itertools
+import collections
+import numpy as np
+
+# Stages of a traced command: name, stamps of the start and of the end
+stages = (('queue', 't_enqueue', 't_dequeue'),  # UI process to the HW process
+          ('dispatch', 't_dequeue', 't_start'),  # Waiting behind other commands in the HW process
+          ('execution', 't_start', 't_end'),  # Command handler including the driver calls, or its future
+          ('feedback', 't_end', 't_feedback'),  # HW process back to the UI, processed
+          ('total', 't_enqueue', 't_feedback'))
+stamps = ('t_enqueue', 't_dequeue', 't_start', 't_end', 't_feedback')
+# Latency histogram bin edges, 10 bins per decade from 10 us to 100 s
+bin_edges = np.logspace(-5, 2, 71)
+
+
+def stamp(command: dict, name: str) -> None:
+    """Stamps a traced command with the current time, untraced commands are left alone."""
+    if 'trace' in command:
+        command['trace'][name] = time.time()
+
+
+class LatencyHistogram:
+    """Latency distribution with logarithmic bins, see bin_edges"""
+    def __init__(self):
+        self.counts = np.zeros(len(bin_edges) + 1, dtype=int)
+        self.n = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def add(self, dt: float) -> None:
+        self.counts[np.searchsorted(bin_edges, dt, side='right')] += 1
+        self.n += 1
+        self.sum += dt
+        self.max = max(self.max, dt)
+
+    def mean(self) -> float:
+        return self.sum/self.n if self.n else 0.
+
+    def quantile(self, q: float) -> float:
+        """Upper edge of the bin containing the quantile q"""
+        if not self.n:
+            return 0.
+        i = int(np.searchsorted(np.cumsum(self.counts), q*self.n))
+        return float(bin_edges[i]) if i < len(bin_edges) else self.max
+
+
+class LatencyTracer:
+    """End-to-end latency tracing of the commands sent to the HW process.
+
+    When enabled, every command gets a trace dict with an id and the time it is queued.
+    The HW process stamps it when it takes the command from the queue, and when the
+    command handler starts and ends, or the future returned by the handler of a command
+    executed by a worker thread is done, then sends it back as a trace_span feedback message,
+    which is stamped when processed by the UI. Command time spans are aggregated into
+    per op and per stage latency histograms, see stages. The last max_spans spans are
+    kept for export. Nothing is stamped or sent while disabled.
+    """
+    max_spans = 10000
+
+    def __init__(self):
+        self.enabled = False
+        self._ids = itertools.count()
+        self.reset()
+
+    def reset(self) -> None:
+        self.histograms: dict[str, dict[str, LatencyHistogram]] = {}
+        self.spans: collections.deque[dict] = collections.deque(maxlen=self.max_spans)
+
+    def start(self, command: dict) -> dict:
+        """Starts tracing the command to be queued, if enabled. Returns the command."""
+        if self.enabled:
+            command['trace'] = {'id': next(self._ids), 't_enqueue': time.time()}
+        return command
+
+    def add(self, op: str, ui_ch: int | None, trace: dict) -> None:
+        """Adds the time span of a command returned by the HW process"""
+        trace['t_feedback'] = time.time()
+        span = {'id': trace['id'], 'op': op, 'ui_ch': ui_ch}
+        histograms = self.histograms.setdefault(op, {})
+        for name, t_start, t_end in stages:
+            if t_start in trace and t_end in trace:
+                dt = trace[t_end] - trace[t_start]
+                span[name] = dt
+                histograms.setdefault(name, LatencyHistogram()).add(dt)
+        span.update({name: trace.get(name) for name in stamps})
+        self.spans.append(span)
+
+    def summary(self) -> list[dict]:
+        """Latency statistics per op in ms: mean of each stage, quantiles and maximum of the total"""
+        rows = []
+        for op in sorted(self.histograms):
+            histograms = self.histograms[op]
+            total = histograms.get('total', LatencyHistogram())
+            row = {'op': op, 'n': total.n}
+            for name, _, _ in stages[:-1]:
+                row[name] = round(histograms[name].mean()*1e3, 3) if name in histograms else None
+            row.update({'p50': round(total.quantile(0.5)*1e3, 3),
+                        'p95': round(total.quantile(0.95)*1e3, 3),
+                        'max': round(total.max*1e3, 3)})
+            rows.append(row)
+        return rows
+
+    def export(self, path: str) -> int:
+        """Writes the spans kept to a CSV file, times in s. Returns the number of spans written."""
+        fieldnames = ['id', 'op', 'ui_ch'] + [name for name, _, _ in stages] + list(stamps)
+        spans = list(self.spans)
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(spans)
+        return len(spans)
@@ -0,0 +1,107 @@
+import threading
+import traceback as tb
+import numpy as np
+from typing import Any, Callable, ContextManager
+
+
+class LiveViewStreamer:
+    """Continuous live view acquisition from one physical VNA.
+
+    A worker thread sweeps the physical channels of the VNA used by the UI channels with
+    live view enabled one after another, as fast as the instrument allows, and passes
+    every trace to on_trace. Each sweep is done with a lease on the VNA held, so the other
+    users of the instrument get theirs between sweeps, fairly, and may cut the sweep in
+    progress short with interrupt(). Streamers of different VNAs run independently.
+
+    Args:
+        dev_inst: VNA driver instance.
+        lease: Returns a lease on the VNA held during each sweep, see ResourceManager.lease().
+        on_trace: Called as on_trace(ui_ch_list, freq_points, s21) after each sweep,
+                  without the lease held.
+        on_error: Called as on_error(err, ui_ch_list) if a sweep fails.
+        suspended: Returns True while the VNA is used by a measurement routine
+                   and live view has to wait.
+    """
+    # Wait time when there is nothing to sweep, s
+    idle_interval = 0.1
+    # Wait time after a failed sweep, s
+    error_interval = 1.
+
+    def __init__(self, dev_inst: Any,
+                 lease: Callable[[], ContextManager],
+                 on_trace: Callable[[list[int], np.ndarray, np.ndarray], None],
+                 on_error: Callable[[Exception, list[int]], None] | None = None,
+                 suspended: Callable[[], bool] | None = None):
+        self.dev_inst = dev_inst
+        self.lease = lease
+        self.on_trace = on_trace
+        self.on_error = on_error
+        self.suspended = suspended
+        # UI channels to deliver the traces to keyed by the physical channel
+        self._channels: dict[int, list[int]] = {}
+        self._stop = threading.Event()
+        self._reading = False
+        # Incremented by interrupt(), a trace taken across an increment is dropped
+        self._generation = 0
+        self._thread = threading.Thread(target=self._run, name='LiveViewStreamer', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.) -> None:
+        self._stop.set()
+        self.interrupt()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def set_channels(self, channels: dict[int, list[int]]) -> None:
+        """Set the UI channels to deliver the traces to keyed by the physical channel."""
+        self._channels = {chan: list(ui_ch_list) for chan, ui_ch_list in channels.items()}
+
+    def interrupt(self) -> None:
+        """Abort the sweep in progress. Its trace is dropped."""
+        self._generation += 1
+        if self._reading:
+            self.dev_inst.abort()
+
+    def _is_suspended(self) -> bool:
+        return self.suspended is not None and self.suspended()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            channels = self._channels
+            if not len(channels) or self._is_suspended():
+                self._stop.wait(self.idle_interval)
+                continue
+            for chan, ui_ch_list in channels.items():
+                if self._stop.is_set():
+                    break
+                generation = self._generation
+                try:
+                    trace = self._sweep(chan)
+                except Exception as err:
+                    if generation != self._generation:
+                        continue
+                    tb.print_exc()
+                    if self.on_error is not None:
+                        self.on_error(err, ui_ch_list)
+                    self._stop.wait(self.error_interval)
+                    continue
+                if trace is not None:
+                    self.on_trace(ui_ch_list, *trace)
+
+    def _sweep(self, chan: int) -> tuple[np.ndarray, np.ndarray] | None:
+        with self.lease():
+            if self._stop.is_set() or self._is_suspended():
+                return None
+            generation = self._generation
+            self._reading = True
+            try:
+                self.dev_inst.channel(chan)
+                freq_points = self.dev_inst.freq_points()
+                s21 = self.dev_inst.read_data()
+            finally:
+                self._reading = False
+        if generation != self._generation:
+            return None
+        return freq_points, s21
@@ -6,6 +6,7 @@ import os
 from .ui_generator import UiGenerator
 from .ui_callbacks import UiCallbacks
 from .feedback_processor import FeedbackProcessor
+from .trace_ring import TraceRing
 from .hw_control_process import hw_process
 from .config_handler import ConfigHandler
 from . import data_structures as ds
@@ -18,29 +19,33 @@ def impa_giu_main():
 
     q_command = mp.Queue(maxsize=100)
     q_feedback = mp.Queue(maxsize=100)
+    # Live view traces are passed through shared memory, the queue carries slot numbers only
+    trace_ring = TraceRing()
 
     ui_objects = ds.UiObjects()
     conf_h = ConfigHandler(ui_objects)
     conf_h.load_config()
 
     ui_cb = UiCallbacks(ui_objects, conf_h, q_command)
-    ui_gen = UiGenerator(ui_objects, ui_cb, conf_h)
-    fp = FeedbackProcessor(q_feedback, q_command, ui_objects, ui_cb)
+    fp = FeedbackProcessor(q_feedback, q_command, ui_objects, ui_cb, trace_ring)
+    ui_gen = UiGenerator(ui_objects, ui_cb, conf_h, fp.metrics)
 
     ui_gen.create_ui()
 
     #mp.set_start_method('fork')
-    p = mp.Process(target=hw_process, args=(q_command, q_feedback))
+    p = mp.Process(target=hw_process, args=(q_command, q_feedback, trace_ring.name))
     p.start()
     ui.timer(0.01, fp.check_queue)
 
     ui_cb.connect_devices()
-    # VNA data request timer, s
-    ui.timer(0.1, ui_cb.request_vna_data)
+    # Live view state check timer, s
+    ui.timer(0.1, ui_cb.update_live_view)
 
     ui.run( port=ui_objects.tcp_ip_port, reload=False)
     q_command.put({'op':'terminate'})
     p.join()
+    trace_ring.close()
+    trace_ring.unlink()
 
 if __name__ == "__main__":
     impa_giu_main()
\ No newline at end of file
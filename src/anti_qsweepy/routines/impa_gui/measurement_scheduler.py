@@ -0,0 +1,143 @@
+import threading
+import collections
+from typing import Any
+
+# VNA methods which change the instrument state when called with an argument.
+# Values passed to them are cached per client to restore the state when
+# several clients share the same physical channel of a device.
+vna_state_methods = ('measurement_type',
+                     'power',
+                     'bandwidth',
+                     'num_of_points',
+                     'averaging',
+                     'freq_start_stop',
+                     'freq_center_span',
+                     'freq_cw',
+                     'seg_tab',
+                     'sweep_type',
+                     'output',
+                     'soft_trig_arm',
+                     'soft_trig_abort')
+_setters_without_args = ('soft_trig_arm', 'soft_trig_abort')
+# Methods setting the same state. Setting one of them invalidates the others.
+_aliases = {'freq_start_stop': 'freq_center_span',
+            'freq_center_span': 'freq_start_stop',
+            'soft_trig_arm': 'soft_trig_abort',
+            'soft_trig_abort': 'soft_trig_arm'}
+# Methods which are called without lock, like abort of a running read_data()
+_unlocked_methods = ('abort',)
+
+
+class FairLock:
+    """Lock granted to the waiting threads in the order of request."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._locked = False
+
+    def acquire(self) -> None:
+        with self._cond:
+            ticket = object()
+            self._queue.append(ticket)
+            while self._locked or self._queue[0] is not ticket:
+                self._cond.wait()
+            self._queue.popleft()
+            self._locked = True
+
+    def release(self) -> None:
+        with self._cond:
+            self._locked = False
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+
+class ScheduledDevice:
+    """Proxy to a device shared by several concurrent routines.
+
+    Every method call is executed exclusively, after the physical channel of this client
+    is selected and, if some other client has used the same physical channel since, its
+    cached state is restored. Routines running in parallel thus interleave their device
+    calls, e.g. one channel's sweep runs while another one's bias and pump settle.
+    """
+    def __init__(self, scheduler: 'MeasurementScheduler', chan: int):
+        self._scheduler = scheduler
+        self._chan = chan
+        # Arguments of the state changing calls in the order of calling
+        self._state: dict[str, tuple] = {}
+
+    def channel(self, val: int | None = None) -> int:
+        """Set or get the physical channel of this client."""
+        if val is not None:
+            self._chan = val
+        return self._chan
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._scheduler.dev_inst, name)
+        if not callable(attr) or name in _unlocked_methods:
+            return attr
+
+        def call(*args, **kwargs):
+            with self._scheduler.lock:
+                self._scheduler.activate(self)
+                res = attr(*args, **kwargs)
+                self._cache_state(name, args)
+            return res
+        return call
+
+    def _cache_state(self, name: str, args: tuple) -> None:
+        if name not in self._scheduler.state_methods:
+            return
+        # Getter call
+        if name not in _setters_without_args and (not len(args) or args[0] is None):
+            return
+        self._state.pop(_aliases.get(name), None)
+        # Keep the order of the last calls
+        self._state.pop(name, None)
+        self._state[name] = args
+
+    def restore_state(self) -> None:
+        """Repeat the cached state changing calls on the device."""
+        for name, args in self._state.items():
+            getattr(self._scheduler.dev_inst, name)(*args)
+
+
+class MeasurementScheduler:
+    """Time-multiplexes one physical device between several concurrent routines.
+
+    Attributes:
+        dev_inst: Shared device driver instance.
+        state_methods (tuple): Names of methods which state is restored when the
+                               physical channel is passed from one client to another.
+        lock: Lock held during each device call, a new FairLock if not given.
+    """
+    def __init__(self, dev_inst: Any, state_methods: tuple = (), lock: Any = None):
+        self.dev_inst = dev_inst
+        self.state_methods = state_methods
+        self.lock = lock if lock is not None else FairLock()
+        self._active: ScheduledDevice | None = None
+        # The last client which used each physical channel
+        self._chan_owner: dict[int, ScheduledDevice] = {}
+
+    def client(self, chan: int) -> ScheduledDevice:
+        """Create a new proxy to the device for a routine using the physical channel chan."""
+        return ScheduledDevice(self, chan)
+
+    def invalidate(self) -> None:
+        """The physical channel has been selected bypassing the clients. Must be called with the lock held."""
+        self._active = None
+
+    def activate(self, client: ScheduledDevice) -> None:
+        """Pass the device to client. Must be called with the lock held."""
+        if self._active is not client:
+            self.dev_inst.channel(client.channel())
+            self._active = client
+        if self._chan_owner.get(client.channel()) is not client:
+            if client.channel() in self._chan_owner:
+                client.restore_state()
+            self._chan_owner[client.channel()] = client
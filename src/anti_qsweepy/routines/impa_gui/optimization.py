@@ -3,14 +3,49 @@ from dataclasses import dataclass
 from concurrent.futures import Future
 import multiprocessing as mp
 import tables
+import time
+from pathlib import Path
 
 from .. import data_mgmt
 from ..helper_functions import *
 from .. import jpa_tuning as jt
+from ..operating_point_store import OperatingPointStore
 from .phy_devices import PhyDevice
+from .measurement_scheduler import ScheduledDevice
 from .std_output_catcher import StdOutputCatcher
 
 min_plot_update_interval = 1
+op_store_name = 'operating_points.h5'
+
+
+class EvaluationRecord(tables.IsDescription):
+    """Telemetry of a single cost function evaluation"""
+    stage = tables.StringCol(16)
+    target_freq = tables.Float64Col()
+    generation = tables.Int32Col()
+    nfev = tables.Int32Col()
+    bias = tables.Float64Col()
+    pump = tables.Float64Col()
+    freq = tables.Float64Col()
+    cost = tables.Float64Col()
+    t_set = tables.Float64Col()
+    t_sweep = tables.Float64Col()
+    t_snr = tables.Float64Col()
+    t_total = tables.Float64Col()
+    timestamp = tables.Float64Col()
+
+
+class GenerationRecord(tables.IsDescription):
+    """Telemetry of a differential evolution generation"""
+    target_freq = tables.Float64Col()
+    generation = tables.Int32Col()
+    nfev = tables.Int32Col()
+    nfev_generation = tables.Int32Col()
+    popsize = tables.Int32Col()
+    best_energy = tables.Float64Col()
+    t_total = tables.Float64Col()
+    t_func = tables.Float64Col()
+    t_overhead = tables.Float64Col()
 
 
 @dataclass
@@ -35,6 +70,21 @@ class OptimizationParameters:
     std_tol: float
     save_path: str
     n_meas_snr: int = 100
+    prescreen: bool = False
+    prescreen_points: int = 51
+    prescreen_bandwidth: float = 50e3
+    prescreen_tol: float = 0.5
+    segmented_sweep: bool = False
+    settle_time: float = 0.
+    snr_rtol: float = 0.
+    spool_snr_traces: bool = False
+    gain_map: bool = False
+    map_bias_points: int = 21
+    map_pump_points: int = 21
+    map_basins: int = 3
+    adaptive_averaging: bool = False
+    max_averages: int = 8
+    noise_k: float = 1.
 
 
 class Optimization:
@@ -49,21 +99,67 @@ class Optimization:
         self.pump_source = pump_source
         self.params: OptimizationParameters = params
         self.future: Future | None = None
+        # Operating points found by all optimization runs of the channel
+        self.op_store_path = str(Path(self.params.save_path)/op_store_name)
         self.params.save_path = data_mgmt.default_save_path(self.params.save_path, name="jpa_tuning")
         self.tuner: jt.IMPATuner| None = None
+        # Proxies of devices shared with concurrent optimizations on other UI channels.
+        # Device instances are used directly if not set.
+        self.shared_vna: ScheduledDevice | None = None
+        self.shared_bias_source: ScheduledDevice | None = None
+        self.shared_pump_source: ScheduledDevice | None = None
         self._abort = False
 
     def abort(self):
         self._abort = True
         self.tuner.abort()
 
+    @staticmethod
+    def _append_records(table: tables.Table, records: list[dict]) -> None:
+        row = table.row
+        for rec in records:
+            for key, val in rec.items():
+                row[key] = val
+            row.append()
+        table.flush()
+
+    def _add_to_op_store(self, op: jt.OperationPoint) -> None:
+        with OperatingPointStore(self.op_store_path) as op_store:
+            op_store.add(op, run=self.params.save_path)
+
+    @staticmethod
+    def _telemetry_report(evaluations: tables.Table, generations: tables.Table,
+                          t_hdf5: float, t_total: float) -> str:
+        """Summary of where the tuning time went"""
+        ev = evaluations.read()
+        gen = generations.read()
+        percent = lambda t: 100*t/t_total if t_total > 0 else 0
+        lines = ["Tuning telemetry: total time {:.1f} s".format(t_total)]
+        for stage in (b'full', b'prescreen', b'remeasure'):
+            sel = ev[ev['stage'] == stage]
+            if len(sel):
+                lines += ["{:s} evaluations: {:d}, {:.1f} s ({:.0f}%), {:.3f} s per evaluation".format(
+                    stage.decode().capitalize(), len(sel), np.sum(sel['t_total']), percent(np.sum(sel['t_total'])),
+                    np.mean(sel['t_total']))]
+        for name, key in (('Instrument setting', 't_set'), ('VNA sweep', 't_sweep'), ('SNR CW read', 't_snr')):
+            lines += ["  {:s}: {:.1f} s ({:.0f}%)".format(name, np.sum(ev[key]), percent(np.sum(ev[key])))]
+        t_overhead = np.sum(gen['t_overhead'])
+        lines += ["DE bookkeeping: {:.1f} s ({:.0f}%) in {:d} generations".format(t_overhead, percent(t_overhead),
+                                                                               len(gen))]
+        lines += ["Waiting for HDF5 writes: {:.1f} s ({:.0f}%)".format(t_hdf5, percent(t_hdf5))]
+        t_other = t_total - np.sum(ev['t_total']) - t_overhead - t_hdf5
+        lines += ["Other (gain map, references, snapshots): {:.1f} s ({:.0f}%)".format(t_other, percent(t_other))]
+        return '\n'.join(lines)
+
     def start(self):
+        t_start = time.time()
+        t_hdf5 = 0.
         # Tuner settings
-        bias_source = self.bias_source.dev_inst
+        bias_source = self.shared_bias_source if self.shared_bias_source is not None else self.bias_source.dev_inst
         bias_source.channel(self.bias_source.chan)
-        pump_source = self.pump_source.dev_inst
+        pump_source = self.shared_pump_source if self.shared_pump_source is not None else self.pump_source.dev_inst
         pump_source.channel(self.pump_source.chan)
-        vna = self.vna.dev_inst
+        vna = self.shared_vna if self.shared_vna is not None else self.vna.dev_inst
         vna.channel(self.vna.chan)
         self.tuner = jt.IMPATuner(vna=vna, pump=pump_source, bias=bias_source)
         self.tuner.bias_range = (self.params.bias_bond_1, self.params.bias_bond_2)
@@ -75,6 +171,15 @@ class Optimization:
         self.tuner.bw = self.params.vna_bandwidth
         self.tuner.points = self.params.vna_points
         self.tuner.w_cent = self.params.w_cent  # Weight of central point. If <1 helps to get a more flat gain.
+        self.tuner.prescreen = self.params.prescreen
+        self.tuner.prescreen_points = int(self.params.prescreen_points)
+        self.tuner.prescreen_bw = self.params.prescreen_bandwidth
+        self.tuner.prescreen_tol = self.params.prescreen_tol
+        self.tuner.segmented = self.params.segmented_sweep
+        self.tuner.settle_time = self.params.settle_time
+        self.tuner.adaptive = self.params.adaptive_averaging
+        self.tuner.max_avg = int(self.params.max_averages)
+        self.tuner.noise_k = self.params.noise_k
 
         data_mgmt.spawn_plotting_script(self.params.save_path, "JPA\\plot_jpa_tuning_results")
         file = open(self.params.save_path + '/tuning_table.txt', 'w+')
@@ -91,62 +196,116 @@ class Optimization:
             Gsnr = tables.Float64Col()
 
         f = tables.open_file(self.params.save_path + '\\data.h5', mode='w', title=hdf5_title)
-        thumbnail = f.create_table(f.root, 'thumbnail', Thumbnail, "thumbnail").row
+        thumbnail = f.create_table(f.root, 'thumbnail', Thumbnail, "thumbnail")
         complex_atom = tables.ComplexAtom(itemsize=16)
         float_atom = tables.Float64Atom()
-        s21_on = f.create_earray(f.root, 's21_on', complex_atom, (0, self.params.vna_points*2), "S21-on")
-        s21_off = f.create_earray(f.root, 's21_off', complex_atom, (0, self.params.vna_points*2), "S21-off")
-        s21_on_snr = f.create_earray(f.root, 's21_on_snr', complex_atom, (0, self.params.vna_points * 2),
-                                     "mean(S21-on-snr)")
-        s21_off_snr = f.create_earray(f.root, 's21_off_snr', complex_atom, (0, self.params.vna_points * 2),
-                                      "mean(S21-off-snr)")
-        s21_freq = f.create_earray(f.root, 's21_frequency', float_atom, (0, self.params.vna_points*2), "S21 frequency")
-        snr_gain = f.create_earray(f.root, 'snr_gain', float_atom, (0, self.params.vna_points*2), "SNR gain")
-        snr_freq = f.create_earray(f.root, 'snr_freq', float_atom, (0, self.params.vna_points*2), "SNR frequency")
-
-        for i, f_cent in enumerate(self.params.target_frequencies_list):
-            self.tuner.target_freq = f_cent
+        n_points = len(self.params.target_frequencies_list)
+        earray = lambda name, atom, title, rows=n_points: data_mgmt.create_earray_2d(f, f.root, name, atom,
+                                                                                    self.params.vna_points*2, title,
+                                                                                    expected_rows=rows)
+        s21_on = earray('s21_on', complex_atom, "S21-on")
+        s21_off = earray('s21_off', complex_atom, "S21-off")
+        s21_on_snr = earray('s21_on_snr', complex_atom, "mean(S21-on-snr)")
+        s21_off_snr = earray('s21_off_snr', complex_atom, "mean(S21-off-snr)")
+        s21_freq = earray('s21_frequency', float_atom, "S21 frequency")
+        snr_gain = earray('snr_gain', float_atom, "SNR gain")
+        snr_freq = earray('snr_freq', float_atom, "SNR frequency")
+        telemetry = f.create_table(f.root, 'telemetry', EvaluationRecord, "Cost function evaluations")
+        telemetry_generations = f.create_table(f.root, 'telemetry_generations', GenerationRecord,
+                                               "Differential evolution generations")
+        # From here on the file is written by the writer thread only
+        writer = data_mgmt.HDF5Writer(f)
+        spool = None
+        if self.params.spool_snr_traces:
+            n_raw = n_points*int(self.params.n_meas_snr)
+            spool = (writer.sink(earray('s21_on_snr_raw', complex_atom, "S21-on-snr", n_raw)),
+                     writer.sink(earray('s21_off_snr_raw', complex_atom, "S21-off-snr", n_raw)))
+
+        try:
+            gain_map = None
+            if self.params.gain_map:
+                # A single coarse map covering all the target frequencies
+                freqs = np.asarray(self.params.target_frequencies_list)
+                with StdOutputCatcher(self.q, self.params.ch_id):
+                    try:
+                        gain_map = self.tuner.gain_map(bias_points=int(self.params.map_bias_points),
+                                                       pump_points=int(self.params.map_pump_points),
+                                                       f_cent=(freqs.min() + freqs.max())/2,
+                                                       span=(freqs.max() - freqs.min() + self.params.target_bandwidth
+                                                             + self.params.frequency_span),
+                                                       path=self.params.save_path + '\\gain_map.h5')
+                    except jt.di.AbortException:
+                        print("Gain map acquisition aborted")
+                        self._abort = False
+                        file.close()
+                        self.q.put({'op': 'stop_optimization', 'args': (self.params.ch_id,)})
+                        return
+
+            de_kwargs = {'popsize': self.params.popsize,
+                         'minpopsize': self.params.minpopsize,
+                         'tol': 0.01,
+                         'std_tol': self.params.std_tol,
+                         'maxiter': self.params.maxiter,
+                         'threshold': self.params.threshold,
+                         'disp': True}
+            for i, f_cent in enumerate(self.params.target_frequencies_list):
+                self.tuner.target_freq = f_cent
+                with StdOutputCatcher(self.q, self.params.ch_id):
+                    print("Target frequency point {0} of {1}: {2} GHz".format(i+1,
+                                                                              len(self.params.target_frequencies_list),
+                                                                              f_cent/1e9))
+                    if gain_map is None:
+                        op, status = self.tuner.find_gain(**de_kwargs)
+                    else:
+                        op, status = self.tuner.find_gain_mapped(gain_map, n_basins=int(self.params.map_basins),
+                                                                 **de_kwargs)
+                t0 = time.time()
+                writer.submit(self._append_records, telemetry, self.tuner.eval_records)
+                writer.submit(self._append_records, telemetry_generations, self.tuner.generation_records)
+                self.tuner.eval_records = []
+                self.tuner.generation_records = []
+                t_hdf5 += time.time() - t0
+                if self._abort:
+                    self._abort = False
+                    break
+                file.write('\n' + op.file_str())
+                file.flush()
+
+                S21on, S21off, Fpoints = self.tuner.vna_snapshot(op)
+                rtol = self.params.snr_rtol if self.params.snr_rtol > 0 else None
+                stats_on, stats_off, snr_Fpoints = self.tuner.snr_snapshot(op, Nmeas=int(self.params.n_meas_snr),
+                                                                           rtol=rtol, spool=spool)
+
+                t0 = time.time()
+                writer.submit(self._add_to_op_store, op)
+                writer.append_row(thumbnail, {'Fs': op.Fs,
+                                              'Fp': op.Fp,
+                                              'G': op.G,
+                                              'Pp': op.Pp,
+                                              'I': op.I,
+                                              'Gsnr': op.Gsnr})
+                writer.append(s21_on, S21on.reshape(1, len(S21on)))
+                writer.append(s21_off, S21off.reshape(1, len(S21off)))
+                writer.append(s21_freq, Fpoints.reshape(1, len(Fpoints)))
+                # Calculate snr gain
+                writer.append(s21_on_snr, stats_on.mean.reshape(1, len(stats_on.mean)))
+                writer.append(s21_off_snr, stats_off.mean.reshape(1, len(stats_off.mean)))
+                writer.append(snr_gain, (stats_on.snr() / stats_off.snr()).reshape(1, len(snr_Fpoints)))
+                writer.append(snr_freq, snr_Fpoints.reshape(1, len(snr_Fpoints)))
+                t_hdf5 += time.time() - t0
+            # Time the acquisition waits for the writer to catch up
+            t0 = time.time()
+            writer.flush()
+            t_hdf5 += time.time() - t0
+            report = writer.submit(self._telemetry_report, telemetry, telemetry_generations, t_hdf5,
+                                   time.time() - t_start).result()
             with StdOutputCatcher(self.q, self.params.ch_id):
-                print("Target frequency point {0} of {1}: {2} GHz".format(i+1,
-                                                                          len(self.params.target_frequencies_list),
-                                                                          f_cent/1e9))
-                op, status = self.tuner.find_gain(popsize=self.params.popsize,
-                                                  minpopsize=self.params.minpopsize,
-                                                  tol=0.01,
-                                                  std_tol=self.params.std_tol,
-                                                  maxiter=self.params.maxiter,
-                                                  threshold=self.params.threshold,
-                                                  disp=True)
-            if self._abort:
-                self._abort = False
-                break
-            file.write('\n' + op.file_str())
-            file.flush()
-            thumbnail['Fs'] = op.Fs
-            thumbnail['Fp'] = op.Fp
-            thumbnail['G'] = op.G
-            thumbnail['Pp'] = op.Pp
-            thumbnail['I'] = op.I
-            thumbnail['Gsnr'] = op.Gsnr
-            thumbnail.append()
-
-            S21on, S21off, Fpoints = self.tuner.vna_snapshot(op)
-            s21_on.append(S21on.reshape(1, len(S21on)))
-            s21_off.append(S21off.reshape(1, len(S21off)))
-            s21_freq.append(Fpoints.reshape(1, len(Fpoints)))
-
-            S21on, S21off, Fpoints = self.tuner.snr_snapshot(op, Nmeas=100)
-            # Calculate snr gain
-            S21on_mean = np.mean(S21on, axis=0)
-            S21off_mean = np.mean(S21off, axis=0)
-            s21_on_snr.append(S21on_mean.reshape(1, len(S21on_mean)))
-            s21_off_snr.append(S21off_mean.reshape(1, len(S21off_mean)))
-            snr_off = abs(S21off_mean) / np.std(np.real(S21off), axis=0)
-            snr_on = abs(S21on_mean) / np.std(np.real(S21on), axis=0)
-            snr_gain.append((snr_on / snr_off).reshape(1, len(Fpoints)))
-            snr_freq.append(Fpoints.reshape(1, len(Fpoints)))
-            f.flush()
-        f.close()
+                print(report)
+            with open(self.params.save_path + '/telemetry_report.txt', 'w') as report_file:
+                report_file.write(report)
+        finally:
+            # Whatever is queued gets written, also on abort or error
+            writer.close()
         file.close()
         self.q.put({'op': 'set_pump_frequency', 'args': (op.Fp, self.params.ch_id,)})
         self.q.put({'op': 'set_pump_power', 'args': (op.Pp, self.params.ch_id,)})
@@ -0,0 +1,223 @@
+import base64
+import json
+import numpy as np
+from nicegui import ui
+
+# Points per trace sent to the browser, about twice the plot width in pixels
+default_trace_points = 2000
+# Heatmap size sent to the browser, about the plot size in pixels
+default_heatmap_columns = 1000
+default_heatmap_rows = 1000
+
+
+def minmax_decimate(x: np.ndarray, y: np.ndarray, n_out: int) -> tuple[np.ndarray, np.ndarray]:
+    """Keeps the minimum and the maximum of y within each of n_out/2 consecutive bins,
+    so narrow peaks and dips of the trace survive the decimation.
+    Traces not longer than n_out are returned as they are."""
+    n = len(y)
+    n_bins = n_out // 2
+    if n <= n_out or n_bins < 1:
+        return x, y
+    k = -(-n // n_bins)
+    # The last bin is padded with its last point
+    y_bins = np.concatenate((y, np.full(n_bins * k - n, y[-1]))).reshape(n_bins, k)
+    offsets = np.arange(n_bins) * k
+    i_min = np.minimum(np.argmin(y_bins, axis=1) + offsets, n - 1)
+    i_max = np.minimum(np.argmax(y_bins, axis=1) + offsets, n - 1)
+    idx = np.sort(np.stack((i_min, i_max), axis=1), axis=1).ravel()
+    return x[idx], y[idx]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> tuple[np.ndarray, np.ndarray]:
+    """Largest-Triangle-Three-Buckets decimation to n_out points. Keeps the visual shape
+    of smooth traces better than min/max binning, at a higher cost."""
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return x, y
+    idx = np.empty(n_out, dtype=int)
+    idx[0] = 0
+    idx[-1] = n - 1
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Average of the next bucket, the last point for the last bucket
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_start = stop if stop < next_stop else next_stop - 1
+        x_avg = np.mean(x[next_start:next_stop])
+        y_avg = np.mean(y[next_start:next_stop])
+        area = np.abs((x[a] - x_avg) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (y_avg - y[a]))
+        a = start + int(np.argmax(area))
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+
+def decimate(x: np.ndarray, y: np.ndarray,
+             n_out: int = default_trace_points,
+             method: str = 'minmax') -> tuple[np.ndarray, np.ndarray]:
+    """Decimates a trace for display.
+
+    Args:
+        x, y: Trace, x sorted.
+        n_out: Maximum number of points.
+        method: 'minmax' or 'lttb'.
+    """
+    if method == 'minmax':
+        return minmax_decimate(x, y, n_out)
+    if method == 'lttb':
+        return lttb(x, y, n_out)
+    raise ValueError("Wrong decimation method {:s}!".format(method))
+
+
+def _typed_array_js(a: np.ndarray, dtype: str) -> str:
+    """JS expression decoding the array passed as base64 encoded binary"""
+    js_types = {'f4': 'Float32Array', 'f8': 'Float64Array'}
+    b64 = base64.b64encode(np.ascontiguousarray(a, dtype='<' + dtype).tobytes()).decode('ascii')
+    return "new {:s}(Uint8Array.from(atob('{:s}'), c => c.charCodeAt(0)).buffer)".format(js_types[dtype], b64)
+
+
+def update_trace(plot: ui.plotly, fig: dict, trace_id: int,
+                 x: np.ndarray, y: np.ndarray, name: str | None = None) -> None:
+    """Replaces the data of one trace of a plot in the browser.
+
+    Only this trace is sent, as binary typed arrays, x in double and y in single precision,
+    and the plot is redrawn by Plotly.react, which recalculates the changed trace only.
+    The figure dict is updated too, so later full updates of the plot show the same data.
+    """
+    trace = fig['data'][trace_id]
+    trace['x'] = x
+    trace['y'] = y
+    if name is not None:
+        trace['name'] = name
+    if plot is None:
+        return
+    js = ("(() => {{const c = getElement({:d}); if (!c) return; "
+          "const t = c.options.data[{:d}]; t.x = {:s}; t.y = {:s}; t.name = {:s}; c.update();}})()")
+    plot.client.run_javascript(js.format(plot.id, trace_id,
+                                         _typed_array_js(x, 'f8'),
+                                         _typed_array_js(y, 'f4'),
+                                         json.dumps(trace['name'])))
+
+
+def _block_mean(a: np.ndarray, k: int, axis: int = -1) -> np.ndarray:
+    """Means of k consecutive elements along axis, the last block may be shorter"""
+    if k == 1:
+        return a
+    a = np.moveaxis(a, axis, -1)
+    n = a.shape[-1]
+    pad = -n % k
+    if pad:
+        a = np.concatenate((a, np.full(a.shape[:-1] + (pad,), np.nan)), axis=-1)
+    res = np.nanmean(a.reshape(a.shape[:-1] + (-1, k)), axis=-1)
+    return np.moveaxis(res, -1, axis)
+
+
+class HeatmapStream:
+    """Append-only updates of a heatmap growing by columns, like the bias sweep plot.
+
+    The heatmap trace is kept transposed, z is a list of columns, so new columns are
+    appended to the plot in the browser instead of sending the whole heatmap again.
+    Rows are averaged down to max_rows. Columns are averaged in bins of k, where k is the
+    smallest power of two keeping the number of bins within max_columns. The last bin
+    may be incomplete; it is then replaced by the next update. The whole heatmap is
+    sent only when k doubles, the rows change, or the data shrinks, e.g. a new file.
+
+    Args:
+        max_columns: Maximum number of columns sent to the browser.
+        max_rows: Maximum number of rows sent to the browser.
+    """
+    def __init__(self, max_columns: int = default_heatmap_columns, max_rows: int = default_heatmap_rows):
+        self.max_columns = max_columns
+        self.max_rows = max_rows
+        self.reset()
+
+    def reset(self) -> None:
+        """Send the whole heatmap with the next update"""
+        self._k = 1
+        self._r = 1
+        self._y: np.ndarray | None = None
+        self._n_cols = 0  # Columns of the data shown
+        self._partial = False  # The last column shown is an incomplete bin
+
+    def _bins(self, x: np.ndarray, z: np.ndarray, start: int) -> tuple[np.ndarray, np.ndarray]:
+        """Binned columns from start on, start is at a bin boundary"""
+        return _block_mean(x[start:], self._k), _block_mean(_block_mean(z[start:], self._r, axis=1), self._k, axis=0)
+
+    def update(self, plot: ui.plotly, fig: dict, trace_id: int,
+               x: np.ndarray, y: np.ndarray, z: np.ndarray,
+               attrs: dict | None = None,
+               other_traces: dict[int, dict] | None = None) -> None:
+        """Shows the heatmap data, sending only the columns added since the last update.
+
+        Args:
+            plot: The plot, or None to update the figure dict only.
+            fig: The figure dict of the plot.
+            trace_id: The heatmap trace.
+            x: Column coordinates.
+            y: Row coordinates.
+            z: Data, one row per column, shape (len(x), len(y)).
+            attrs: Other attributes of the heatmap trace to set, e.g. zmin and zmax.
+            other_traces: Attributes of the other traces to set, keyed by trace id.
+                          They are sent as JSON, so these must be small.
+        """
+        attrs = {} if attrs is None else attrs
+        other_traces = {} if other_traces is None else other_traces
+        n_cols = len(x)
+        k = 1
+        while -(-n_cols // k) > self.max_columns:
+            k *= 2
+        r = max(1, -(-len(y) // self.max_rows))
+        trace = fig['data'][trace_id]
+        trace.update(attrs)
+        for other_id, other_attrs in other_traces.items():
+            fig['data'][other_id].update(other_attrs)
+        if not n_cols:
+            self.reset()
+            trace.update({'x': [], 'y': [], 'z': []})
+            if plot is not None:
+                plot.update()
+            return
+        if k != self._k or r != self._r or self._y is None or len(y) != len(self._y) or \
+                np.any(y != self._y) or n_cols < self._n_cols:
+            self._k = k
+            self._r = r
+            self._y = np.array(y)
+            x_bins, z_bins = self._bins(x, z, 0)
+            trace['x'] = list(x_bins)
+            trace['y'] = _block_mean(self._y, r)
+            trace['z'] = list(z_bins)
+            trace['transpose'] = True
+            self._n_cols = n_cols
+            self._partial = n_cols % k != 0
+            if plot is not None:
+                plot.update()
+            return
+        # The incomplete bin shown is recomputed from its first column
+        start = (self._n_cols // k) * k
+        x_bins, z_bins = self._bins(x, z, start)
+        drop = self._partial
+        if drop:
+            trace['x'].pop()
+            trace['z'].pop()
+        trace['x'] += list(x_bins)
+        trace['z'] += list(z_bins)
+        self._n_cols = n_cols
+        self._partial = n_cols % k != 0
+        if plot is None:
+            return
+        js = ("(() => {{const c = getElement({:d}); if (!c) return; "
+              "const t = c.options.data[{:d}]; "
+              "if ({:s}) {{t.x.pop(); t.z.pop();}} "
+              "const x = {:s}; const z = {:s}; const m = {:d}; "
+              "for (let i = 0; i < x.length; i++) {{t.x.push(x[i]); t.z.push(Array.from(z.subarray(i*m, (i+1)*m)));}} "
+              "Object.assign(t, {:s}); "
+              "const o = {:s}; for (const i in o) Object.assign(c.options.data[i], o[i]); "
+              "c.options.layout.datarevision = (c.options.layout.datarevision || 0) + 1; "
+              "c.update();}})()")
+        plot.client.run_javascript(js.format(plot.id, trace_id,
+                                             'true' if drop else 'false',
+                                             _typed_array_js(x_bins, 'f8'),
+                                             _typed_array_js(z_bins.ravel(), 'f4'),
+                                             z_bins.shape[1] if len(z_bins) else 0,
+                                             json.dumps(attrs),
+                                             json.dumps(other_traces)))
@@ -0,0 +1,145 @@
+import threading
+import collections
+from typing import Any, Hashable
+
+from .measurement_scheduler import MeasurementScheduler
+
+class FairRLock:
+    """Reentrant lock granted to the waiting threads in the order of request.
+
+    No later request overtakes a waiting one, so a thread reacquiring the lock in a loop
+    never starves the others. The holder can reacquire the lock. Grants to a new holder
+    are counted in n_grants, so a holder can tell if somebody else has held the lock since.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._owner: int | None = None
+        self._depth = 0
+        self.n_grants = 0
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """Returns False if the lock has not been granted within timeout."""
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._depth += 1
+                return True
+            ticket = object()
+            self._queue.append(ticket)
+            granted = self._cond.wait_for(lambda: self._owner is None and self._queue[0] is ticket, timeout)
+            self._queue.remove(ticket)
+            if granted:
+                self._owner = me
+                self._depth = 1
+                self.n_grants += 1
+            # The next request in the queue may be granted if this one has timed out
+            self._cond.notify_all()
+            return granted
+
+    def release(self) -> None:
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner != me:
+                raise RuntimeError("Lock is not held by this thread!")
+            self._depth -= 1
+            if not self._depth:
+                self._owner = None
+            self._cond.notify_all()
+
+    def status(self) -> tuple[bool, int]:
+        """Whether the lock is held and the number of waiting requests"""
+        with self._cond:
+            return self._owner is not None, len(self._queue)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+
+class Lease:
+    """Locks of several devices held together. Returned by ResourceManager.lease()."""
+    def __init__(self, manager: 'ResourceManager', keys: list[Hashable]):
+        self._manager = manager
+        self.keys = keys
+        self._held: list[Hashable] = []
+        # FairRLock.n_grants of each device lock when acquired
+        self.grants: dict[Hashable, int] = {}
+
+    def _acquire(self, timeout: float | None) -> None:
+        for key in self.keys:
+            lock = self._manager.lock(key)
+            if not lock.acquire(timeout):
+                self.release()
+                raise TimeoutError("Device {} is busy!".format(key))
+            self._held.append(key)
+            self.grants[key] = lock.n_grants
+
+    def release(self) -> None:
+        while len(self._held):
+            key = self._held.pop()
+            self._manager.invalidate(key)
+            self._manager.lock(key).release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+
+class ResourceManager:
+    """Hands out leases on the physical devices shared by the routines of the HW process.
+
+    Devices are identified by keys, driver name and address for the instruments. Every
+    routine calling a device holds a lease on it, since any call may depend on the device
+    state, including selection of the physical channel. Leases on several devices are
+    acquired in the key order, so routines using overlapping sets of devices do not
+    deadlock, while routines using independent devices run in parallel.
+    The measurement schedulers time-multiplexing a device between concurrent routines
+    lock it with the same lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks: dict[Hashable, FairRLock] = {}
+        self._schedulers: dict[Hashable, MeasurementScheduler] = {}
+
+    def _get_lock(self, key: Hashable) -> FairRLock:
+        if key not in self._locks:
+            self._locks.update({key: FairRLock()})
+        return self._locks[key]
+
+    def lock(self, key: Hashable) -> FairRLock:
+        with self._lock:
+            return self._get_lock(key)
+
+    def scheduler(self, key: Hashable, dev_inst: Any, state_methods: tuple = ()) -> MeasurementScheduler:
+        """Scheduler of the device, a new one if the device has been reconnected"""
+        with self._lock:
+            if key not in self._schedulers or self._schedulers[key].dev_inst is not dev_inst:
+                self._schedulers.update({key: MeasurementScheduler(dev_inst, state_methods, self._get_lock(key))})
+            return self._schedulers[key]
+
+    def invalidate(self, key: Hashable) -> None:
+        """The device has been used bypassing its scheduler. Must be called with the lock held."""
+        scheduler = self._schedulers.get(key)
+        if scheduler is not None:
+            scheduler.invalidate()
+
+    def lease(self, *keys: Hashable, timeout: float | None = None) -> Lease:
+        """Acquires a lease on the devices. Use as a context manager or release() it.
+
+        Raises:
+            TimeoutError: If the devices are not available within timeout.
+        """
+        lease = Lease(self, sorted(set(keys), key=repr))
+        lease._acquire(timeout)
+        return lease
+
+    def status(self) -> dict[Hashable, tuple[bool, int]]:
+        with self._lock:
+            locks = dict(self._locks)
+        return {key: lock.status() for key, lock in locks.items()}
@@ -1,26 +1,183 @@
 import sys
+import time
+import threading
 import multiprocessing as mp
+from typing import TextIO
+
+
+class LogBatcher:
+    """Lines logged to a UI channel, sent as one log_push message per flush.
+
+    Consecutive repeats of a line are collapsed to a count, and the lines beyond max_rate
+    per second are dropped and counted, so a chatty routine doesn't flood the feedback queue.
+
+    Args:
+        q: Feedback queue.
+        ui_ch: UI channel of the log.
+        max_rate: Maximum number of lines per second, bursts of up to one second are passed.
+    """
+    def __init__(self, q: mp.Queue, ui_ch: int, max_rate: float = 20.):
+        self.q = q
+        self.ui_ch = ui_ch
+        self.max_rate = max_rate
+        self._lock = threading.Lock()
+        self._lines: list[str] = []
+        self._last_line: str | None = None
+        self._n_repeats = 0
+        self._n_dropped = 0
+        # Token bucket of the rate limit
+        self._tokens = max_rate
+        self._t = time.monotonic()
+
+    def _close_repeats(self) -> None:
+        if self._n_repeats:
+            self._lines.append("Last line repeated {:d} times".format(self._n_repeats))
+            self._n_repeats = 0
+
+    def push(self, line: str) -> None:
+        with self._lock:
+            if line == self._last_line:
+                self._n_repeats += 1
+                return
+            now = time.monotonic()
+            self._tokens = min(self.max_rate, self._tokens + (now - self._t)*self.max_rate)
+            self._t = now
+            if self._tokens < 1:
+                self._n_dropped += 1
+                return
+            self._tokens -= 1
+            self._close_repeats()
+            self._last_line = line
+            self._lines.append(line)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._close_repeats()
+            if self._n_dropped:
+                self._lines.append("{:d} lines dropped, log rate limit is {:g} lines/s".
+                                   format(self._n_dropped, self.max_rate))
+                self._n_dropped = 0
+            if not len(self._lines):
+                return
+            msg = '\n'.join(self._lines)
+            self._lines = []
+        self.q.put({'op': 'log_push', 'args': (msg, self.ui_ch)})
+
+
+class _StdoutRouter:
+    """sys.stdout replacement routing the output of each thread by its log channel.
+
+    Lines printed by a thread with a batcher set go to the batcher, the output of the other
+    threads goes to the original stdout. Installed while any StdOutputCatcher is active.
+    The batchers are flushed by a background thread every flush_interval.
+    """
+    _instance: '_StdoutRouter | None' = None
+    _n_users = 0
+    _install_lock = threading.Lock()
+
+    def __init__(self, stdout: TextIO, flush_interval: float):
+        self.stdout = stdout
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._batchers: set[LogBatcher] = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='LogFlusher', daemon=True)
+
+    @classmethod
+    def acquire(cls, flush_interval: float) -> '_StdoutRouter':
+        with cls._install_lock:
+            if cls._instance is None:
+                cls._instance = cls(sys.stdout, flush_interval)
+                cls._instance._thread.start()
+                sys.stdout = cls._instance
+            cls._n_users += 1
+            return cls._instance
+
+    @classmethod
+    def release(cls) -> None:
+        with cls._install_lock:
+            cls._n_users -= 1
+            if cls._n_users or cls._instance is None:
+                return
+            router = cls._instance
+            cls._instance = None
+            # Leave stdout alone if somebody else has replaced it meanwhile
+            if sys.stdout is router:
+                sys.stdout = router.stdout
+        router._stop.set()
+        router._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            for batcher in list(self._batchers):
+                batcher.flush()
+
+    def route(self, batcher: LogBatcher | None) -> tuple[LogBatcher | None, str]:
+        """Routes the output of the calling thread to the batcher, or to stdout if None.
+
+        Returns:
+            Previous batcher and incomplete line of the thread.
+        """
+        prev = getattr(self._local, 'batcher', None), getattr(self._local, 'buf', '')
+        if batcher is not None:
+            self._batchers.add(batcher)
+        self._local.batcher = batcher
+        self._local.buf = ''
+        return prev
+
+    def unroute(self, prev: tuple[LogBatcher | None, str]) -> None:
+        """Restores the routing returned by route(), flushing the current batcher"""
+        batcher = getattr(self._local, 'batcher', None)
+        if batcher is not None:
+            if self._local.buf:
+                batcher.push(self._local.buf)
+            self._batchers.discard(batcher)
+            batcher.flush()
+        self._local.batcher, self._local.buf = prev
+
+    def write(self, msg: str) -> int:
+        batcher = getattr(self._local, 'batcher', None)
+        if batcher is None:
+            return self.stdout.write(msg)
+        *lines, self._local.buf = (self._local.buf + msg).split('\n')
+        for line in lines:
+            batcher.push(line)
+        return len(msg)
+
+    def flush(self) -> None:
+        if getattr(self._local, 'batcher', None) is None:
+            self.stdout.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.stdout, name)
+
 
 class StdOutputCatcher:
+    """Sends the output printed by the calling thread to the log of a UI channel.
+
+    Only the calling thread is redirected, the other threads keep printing to their own
+    channel or to the console, so routines of different channels run concurrently. Lines
+    are sent in batches every flush_interval, see LogBatcher for the rate limit.
+    Catchers can be nested.
+    """
+    # Interval of sending the lines caught, s
+    flush_interval = 0.2
+    # Maximum number of lines per second sent to a log
+    max_rate = 20.
+
     def __init__(self, q: mp.Queue, ui_ch: int):
         self.ui_ch = ui_ch
         self.q = q
-        self._stdout = None
-        self._buf = ''
+        self._batcher = LogBatcher(q, ui_ch, self.max_rate)
+        self._router: _StdoutRouter | None = None
+        self._prev: tuple[LogBatcher | None, str] = (None, '')
 
     def __enter__(self):
-        self._stdout = sys.stdout
-        sys.stdout = self
+        self._router = _StdoutRouter.acquire(self.flush_interval)
+        self._prev = self._router.route(self._batcher)
         return self
 
     def __exit__(self, type, value, traceback):
-        sys.stdout = self._stdout
-
-    def write(self, msg: str) -> None:
-        self._buf += msg
-        if msg[-1] == '\n':
-            self.flush()
-
-    def flush(self):
-        self.q.put({'op': 'log_push', 'args': (self._buf, self.ui_ch)})
-        self._buf = ''
+        self._router.unroute(self._prev)
+        self._router = None
+        _StdoutRouter.release()
@@ -0,0 +1,81 @@
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class TraceRing:
+    """Ring of trace slots in shared memory passing live view traces between processes.
+
+    The writer copies a trace into the next slot and sends only the slot number and
+    its sequence number over the queue. Each slot has a sequence number which is odd
+    while the slot is being written, so a reader detects a slot overwritten during or
+    before its copy and drops that frame instead of showing a torn trace.
+
+    Args:
+        name: Name of an existing ring to attach to. A new ring is created if None.
+        n_slots: Number of slots of a new ring.
+        max_points: Maximum number of points per trace of a new ring.
+    """
+    def __init__(self, name: str | None = None, n_slots: int = 16, max_points: int = 20001):
+        header_size = 2 * 8
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True,
+                                                   size=header_size + n_slots * (16 + 2 * max_points * 8))
+            self._shm.buf[:header_size] = np.array([n_slots, max_points], dtype=np.int64).tobytes()
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            n_slots, max_points = np.frombuffer(self._shm.buf, dtype=np.int64, count=2)
+        self.n_slots = int(n_slots)
+        self.max_points = int(max_points)
+        # Sequence number and number of points of each slot
+        self._headers = np.ndarray((self.n_slots, 2), dtype=np.int64, buffer=self._shm.buf, offset=header_size)
+        self._data = np.ndarray((self.n_slots, 2, self.max_points), dtype=np.float64, buffer=self._shm.buf,
+                                offset=header_size + self.n_slots * 16)
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def write(self, x: np.ndarray, y: np.ndarray) -> tuple[int, int] | None:
+        """Copies a trace into the next slot.
+
+        Returns:
+            Slot number and sequence number to be sent to the reader, or None if
+            the trace is longer than max_points.
+        """
+        n = len(x)
+        if n > self.max_points:
+            return None
+        with self._lock:
+            slot = self._next_slot
+            self._next_slot = (slot + 1) % self.n_slots
+            header = self._headers[slot]
+            seq = int(header[0]) + 1
+            header[0] = seq  # Odd: being written
+            self._data[slot, 0, :n] = x
+            self._data[slot, 1, :n] = y
+            header[1] = n
+            header[0] = seq + 1
+        return slot, seq + 1
+
+    def read(self, slot: int, seq: int) -> np.ndarray | None:
+        """Copy of the trace written to slot with the sequence number seq as a (2, n) array,
+        None if the slot has been overwritten since."""
+        header = self._headers[slot]
+        if header[0] != seq:
+            return None
+        n = int(header[1])
+        data = self._data[slot, :, :n].copy()
+        if header[0] != seq:
+            return None
+        return data
+
+    def close(self) -> None:
+        del self._headers, self._data
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """Frees the shared memory. Called by the creator when all processes are done."""
+        self._shm.unlink()
@@ -1,7 +1,9 @@
+import asyncio
+import functools
 import queue
 import traceback as tb
 from dataclasses import fields
-from typing import Any
+from typing import Any, Awaitable, Callable
 import numpy as np
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
@@ -13,7 +15,10 @@ from . import data_structures as ds
 from .file_picker.local_file_picker import local_file_picker
 from .hdf5_gain import HDF5GainFile
 from .hdf5_bias_sweep import HDF5BiasSweepFile
+from .optimization import op_store_name
+from ..operating_point_store import OperatingPointStore
 from . import config_handler as ch
+from .latency_trace import LatencyTracer
 
 
 class UiCallbacks:
@@ -24,18 +29,27 @@ class UiCallbacks:
         self._executor = ThreadPoolExecutor(max_workers=1)
         self._param_inc_dec_future: Future | None = None
         self._param_inc_dec_stop = False
+        # End-to-end latency of the commands sent, disabled by default
+        self.tracer = LatencyTracer()
+        # Live view state last sent to the HW process
+        self._live_view_sent: dict[int, bool] = {}
+        # Files are read and processed in this thread, off the UI event loop
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='FileLoader')
+        # Latest request waiting for the file of a plot, keyed by (kind, ch_id)
+        self._file_requests: dict[tuple[str, int], dict] = {}
+        self._busy_files: set[tuple[str, int]] = set()
 
     def _connect_device(self, device: ds.Device, ui_ch: int) -> None:
-        self.q_command.put({'op': device.connect_method,
-                            'args': (device.driver_name,
-                                     device.class_name,
-                                     device.address,
-                                     device.channel,
-                                     ui_ch)})
+        self.q_command.put(self.tracer.start({'op': device.connect_method,
+                                              'args': (device.driver_name,
+                                                       device.class_name,
+                                                       device.address,
+                                                       device.channel,
+                                                       ui_ch)}))
 
     def _disconnect_device(self, device: ds.Device, ch_id: int) -> None:
-        self.q_command.put({'op': device.disconnect_method,
-                            'args': (ch_id,)})
+        self.q_command.put(self.tracer.start({'op': device.disconnect_method,
+                                              'args': (ch_id,)}))
 
     def setup_device(self, dev: ds.Device, ch_id: int) -> None:
         if dev.is_connected.value:
@@ -58,7 +72,7 @@ class UiCallbacks:
                         # VNA is a complicated device so it's better to reset setting to default first
                         vna_entry = [attr.driver_name,attr.class_name,attr.address]
                         if vna_entry not in vna_entries:
-                            self.q_command.put({'op': 'vna_preset', 'args': (ch_id,)})
+                            self.q_command.put(self.tracer.start({'op': 'vna_preset', 'args': (ch_id,)}))
                             vna_entries += vna_entry
                     self.setup_device(attr, ch_id)
 
@@ -128,7 +142,7 @@ class UiCallbacks:
     def queue_param(self, ch_id, val: Any, p: ds.UIParameter) -> bool:
         if p.enabled:
             try:
-                self.q_command.put({'op': p.method, 'args': (val, ch_id)})
+                self.q_command.put(self.tracer.start({'op': p.method, 'args': (val, ch_id)}))
             except queue.Full:
                 p.update_str()
                 return False
@@ -137,9 +151,19 @@ class UiCallbacks:
             return True
         return False
 
+    def export_latency_trace(self) -> str:
+        """Saves the command spans traced to the data folder. Returns the message to show."""
+        pth = Path(self.ui_objects.data_folder) / 'latency_trace.csv'
+        try:
+            n = self.tracer.export(str(pth))
+        except OSError:
+            tb.print_exc()
+            return "Unable to write file:" + str(pth)
+        return "{:d} command spans saved to {:s}".format(n, str(pth))
+
     def _queue_command(self, op: str, args: tuple) -> bool:
         try:
-            self.q_command.put({'op': op, 'args': args})
+            self.q_command.put(self.tracer.start({'op': op, 'args': args}))
         except queue.Full:
             return False
         else:
@@ -155,26 +179,102 @@ class UiCallbacks:
                                          upper_limit=self.ui_objects.data_folder)
         return result
 
-    async def pick_gain_file(self, ch_id: int) -> None:
+    async def _run_in_loader(self, func: Callable, *args, **kwargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._loader,
+                                                                functools.partial(func, *args, **kwargs))
+
+    async def _submit_file_request(self, kind: str, ch_id: int, request: dict,
+                                   handler: Callable[[int, dict], Awaitable[None]]) -> None:
+        """Processes the requests for the file of a plot one at a time with handler.
+
+        A request submitted while another one is processed waits, replacing the one waiting
+        before, except that a refresh of the file shown never replaces an open or close
+        request. The request processed checks _is_superseded() and drops its result if another
+        file has been requested meanwhile. The tab flag <kind>_file_loading is set meanwhile.
+
+        Args:
+            kind: 'gain' or 'bias_sweep'.
+            request: {'op': 'open'|'refresh'|'close', ...}
+        """
+        key = (kind, ch_id)
+        if request['op'] == 'refresh' and key in self._file_requests:
+            return
+        self._file_requests.update({key: request})
+        if key in self._busy_files:
+            return
+        self._busy_files.add(key)
         tab = self.ui_objects.channel_tabs[ch_id]
+        setattr(tab, kind + '_file_loading', True)
+        try:
+            while key in self._file_requests:
+                try:
+                    await handler(ch_id, self._file_requests.pop(key))
+                except Exception:
+                    tb.print_exc()
+        finally:
+            self._busy_files.discard(key)
+            setattr(tab, kind + '_file_loading', False)
+
+    def _is_superseded(self, kind: str, ch_id: int) -> bool:
+        """Another file has been requested for the plot since the request processed"""
+        request = self._file_requests.get((kind, ch_id))
+        return request is not None and request['op'] != 'refresh'
+
+    async def pick_gain_file(self, ch_id: int) -> None:
         result = await self._channel_dir_file_picker(ch_id)
         if result is not None:
-            result = result[0]
-            try:
-                tab.gain_file = HDF5GainFile(result, mode='r')
-            except Exception:
-                tab.log.push("Unable to open file:" + result)
-                tb.print_exc()
-            else:
-                tab.log.push("Opened gain file:" + result)
-                tab.gain_file_toolbar_enabled = True
-                if not self.update_gain_plot_from_file(ch_id):
-                    self.close_gain_file(ch_id)
+            await self.open_gain_file(result[0], ch_id)
+
+    async def open_gain_file(self, path: str, ch_id: int) -> None:
+        await self._submit_file_request('gain', ch_id, {'op': 'open', 'path': path}, self._process_gain_request)
+
+    async def update_gain_plot_from_file(self, ch_id: int) -> None:
+        await self._submit_file_request('gain', ch_id, {'op': 'refresh'}, self._process_gain_request)
+
+    @staticmethod
+    def _read_gain_file(gain_file: HDF5GainFile) -> dict:
+        data = gain_file.get_data()
+        if data['status']:
+            # Cached for the bias sweep plot overlay
+            gain_file.thumbnail()
+        return data
 
-    def update_gain_plot_from_file(self, ch_id: int) -> bool:
+    async def _process_gain_request(self, ch_id: int, request: dict) -> None:
+        tab = self.ui_objects.channel_tabs[ch_id]
+        if request['op'] == 'close':
+            if tab.gain_file is not None:
+                await self._close_gain_file(ch_id)
+            return
+        if request['op'] == 'refresh':
+            if tab.gain_file is not None:
+                data = await self._run_in_loader(tab.gain_file.get_data)
+                if not self._is_superseded('gain', ch_id):
+                    self.show_gain_record(ch_id, data)
+            return
+        path = request['path']
+        try:
+            gain_file = await self._run_in_loader(HDF5GainFile, path, mode='r')
+        except Exception:
+            tab.log.push("Unable to open file:" + path)
+            tb.print_exc()
+            return
+        data = await self._run_in_loader(self._read_gain_file, gain_file)
+        if self._is_superseded('gain', ch_id):
+            await self._run_in_loader(gain_file.close)
+            return
+        if tab.gain_file is not None:
+            await self._run_in_loader(tab.gain_file.close)
+        tab.gain_file = gain_file
+        tab.log.push("Opened gain file:" + path)
+        tab.gain_file_toolbar_enabled = True
+        if not self.show_gain_record(ch_id, data):
+            await self._close_gain_file(ch_id)
+
+    def show_gain_record(self, ch_id: int, data: dict) -> bool:
+        """Shows a record read from the gain file"""
         tab = self.ui_objects.channel_tabs[ch_id]
-        data = tab.gain_file.get_data()
         if data['status']:
+            tab.gain_file_data = data
             gain_trace_id = self.ui_objects.gain_plot_traces.file_gain
             snr_gain_trace_id = self.ui_objects.gain_plot_traces.file_snr_gain
             tab.gain_fig['data'][gain_trace_id]['x'] = data['frequency']
@@ -274,17 +374,20 @@ class UiCallbacks:
             pass
         tab.gain_plot.update()
 
-    def browse_gain_file_left(self, ch_id: int):
+    async def browse_gain_file_left(self, ch_id: int):
         tab = self.ui_objects.channel_tabs[ch_id]
-        if tab.gain_file.backward():
-            self.update_gain_plot_from_file(ch_id)
+        if tab.gain_file is not None and tab.gain_file.backward():
+            await self.update_gain_plot_from_file(ch_id)
 
-    def browse_gain_file_right(self, ch_id: int) -> None:
+    async def browse_gain_file_right(self, ch_id: int) -> None:
         tab = self.ui_objects.channel_tabs[ch_id]
-        if tab.gain_file.forward():
-            self.update_gain_plot_from_file(ch_id)
+        if tab.gain_file is not None and tab.gain_file.forward():
+            await self.update_gain_plot_from_file(ch_id)
+
+    async def close_gain_file(self, ch_id: int) -> None:
+        await self._submit_file_request('gain', ch_id, {'op': 'close'}, self._process_gain_request)
 
-    def close_gain_file(self, ch_id: int) -> None:
+    async def _close_gain_file(self, ch_id: int) -> None:
         tab = self.ui_objects.channel_tabs[ch_id]
         fig = tab.gain_fig
         fig['data'][2] = dict(ds.default_gain_fig_data)
@@ -292,94 +395,139 @@ class UiCallbacks:
         fig['layout']['annotations'][0]['text'] = ''
         tab.gain_plot.update()
         tab.log.push("Gain file closed:" + tab.gain_file.filename)
-        tab.gain_file.close()
-        del tab.gain_file
+        gain_file = tab.gain_file
+        tab.gain_file = None
+        tab.gain_file_data = None
         tab.gain_file_toolbar_enabled = False
+        await self._run_in_loader(gain_file.close)
 
     async def pick_bias_sweep_file(self, ch_id: int) -> None:
         result = await self._channel_dir_file_picker(ch_id)
         if result is not None:
             result = result[0]
-            self.open_bias_sweep_file(result, ch_id)
-
-    def open_bias_sweep_file(self, path: str,
-                             ch_id: int,
-                             log: bool = True,
-                             cb_autoscale=True) -> None:
+            await self.open_bias_sweep_file(result, ch_id)
+
+    async def open_bias_sweep_file(self, path: str,
+                                   ch_id: int,
+                                   log: bool = True,
+                                   cb_autoscale=True) -> None:
+        await self._submit_file_request('bias_sweep', ch_id,
+                                        {'op': 'open', 'path': path, 'log': log, 'cb_autoscale': cb_autoscale},
+                                        self._process_bias_sweep_request)
+
+    async def update_bias_sweep_plot_from_file(self, ch_id: int, cb_autoscale=True) -> None:
+        await self._submit_file_request('bias_sweep', ch_id,
+                                        {'op': 'refresh', 'cb_autoscale': cb_autoscale},
+                                        self._process_bias_sweep_request)
+
+    async def _process_bias_sweep_request(self, ch_id: int, request: dict) -> None:
         tab = self.ui_objects.channel_tabs[ch_id]
-        old_filename = ''
-        if tab.bias_sweep_file is not None:
-            old_filename = tab.bias_sweep_file.filename
-            tab.bias_sweep_file.close()
+        old_file = tab.bias_sweep_file
+        if request['op'] == 'close':
+            if old_file is not None:
+                await self._close_bias_sweep_file(ch_id)
+            return
+        if request['op'] == 'refresh':
+            if old_file is None:
+                return
+            path = old_file.filename
+            log = False
+        else:
+            path = request['path']
+            log = request['log']
+        same_file = old_file is not None and old_file.filename == path
+        if same_file:
+            # Closed first, so the file reopened sees the rows appended since. The closed
+            # instance keeps the rows read so far, it stays current until the reopen succeeds.
+            await self._run_in_loader(old_file.close)
+        bias_sweep_file = None
         try:
-            tab.bias_sweep_file = HDF5BiasSweepFile(path, mode='r')
+            bias_sweep_file = await self._run_in_loader(HDF5BiasSweepFile, path, mode='r')
+            if old_file is not None:
+                # Reopened to see new rows of a running sweep, only those are read
+                bias_sweep_file.adopt_cache(old_file)
+            data = await self._run_in_loader(bias_sweep_file.get_data)
         except Exception:
-            tab.bias_sweep_file = HDF5BiasSweepFile(old_filename, mode='r')
-            tab.log.push("Unable to open file:" + path)
+            data = {'status': False, 'message': "Unable to read file:" + path}
             tb.print_exc()
-        else:
-            if log:
-                tab.log.push("Opened bias sweep file:" + path)
-            tab.bias_sweep_file_toolbar_enabled = True
-            if not self.update_bias_sweep_plot(ch_id, cb_autoscale):
-                self.close_bias_sweep_file(ch_id)
-
-    def update_bias_sweep_plot_from_file(self, ch_id: int, cb_autoscale=True) -> None:
-        tab = self.ui_objects.channel_tabs[ch_id]
-        if tab.bias_sweep_file is not None:
-            filename = tab.bias_sweep_file.filename
-            self.open_bias_sweep_file(filename, ch_id, log=False,
-                                      cb_autoscale=cb_autoscale)
+        if not data['status']:
+            # The current file and plot are kept, a failed refresh is retried on the next one.
+            # The file is closed only by the user.
+            tab.log.push(data['message'])
+            if bias_sweep_file is not None:
+                await self._run_in_loader(bias_sweep_file.close)
+            return
+        if not same_file:
+            if self._is_superseded('bias_sweep', ch_id):
+                await self._run_in_loader(bias_sweep_file.close)
+                return
+            if old_file is not None:
+                await self._run_in_loader(old_file.close)
+            tab.bias_sweep_stream.reset()
+        tab.bias_sweep_file = bias_sweep_file
+        if self._is_superseded('bias_sweep', ch_id):
+            return
+        if log:
+            tab.log.push("Opened bias sweep file:" + path)
+        tab.bias_sweep_file_toolbar_enabled = True
+        self.update_bias_sweep_plot(ch_id, data, request['cb_autoscale'])
 
-    def update_bias_sweep_plot(self, ch_id: int, cb_autoscale: bool = False) -> bool:
+    def update_bias_sweep_plot(self, ch_id: int, data: dict, cb_autoscale: bool = False) -> bool:
+        """Shows the data read from the bias sweep file"""
         tab = self.ui_objects.channel_tabs[ch_id]
-        data = tab.bias_sweep_file.get_data()
         if data['status']:
             trace = self.ui_objects.bias_sweep_plot_traces.sweep_data
-            tab.bias_sweep_fig['data'][trace]['x'] = data['current']
-            tab.bias_sweep_fig['data'][trace]['y'] = data['frequency']
-            tab.bias_sweep_fig['data'][trace]['z'] = data['delay'].tolist()
+            overlays = {}
             # Operation point overlay
             overlay_trace = self.ui_objects.bias_sweep_plot_traces.operation_point_overlay
-            tab.bias_sweep_fig['data'][overlay_trace]['x'] = \
-                [tab.chan.bias_source.current.value/tab.bias_sweep_file.i_unit]
-            tab.bias_sweep_fig['data'][overlay_trace]['y'] = \
-                [tab.chan.pump_source.frequency.value/2/tab.bias_sweep_file.f_unit]
+            overlays[overlay_trace] = {
+                'x': [tab.chan.bias_source.current.value/tab.bias_sweep_file.i_unit],
+                'y': [tab.chan.pump_source.frequency.value/2/tab.bias_sweep_file.f_unit]}
             # Gain file overlay
             if tab.gain_file is not None:
                 x_overlay = []
                 y_overlay = []
-                for record in tab.gain_file.root.thumbnail:
-                    x_overlay += [record['I']/tab.gain_file.i_unit]
-                    y_overlay += [record['Fs']/tab.gain_file.f_unit]
+                for record in tab.gain_file.thumbnail():
+                    x_overlay += [float(record['I']/tab.gain_file.i_unit)]
+                    y_overlay += [float(record['Fs']/tab.gain_file.f_unit)]
                 overlay_trace = self.ui_objects.bias_sweep_plot_traces.gain_file_points_overlay
-                tab.bias_sweep_fig['data'][overlay_trace]['x'] = x_overlay
-                tab.bias_sweep_fig['data'][overlay_trace]['y'] = y_overlay
+                overlays[overlay_trace] = {'x': x_overlay, 'y': y_overlay}
             if cb_autoscale and len(data['delay']):
-                zmin = np.min(data['delay'])
-                zmax = np.max(data['delay'])
+                zmin = float(np.min(data['delay']))
+                zmax = float(np.max(data['delay']))
             else:
                 zmin = tab.bias_sweep_cb_min.get_value()
                 zmax = tab.bias_sweep_cb_max.get_value()
-            tab.bias_sweep_fig['data'][trace]['zmin'] = zmin
-            tab.bias_sweep_fig['data'][trace]['zmax'] = zmax
             tab.bias_sweep_cb_min.update(zmin)
             tab.bias_sweep_cb_max.update(zmax)
-            tab.bias_sweep_plot.update()
+            # Only the columns measured since the last update are sent to the plot
+            tab.bias_sweep_stream.update(tab.bias_sweep_plot, tab.bias_sweep_fig, trace,
+                                         data['current'], data['frequency'], data['delay'].T,
+                                         attrs={'zmin': zmin, 'zmax': zmax},
+                                         other_traces=overlays)
             return True
         else:
             tab.log.push(data['message'])
             return False
 
-    def close_bias_sweep_file(self, ch_id: int) -> None:
+    async def close_bias_sweep_file(self, ch_id: int) -> None:
+        await self._submit_file_request('bias_sweep', ch_id, {'op': 'close'}, self._process_bias_sweep_request)
+
+    async def _close_bias_sweep_file(self, ch_id: int) -> None:
         tab = self.ui_objects.channel_tabs[ch_id]
         tab.log.push("Bias sweep file closed:" + tab.bias_sweep_file.filename)
-        tab.bias_sweep_file.close()
-        del tab.bias_sweep_file
+        bias_sweep_file = tab.bias_sweep_file
+        tab.bias_sweep_file = None
+        self._clear_bias_sweep_plot(ch_id)
+        await self._run_in_loader(bias_sweep_file.close)
+
+    def _clear_bias_sweep_plot(self, ch_id: int) -> None:
+        tab = self.ui_objects.channel_tabs[ch_id]
         tab.bias_sweep_file_toolbar_enabled = False
         tab.bias_sweep_fig['data'][0]['x'] = []
         tab.bias_sweep_fig['data'][0]['y'] = []
         tab.bias_sweep_fig['data'][0]['z'] = []
+        tab.bias_sweep_stream.reset()
         tab.bias_sweep_plot.update()
 
     def toggle_vna_connection(self, ch_id):
@@ -395,7 +543,7 @@ class UiCallbacks:
             tab.chan.vna.is_connected.enabled = False
 
     def vna_sync(self,ch_id):
-        self.q_command.put({'op': 'vna_preset', 'args': (ch_id,)})
+        self.q_command.put(self.tracer.start({'op': 'vna_preset', 'args': (ch_id,)}))
         self.setup_device( self.ui_objects.channel_tabs[ch_id].chan.vna, ch_id)
 
     def bind_pump_freq_to_vna_center(self, ch_id):
@@ -408,17 +556,17 @@ class UiCallbacks:
         else:
             p.enabled = True
 
-    def request_vna_data(self):
+    def update_live_view(self) -> None:
+        """Sends the live view state of the channels to the HW process when it changes.
+        The HW process then streams the traces of all channels with live view on its own."""
         if self.ui_objects.app_state is not ds.AppState.initialization_done:
             return
-        try:
-            ch_id = self.ui_objects.channel_name_id[self.ui_objects.current_tab]
-        except KeyError:
-            return
-        tab = self.ui_objects.channel_tabs[ch_id]
-        status = tab.chan.vna.is_connected.value and not tab.chan.vna.locked
-        if status and self.q_command.empty():
-            self.q_command.put({'op': 'get_vna_data', 'args': (ch_id,)})
+        for ch_id, tab in enumerate(self.ui_objects.channel_tabs):
+            vna = tab.chan.vna
+            val = vna.live_view.value and vna.is_connected.value and not vna.locked
+            if self._live_view_sent.get(ch_id) != val:
+                self._live_view_sent.update({ch_id: val})
+                self.q_command.put(self.tracer.start({'op': 'set_live_view', 'args': (val, ch_id)}))
 
     def set_pump_freq(self, ch_id: int, p: ds.UIParameter) -> None:
         ch_tab = self.ui_objects.channel_tabs[ch_id]
@@ -470,6 +618,26 @@ class UiCallbacks:
             if self._queue_command('abort_bias_sweep', (ch_id,)):
                 ch.bias_sweep.is_running.enabled = False
 
+    def _source_in_use(self, ch_id: int) -> tuple[str, str] | None:
+        """Finds a routine running at another channel on the same physical bias or pump source
+        channel as the channel ch_id. Only the VNA state is restored per measurement, so
+        routines sharing a source channel would overwrite each other's set points.
+
+        Returns:
+            Name of the source and of the channel of the routine, None if there is none.
+        """
+        ch = self.ui_objects.channel_tabs[ch_id].chan
+        for other_id, other_tab in enumerate(self.ui_objects.channel_tabs):
+            other = other_tab.chan
+            if other_id == ch_id or not (other.optimization.is_running.value or other.bias_sweep.is_running.value):
+                continue
+            for name, dev, other_dev in (('bias source', ch.bias_source, other.bias_source),
+                                         ('pump source', ch.pump_source, other.pump_source)):
+                if (dev.driver_name, dev.address, dev.channel) == \
+                        (other_dev.driver_name, other_dev.address, other_dev.channel):
+                    return name, other.name
+        return None
+
     def start_stop_optimization(self, ch_id: int) -> None:
         tab = self.ui_objects.channel_tabs[ch_id]
         ch = tab.chan
@@ -504,6 +672,11 @@ class UiCallbacks:
             elif not ch.bias_source.is_connected.value:
                 tab.log.push("Error: can't start optimization because bias source is not connected.")
                 return
+            in_use = self._source_in_use(ch_id)
+            if in_use is not None:
+                tab.log.push("Error: can't start optimization because the {:s} channel is used by "
+                             "the routine running at {:s}.".format(*in_use))
+                return
             if self._queue_command('start_optimization', (data,)):
                 ch.optimization.is_running.enabled = False
                 self.conf_h.save_optimization_config()
@@ -513,18 +686,60 @@ class UiCallbacks:
             if self._queue_command('abort_optimization', (ch_id,)):
                 ch.optimization.is_running.enabled = False
 
+    def start_stop_tracking(self, ch_id: int) -> None:
+        ch = self.ui_objects.channel_tabs[ch_id].chan
+        tab = self.ui_objects.channel_tabs[ch_id]
+        if not ch.tracking.is_running.value:
+            if not (ch.vna.is_connected.value and ch.pump_source.is_connected.value
+                    and ch.bias_source.is_connected.value):
+                tab.log.push("Error: can't start tracking because not all devices are connected.")
+                return
+            data = self._mk_routine_data(ch.tracking, ch_id)
+            if self._queue_command('start_tracking', (data,)):
+                ch.tracking.is_running.enabled = False
+                self.conf_h.save_tracking_config()
+        else:
+            if self._queue_command('stop_tracking', (ch_id,)):
+                ch.tracking.is_running.enabled = False
+
     def set_operation_point(self, ch_id: int) -> None:
+        """Sets the operating point of the gain file record shown"""
         tab = self.ui_objects.channel_tabs[ch_id]
-        data = tab.gain_file.get_data()
-        if data['status']:
-            Pp = data['Pp']
+        data = tab.gain_file_data
+        if tab.gain_file is not None and data is not None:
             Fs = data['Fs']*tab.gain_file.f_unit
-            Ib = data['Ib']*tab.gain_file.i_unit
-            Fp = Fs*2
-            self.queue_param(ch_id, Pp, tab.chan.pump_source.power)
-            self.queue_param(ch_id, Fp, tab.chan.pump_source.frequency)
-            self.queue_param(ch_id, Ib, tab.chan.bias_source.current)
-            if tab.chan.vna.pump_center_bind.value:
-                self.queue_param(ch_id, Fs, tab.chan.vna.center)
-        else:
-            tab.log.push(data['message'])
\ No newline at end of file
+            self._queue_operation_point(ch_id, Fs, Fs*2, data['Pp'], data['Ib']*tab.gain_file.i_unit)
+
+    def _queue_operation_point(self, ch_id: int, Fs: float, Fp: float, Pp: float, Ib: float) -> None:
+        tab = self.ui_objects.channel_tabs[ch_id]
+        self.queue_param(ch_id, Pp, tab.chan.pump_source.power)
+        self.queue_param(ch_id, Fp, tab.chan.pump_source.frequency)
+        self.queue_param(ch_id, Ib, tab.chan.bias_source.current)
+        if tab.chan.vna.pump_center_bind.value:
+            self.queue_param(ch_id, Fs, tab.chan.vna.center)
+
+    def lookup_operation_point(self, ch_id: int) -> None:
+        """Sets the measured operating point nearest in the signal frequency from the channel
+        operating points database"""
+        tab = self.ui_objects.channel_tabs[ch_id]
+        pth = Path(self.ui_objects.data_folder) / tab.chan.name.replace(' ', '_') / op_store_name
+        if not pth.exists():
+            tab.log.push("No operating points found for {:s}".format(tab.chan.name))
+            return
+        # Reload only if the optimization has added new points
+        if tab.op_store is None or pth.stat().st_mtime != tab.op_store_mtime:
+            try:
+                with OperatingPointStore(str(pth), mode='r') as op_store:
+                    tab.op_store = op_store
+                tab.op_store_mtime = pth.stat().st_mtime
+            except Exception:
+                tab.log.push("Unable to open file:" + str(pth))
+                tb.print_exc()
+                return
+        if not len(tab.op_store):
+            tab.log.push("No operating points found for {:s}".format(tab.chan.name))
+            return
+        op = tab.op_store.lookup(tab.op_lookup_frequency.value)
+        tab.log.push("Operating point for Fs={:.6f}GHz: Fp={:.6f}GHz Pp={:.2f}dBm I={:.4f}mA G={:.2f}dB".
+                     format(op.Fs/1e9, op.Fp/1e9, op.Pp, op.I/1e-3, op.G))
+        self._queue_operation_point(ch_id, op.Fs, op.Fp, op.Pp, op.I)
@@ -5,6 +5,8 @@ from typing import Callable
 from . import data_structures as ds
 from . import ui_callbacks as ui_cb
 from . import config_handler
+from . import latency_trace
+from .feedback_processor import FeedbackMetrics
 
 
 def validate_float(s: str) -> str | None:
@@ -22,10 +24,12 @@ def validate_float(s: str) -> str | None:
 class UiGenerator:
     def __init__(self, ui_objects: ds.UiObjects,
                  cb: ui_cb.UiCallbacks,
-                 ch: config_handler.ConfigHandler):
+                 ch: config_handler.ConfigHandler,
+                 feedback_metrics: FeedbackMetrics | None = None):
         self.ui_objects = ui_objects
         self.cb = cb
         self.ch = ch
+        self.feedback_metrics = feedback_metrics
         self.hardware_state = True
 
     def create_ui(self) -> None:
@@ -60,11 +64,51 @@ class UiGenerator:
                     ui.button('Save configuration', on_click=self.ch.save_config) \
                         .classes('text-xs mt-1 ml-1') \
                         .tooltip('')
+                    self._fill_diagnostics()
             # Channel tabs
             for ch_id, tab in enumerate(self.ui_objects.channel_tabs):
                 with ui.tab_panel(tab.tab):
                     self._fill_channel_tab(ch_id)
 
+    def _fill_diagnostics(self) -> None:
+        """Command latency statistics, see latency_trace.LatencyTracer, and feedback
+        processing statistics, see feedback_processor.FeedbackMetrics"""
+        tracer = self.cb.tracer
+        columns = [{'name': 'op', 'label': 'Command', 'field': 'op', 'align': 'left'},
+                   {'name': 'n', 'label': 'N', 'field': 'n'}]
+        columns += [{'name': name, 'label': name.capitalize() + ', ms', 'field': name}
+                    for name, _, _ in latency_trace.stages[:-1]]
+        columns += [{'name': name, 'label': 'Total ' + name + ', ms', 'field': name}
+                    for name in ('p50', 'p95', 'max')]
+
+        def refresh() -> None:
+            if self.feedback_metrics is not None:
+                feedback_label.text = self.feedback_metrics.summary()
+                scheduler_label.text = self.feedback_metrics.scheduler_summary()
+            if tracer.enabled:
+                table.rows = tracer.summary()
+                table.update()
+
+        def reset() -> None:
+            tracer.reset()
+            table.rows = []
+            table.update()
+
+        with ui.expansion('Diagnostics').classes('mt-2 ml-1'):
+            with ui.row(wrap=False):
+                ui.switch('Latency tracing') \
+                    .bind_value(tracer, 'enabled') \
+                    .tooltip('Trace the commands from the UI to the instruments and back')
+                ui.button('Reset', on_click=reset) \
+                    .classes('text-xs mt-2 ml-1')
+                ui.button('Export', on_click=lambda: ui.notify(self.cb.export_latency_trace())) \
+                    .classes('text-xs mt-2 ml-1') \
+                    .tooltip('Save the latest command spans to the data folder')
+            feedback_label = ui.label('').classes('text-xs ml-1')
+            scheduler_label = ui.label('').classes('text-xs ml-1')
+            table = ui.table(columns=columns, rows=[], row_key='op').props('dense').classes('text-xs')
+        ui.timer(1., refresh)
+
     def _fill_channel_tab(self, ch_id: int) -> None:
         tab = self.ui_objects.channel_tabs[ch_id]
         pick_gain_file = lambda: self.cb.pick_gain_file(ch_id)
@@ -81,6 +125,7 @@ class UiGenerator:
         update_bias_sweep_plot_from_file = lambda: self.cb.update_bias_sweep_plot_from_file(ch_id,
                                                                                          cb_autoscale=False)
         set_operation_point = lambda: self.cb.set_operation_point(ch_id)
+        lookup_operation_point = lambda: self.cb.lookup_operation_point(ch_id)
         close_bias_sweep_file = lambda: self.cb.close_bias_sweep_file(ch_id)
 
         with ui.row(wrap=False).classes('w-full'):
@@ -107,6 +152,19 @@ class UiGenerator:
                     ui.button('Close', on_click=close_gain_file) \
                         .classes('text-xs mt-1 ml-1') \
                         .bind_enabled(tab, 'gain_file_toolbar_enabled')
+                    ui.spinner() \
+                        .bind_visibility_from(tab, 'gain_file_loading') \
+                        .classes('mt-2 ml-1')
+                with ui.row(wrap=False).classes('w-full'):
+                    ui.input(label=tab.op_lookup_frequency.name) \
+                        .on('keydown.enter', tab.op_lookup_frequency.update_val) \
+                        .on('blur', tab.op_lookup_frequency.update_val) \
+                        .bind_value(tab.op_lookup_frequency, 'str_repr') \
+                        .classes('text-xs w-28 ml-1') \
+                        .tooltip(tab.op_lookup_frequency.tooltip)
+                    ui.button('Set', on_click=lookup_operation_point) \
+                        .classes('text-xs mt-4 ml-1') \
+                        .tooltip('Set the operating point from the channel operating points database')
             # SvsBias plot
             with ui.column().classes('w-1/3 h-full'):
                 tab.bias_sweep_plot = ui.plotly(tab.bias_sweep_fig).classes('mr-2 w-full aspect-square')
@@ -121,6 +179,9 @@ class UiGenerator:
                     ui.button('Close', on_click=close_bias_sweep_file) \
                         .classes('text-xs mt-2 ml-1') \
                         .bind_enabled(tab, 'bias_sweep_file_toolbar_enabled')
+                    ui.spinner() \
+                        .bind_visibility_from(tab, 'bias_sweep_file_loading') \
+                        .classes('mt-3 ml-1')
                     ui.input(label='Colorbar min.',) \
                         .on('keydown.enter', tab.bias_sweep_cb_min.update_val) \
                         .on('blur', tab.bias_sweep_cb_min.update_val) \
@@ -140,6 +201,7 @@ class UiGenerator:
                     vna_tab = ui.tab("VNA")
                     optimization_tab = ui.tab("Optimization")
                     sweep_tab = ui.tab("Bias sweep")
+                    tracking_tab = ui.tab("Tracking")
                 with ui.tab_panels(tabs, value=control_tab).classes('w-full'):
                     with ui.tab_panel(control_tab):
                         self._fill_control_tab(ch_id)
@@ -149,6 +211,8 @@ class UiGenerator:
                         self._fill_optimization_tab(ch_id)
                     with ui.tab_panel(sweep_tab):
                         self._fill_bias_sweep_tab(ch_id)
+                    with ui.tab_panel(tracking_tab):
+                        self._fill_tracking_tab(ch_id)
         # Log
         tab.log = ui.log(max_lines=500).classes('w-full h-30')
 
@@ -204,6 +268,11 @@ class UiGenerator:
                     .bind_enabled(ch.vna.is_connected, 'enabled') \
                     .classes('w-28 ml-2')\
                     .tooltip("Reset VNA to default state and load actual parameters")
+                ui.switch('Live view') \
+                    .bind_value(ch.vna.live_view, 'value') \
+                    .bind_enabled(ch.vna.live_view, 'enabled') \
+                    .classes('ml-2') \
+                    .tooltip("Sweep continuously and update the gain plot")
             # Bandwidth input
             with ui.row(wrap=False):
                 self._create_instrumental_parameter_input(ch.vna.bandwidth, ch_id)
@@ -277,6 +346,49 @@ class UiGenerator:
                 with ui.row(wrap=False):
                     self._create_parameter_input(chan.optimization.std_tol, 'w-28')
                     self._create_parameter_input(chan.optimization.w_cent, 'w-28')
+                with ui.row(wrap=False):
+                    ui.switch(chan.optimization.prescreen.name) \
+                        .bind_value(chan.optimization.prescreen, 'value') \
+                        .bind_enabled(chan.optimization.prescreen, 'enabled') \
+                        .classes('mt-2') \
+                        .tooltip(chan.optimization.prescreen.tooltip)
+                    self._create_parameter_input(chan.optimization.prescreen_tol, 'w-28')
+                with ui.row(wrap=False):
+                    self._create_parameter_input(chan.optimization.prescreen_points, 'w-28')
+                    self._create_parameter_input(chan.optimization.prescreen_bandwidth, 'w-28')
+                with ui.row(wrap=False):
+                    ui.switch(chan.optimization.segmented_sweep.name) \
+                        .bind_value(chan.optimization.segmented_sweep, 'value') \
+                        .bind_enabled(chan.optimization.segmented_sweep, 'enabled') \
+                        .classes('mt-2') \
+                        .tooltip(chan.optimization.segmented_sweep.tooltip)
+                    self._create_parameter_input(chan.optimization.settle_time, 'w-28')
+                with ui.row(wrap=False):
+                    self._create_parameter_input(chan.optimization.snr_rtol, 'w-28')
+                    ui.switch(chan.optimization.spool_snr_traces.name) \
+                        .bind_value(chan.optimization.spool_snr_traces, 'value') \
+                        .bind_enabled(chan.optimization.spool_snr_traces, 'enabled') \
+                        .classes('mt-2') \
+                        .tooltip(chan.optimization.spool_snr_traces.tooltip)
+                with ui.row(wrap=False):
+                    ui.switch(chan.optimization.gain_map.name) \
+                        .bind_value(chan.optimization.gain_map, 'value') \
+                        .bind_enabled(chan.optimization.gain_map, 'enabled') \
+                        .classes('mt-2') \
+                        .tooltip(chan.optimization.gain_map.tooltip)
+                    self._create_parameter_input(chan.optimization.map_basins, 'w-28')
+                with ui.row(wrap=False):
+                    self._create_parameter_input(chan.optimization.map_bias_points, 'w-28')
+                    self._create_parameter_input(chan.optimization.map_pump_points, 'w-28')
+                with ui.row(wrap=False):
+                    ui.switch(chan.optimization.adaptive_averaging.name) \
+                        .bind_value(chan.optimization.adaptive_averaging, 'value') \
+                        .bind_enabled(chan.optimization.adaptive_averaging, 'enabled') \
+                        .classes('mt-2') \
+                        .tooltip(chan.optimization.adaptive_averaging.tooltip)
+                with ui.row(wrap=False):
+                    self._create_parameter_input(chan.optimization.max_averages, 'w-28')
+                    self._create_parameter_input(chan.optimization.noise_k, 'w-28')
 
     def _fill_bias_sweep_tab(self, ch_id: int) -> None:
         chan = self.ui_objects.channel_tabs[ch_id].chan
@@ -305,6 +417,28 @@ class UiGenerator:
                     self._create_parameter_input(chan.bias_sweep.vna_points, 'w-28')
                     self._create_parameter_input(chan.bias_sweep.vna_power, 'w-28')
 
+    def _fill_tracking_tab(self, ch_id: int) -> None:
+        chan = self.ui_objects.channel_tabs[ch_id].chan
+        start_btn_cb = lambda: self.cb.start_stop_tracking(ch_id)
+        with ui.column():
+            with ui.row(wrap=False):
+                # Run/stop button
+                ui.button('Start', on_click=start_btn_cb) \
+                    .bind_enabled(chan.tracking.is_running, 'enabled') \
+                    .bind_text(chan.tracking.is_running, 'str_repr') \
+                    .classes('w-28')
+                ui.spinner() \
+                    .bind_visibility_from(chan.tracking.is_running, 'value') \
+                    .classes('ml-4')
+            with ui.row(wrap=False):
+                self._create_parameter_input(chan.tracking.interval, 'w-28')
+                self._create_parameter_input(chan.tracking.gain_tol, 'w-28')
+            with ui.row(wrap=False):
+                self._create_parameter_input(chan.tracking.bias_step, 'w-28')
+                self._create_parameter_input(chan.tracking.pump_step, 'w-28')
+            with ui.row(wrap=False):
+                self._create_parameter_input(chan.tracking.max_evals, 'w-28')
+
     def _create_parameter_input(self, p: ds.UIParameter, classes: str = 'w-20') -> None:
         inp = ui.input(label=p.name)\
             .on('keydown.enter', p.update_val)\
@@ -1,4 +1,6 @@
+import time
 from numpy import *
+import tables
 from . import differential_evolution as di
 
 
@@ -89,6 +91,97 @@ class TuningTable():
                 self.add_point(op)
 
 
+class TraceStatistics():
+    """Streaming per point statistics of complex traces (Welford's algorithm).
+
+    Keeps the complex mean and the variances of the real and imaginary parts,
+    so repeated traces don't need to be stored.
+    """
+    def __init__(self, N):
+        self.n = 0
+        self.mean = zeros(N, dtype=complex)
+        self._m2_re = zeros(N)
+        self._m2_im = zeros(N)
+
+    def update(self, trace):
+        self.n += 1
+        delta = trace - self.mean
+        self.mean += delta / self.n
+        delta2 = trace - self.mean
+        self._m2_re += real(delta) * real(delta2)
+        self._m2_im += imag(delta) * imag(delta2)
+
+    def var_real(self, ddof=0):
+        return self._m2_re / maximum(self.n - ddof, 1)
+
+    def var_imag(self, ddof=0):
+        return self._m2_im / maximum(self.n - ddof, 1)
+
+    def std_real(self, ddof=0):
+        return sqrt(self.var_real(ddof))
+
+    def snr(self):
+        """Per point SNR, abs(mean)/std(real)."""
+        return abs(self.mean) / self.std_real()
+
+    def snr_rel_err(self):
+        """Relative standard error of the per point SNR estimate.
+        Contributions of the mean and of the standard deviation estimates."""
+        if self.n < 2:
+            return full(len(self.mean), inf)
+        snr = self.snr()
+        return sqrt(1 / (self.n * snr ** 2) + 1 / (2 * (self.n - 1)))
+
+
+class GainMap():
+    """Coarse gain map, linear gain as a function of bias, pump power and frequency."""
+    def __init__(self, bias, pump, freq, gain, Fp=0.):
+        self.bias = asarray(bias)
+        self.pump = asarray(pump)
+        self.freq = asarray(freq)
+        self.gain = asarray(gain)  # Shape (len(bias), len(pump), len(freq))
+        self.Fp = Fp
+
+    def save(self, path):
+        with tables.open_file(path, mode='w', title='Gain map') as f:
+            f.create_array(f.root, 'bias', self.bias, 'Bias, A')
+            f.create_array(f.root, 'pump', self.pump, 'Pump power, dBm')
+            f.create_array(f.root, 'frequency', self.freq, 'Frequency, Hz')
+            f.create_array(f.root, 'gain', self.gain, 'Linear gain')
+            f.root._v_attrs.Fp = self.Fp
+
+    @classmethod
+    def load(cls, path):
+        with tables.open_file(path, mode='r') as f:
+            return cls(f.root.bias.read(), f.root.pump.read(), f.root.frequency.read(), f.root.gain.read(),
+                       f.root._v_attrs.Fp)
+
+    def cost(self, tuner):
+        """Gain cost of the tuner target on the whole map, array of shape (len(bias), len(pump))."""
+        band = abs(self.freq - tuner.target_freq) <= tuner.target_bw / 2
+        if not any(band):
+            raise ValueError('Target frequency is out of the map band!')
+        return tuner._gain_cost(self.gain[:, :, band])
+
+    def basins(self, cost, n):
+        """Grid indices of the n best local minima of cost."""
+        padded = pad(cost, 1, constant_values=inf)
+        is_min = ones(shape(cost), dtype=bool)
+        for di_ in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                if di_ or dj:
+                    is_min &= cost <= padded[1 + di_:1 + di_ + shape(cost)[0], 1 + dj:1 + dj + shape(cost)[1]]
+        idx = argwhere(is_min)
+        order = argsort(cost[is_min])
+        return [tuple(int(v) for v in idx[k]) for k in order[:n]]
+
+    def basin_ranges(self, i, j):
+        """Bias and pump ranges of one grid step around the node (i, j)."""
+        bias = sort(self.bias[clip([i - 1, i + 1], 0, len(self.bias) - 1)])
+        pump = sort(self.pump[clip([j - 1, j + 1], 0, len(self.pump) - 1)])
+        return [tuple(bias), tuple(pump)]
+
+
 # Tuner for wideband IMPA based on differetial evalution algorithm.
 # Works for both wide and narrow band modes. For narrow band modes central point weight is more important.
 # It's batter to set target bw closer to expected. It can be wider, but not much.
@@ -112,8 +205,41 @@ class IMPATuner():
         self.snr_ref = None
         self.res = None
         self.n = 10
+        # Two-stage evaluation. Trial vectors are first scored by a fast gain-only sweep
+        # and measured at full fidelity only if they could beat their parent.
+        self.prescreen = False
+        self.prescreen_points = 51
+        self.prescreen_bw = 50e3
+        self.prescreen_tol = 0.5  # Relative rejection threshold
+        self.ref_prescreen = None
+        # Measurement time and number of evaluations spent in each stage
+        self.stage_time = {'prescreen': 0., 'full': 0., 'remeasure': 0.}
+        self.stage_nfev = {'prescreen': 0, 'full': 0, 'remeasure': 0}
+        # Combined acquisition: one segmented sweep containing the gain band and
+        # a CW-like segment at the detuned frequency for the SNR measurement
+        self.segmented = False
+        self.snr_points = None  # Points of the SNR segment, self.points if None
+        # Delay after setting bias and pump. When the VNA is shared with other tuners
+        # through a measurement scheduler their sweeps run in the meantime.
+        self.settle_time = 0.
+        # Percentile of the per point SNR relative errors tested against rtol in snr_snapshot()
+        self.snr_err_percentile = 95.
+        # Noise-adaptive averaging. The cost uncertainty of every evaluation is estimated
+        # from the noise of its own traces. When a trial and its parent differ by less than
+        # noise_k uncertainties both are re-measured with doubled averaging up to max_avg.
+        self.adaptive = False
+        self.noise_k = 1.
+        self.max_avg = 8
+        self._evals = {}
+        # Per evaluation telemetry records, see _record_eval(), and DE generation records
+        self.eval_records = []
+        self.generation_records = []
+        self._f_cent = self.target_freq
+        self._fidelity = None
         self.di_solver: di.DifferentialEvolutionSolver | None = None
         self._abort = False
+        # Set when the last run was aborted, kept until the next one starts
+        self._aborted = False
 
     def abort(self) -> None:
         """Thread abort."""
@@ -124,58 +250,267 @@ class IMPATuner():
         method was previously called."""
         if self._abort:
             self._abort = False
+            self._aborted = True
             raise di.AbortException
 
+    def _segment_table(self, points: int, bw: float, snr: bool) -> list[dict]:
+        """Segment table of the gain band around the current center frequency
+        optionally followed by a CW-like segment at the detuned frequency."""
+        seg_tab = [{'start': self._f_cent - self.target_bw / 2,
+                    'stop': self._f_cent + self.target_bw / 2,
+                    'points': int(points),
+                    'power': self.Ps,
+                    'bandwidth': bw}]
+        if snr:
+            snr_points = self.points if self.snr_points is None else self.snr_points
+            seg_tab += [{'start': self._f_cent + self.detuning,
+                         'stop': self._f_cent + self.detuning,
+                         'points': int(snr_points),
+                         'power': self.Ps,
+                         'bandwidth': bw}]
+        return seg_tab
+
+    def _set_fidelity(self, points: int, bw: float, snr: bool = False) -> None:
+        """Sets VNA number of points and IF bandwidth if they differ from the current ones.
+        In segmented mode loads the segment table instead, with the SNR segment if snr is True."""
+        # Numbers of points may come from the UI as floats
+        points = int(points)
+        if self.segmented:
+            if self._fidelity != (points, bw, snr, self._f_cent):
+                self.vna.seg_tab(self._segment_table(points, bw, snr))
+                self._fidelity = (points, bw, snr, self._f_cent)
+        elif self._fidelity != (points, bw):
+            self.vna.num_of_points(points)
+            self.vna.bandwidth(bw)
+            self._fidelity = (points, bw)
+
+    @staticmethod
+    def _snr(data: ndarray) -> float:
+        return abs(mean(data)) / std(real(data))
+
+    def _read_gain_band(self) -> ndarray:
+        """Reads the gain band only."""
+        if self.segmented:
+            return self.vna.read_segmented_data()[0]
+        return self.vna.read_data()
+
     def _measure_ref(self):
         self.bias.output(False)
         self.pump.output(False)
         self.vna.soft_trig_arm()
-        self.ref = self.vna.read_data()
-        # print("Reference level: {:f}db".format(db_ref))
-        f_cent, span = self.vna.freq_center_span()
-        self.vna.sweep_type('cw')
-        self.vna.freq_cw(f_cent + self.detuning)
-        noise_ref = self.vna.read_data()
-        self.snr_ref = abs(mean(noise_ref)) / std(real(noise_ref))
-        self.vna.sweep_type('lin')
+        if self.prescreen:
+            self._set_fidelity(self.prescreen_points, self.prescreen_bw)
+            self.ref_prescreen = self._read_gain_band()
+        if self.segmented:
+            self._set_fidelity(self.points, self.bw, snr=True)
+            self.ref, noise_ref = self.vna.read_segmented_data()
+            self.snr_ref = self._snr(noise_ref)
+        else:
+            self._set_fidelity(self.points, self.bw)
+            self.ref = self.vna.read_data()
+            # print("Reference level: {:f}db".format(db_ref))
+            f_cent, span = self.vna.freq_center_span()
+            self.vna.sweep_type('cw')
+            self.vna.freq_cw(f_cent + self.detuning)
+            noise_ref = self.vna.read_data()
+            self.snr_ref = self._snr(noise_ref)
+            self.vna.sweep_type('lin')
         self.pump.output('on')
         self.vna.soft_trig_abort()
 
-    def _measure_snr_gain(self, f_cent):
+    def _read_snr_data(self, f_cent):
         # f_cent,span = self.vna.freq_center_span()
         self.vna.sweep_type('cw')
         self.vna.freq_cw(f_cent)
         data = self.vna.read_data()
-        snr = abs(mean(data)) / std(real(data))
-        snr_gain = snr / self.snr_ref
         self.vna.sweep_type('lin')
-        return snr_gain
+        return data
 
-    def _func_min(self, x: ndarray) -> float:
-        """Cost function for differential evolution minimizer.
+    def _measure_snr_gain(self, f_cent):
+        return self._snr(self._read_snr_data(f_cent)) / self.snr_ref
+
+    def _read_full(self) -> tuple[ndarray, ndarray, float, float]:
+        """Reads the gain band and the SNR trace at the current point with full fidelity.
 
-        Arguments:
-            x : array_like The parameters vector, x[0] - bias value ,x[1] - pump amplitude
         Returns:
-            float cost function value
+            Gain band and SNR traces, times the fidelity was set and the gain band was read.
         """
+        if self.segmented:
+            # Gain and SNR from a single trigger
+            self._set_fidelity(self.points, self.bw, snr=True)
+            t_set = time.time()
+            data, snr_data = self.vna.read_segmented_data()
+            return data, snr_data, t_set, time.time()
+        self._set_fidelity(self.points, self.bw)
+        t_set = time.time()
+        data = self.vna.read_data()
+        t_sweep = time.time()
+        f_cent, span = self.vna.freq_center_span()
+        return data, self._read_snr_data(f_cent + self.detuning), t_set, t_sweep
+
+    def _set_point(self, x: ndarray) -> None:
+        """Sets bias, pump and, if the frequency is optimized too, VNA center."""
         self.pump.power(x[1])
         self.bias.setpoint(x[0])
         if len(x) > 2:
             self.pump.freq(2 * x[2])
-            self.vna.freq_center_span((x[2], self.target_bw))
+            self._f_cent = x[2]
+            if not self.segmented:
+                self.vna.freq_center_span((x[2], self.target_bw))
+        if self.settle_time > 0:
+            time.sleep(self.settle_time)
+
+    def _gain_cost(self, gain: ndarray) -> float | ndarray:
+        """Gain part of the cost function. Frequency is the last axis of gain,
+        so a whole map of gain traces is evaluated at once."""
         target_gain = 10 ** (self.target_gain / 20)
-        gain = abs(self.vna.read_data() / self.ref)
         gain_diff = gain - target_gain
-        f_cent, span = self.vna.freq_center_span()
-        snr_gain = self._measure_snr_gain(f_cent + self.detuning)
-        c_point = gain_diff[int(len(gain_diff) / 2)]
-        cent = 0
-        if c_point > 0:
-            cent = (self.w_cent * c_point) ** 2
+        c_point = gain_diff[..., int(shape(gain_diff)[-1] / 2)]
+        cent = where(c_point > 0, (self.w_cent * c_point) ** 2, 0)
+        return mean(gain_diff ** 2, axis=-1) + cent
+
+    def _func_min(self, x: ndarray) -> float:
+        """Cost function for differential evolution minimizer.
+
+        Arguments:
+            x : array_like The parameters vector, x[0] - bias value ,x[1] - pump amplitude
+        Returns:
+            float cost function value
+        """
+        t0 = time.time()
+        self._set_point(x)
+        data, snr_data, t_set, t_sweep = self._read_full()
+        t_snr = time.time()
         # return mean(diff**2) + self.w_cent*diff[int(len(diff)/2)]**2 - snr_gain**2
         # return mean(gain_diff**2) + cent - snr_gain**2
-        return mean(gain_diff ** 2) + cent + (snr_gain - target_gain) ** 2
+        if self.adaptive:
+            self._evals[tuple(x)] = {'n': 0, 'gain_sum': 0., 'gain_sq_sum': 0.,
+                                     'snr_n': 0, 'snr_mean': 0j, 'snr_m2': 0.}
+            cost = self._accumulate_eval(x, data, snr_data)
+        else:
+            cost = self._cost(abs(data / self.ref), snr_data)
+        self.stage_time['full'] += time.time() - t0
+        self.stage_nfev['full'] += 1
+        self._record_eval('full', x, cost, t_set - t0, t_sweep - t_set, t_snr - t_sweep, time.time() - t0)
+        return cost
+
+    def _cost(self, gain: ndarray, snr_data: ndarray) -> float:
+        return self._cost_snr_gain(gain, self._snr(snr_data) / self.snr_ref)
+
+    def _cost_snr_gain(self, gain: ndarray, snr_gain: float) -> float:
+        target_gain = 10 ** (self.target_gain / 20)
+        return self._gain_cost(gain) + (snr_gain - target_gain) ** 2
+
+    def _accumulate_eval(self, x: ndarray, data: ndarray, snr_data: ndarray) -> float:
+        """Adds a sweep to the averaged evaluation at x, updates its cost uncertainty
+        and returns the averaged cost."""
+        ev = self._evals[tuple(x)]
+        gain = abs(data / self.ref)
+        ev['n'] += 1
+        ev['gain_sum'] = ev['gain_sum'] + gain
+        ev['gain_sq_sum'] = ev['gain_sq_sum'] + gain ** 2
+        # Running mean and sum of squared deviations of the real part of the SNR samples,
+        # the sweep merged as a batch (Chan et al.), so the raw samples aren't kept
+        n_b = len(snr_data)
+        mean_b = mean(snr_data)
+        m2_b = sum((real(snr_data) - real(mean_b)) ** 2)
+        n_a = ev['snr_n']
+        ev['snr_n'] = n_a + n_b
+        delta = real(mean_b) - real(ev['snr_mean'])
+        ev['snr_mean'] = ev['snr_mean'] + (mean_b - ev['snr_mean']) * n_b / ev['snr_n']
+        ev['snr_m2'] = ev['snr_m2'] + m2_b + delta ** 2 * n_a * n_b / ev['snr_n']
+        n = ev['n']
+        gain = ev['gain_sum'] / n
+        if n > 1:
+            # Standard error of the mean gain from the trace to trace spread
+            sigma_g = sqrt(mean(maximum(ev['gain_sq_sum'] / n - gain ** 2, 0.)) / (n - 1))
+        else:
+            # Point to point spread, an upper estimate including the gain ripple
+            sigma_g = std(diff(gain)) / sqrt(2)
+        target_gain = 10 ** (self.target_gain / 20)
+        snr_gain = abs(ev['snr_mean']) / sqrt(ev['snr_m2'] / ev['snr_n']) / self.snr_ref
+        # Linear error propagation of both cost terms
+        sigma_gain_cost = 2 * sigma_g * sqrt(mean((gain - target_gain) ** 2) / len(gain))
+        sigma_snr_cost = 2 * abs(snr_gain - target_gain) * snr_gain / sqrt(2 * ev['snr_n'])
+        ev['sigma'] = float(hypot(sigma_gain_cost, sigma_snr_cost))
+        ev['cost'] = float(self._cost_snr_gain(gain, snr_gain))
+        return ev['cost']
+
+    def _evict_evals(self) -> None:
+        """Forgets the averaged evaluations of the vectors no longer in the population.
+        Trials are evaluated after this, the parents they are compared to are kept."""
+        if self.di_solver is None or not len(self._evals):
+            return
+        population = {tuple(x) for x in self.di_solver._scale_parameters(self.di_solver.population)}
+        self._evals = {key: ev for key, ev in self._evals.items() if key in population}
+
+    def _uncertainty(self, x: ndarray) -> float:
+        """Standard deviation of the last cost value at x, zero if x wasn't evaluated."""
+        ev = self._evals.get(tuple(x))
+        return 0. if ev is None else ev['sigma']
+
+    def _remeasure(self, x: ndarray) -> float:
+        """Doubles the number of averaged sweeps at x, up to max_avg, and returns the
+        averaged cost."""
+        self._check_abort_flag()
+        ev = self._evals.get(tuple(x))
+        if ev is None:
+            return self._func_min(x)
+        n_new = int(minimum(ev['n'], self.max_avg - ev['n']))
+        if n_new <= 0:
+            return ev['cost']
+        t0 = time.time()
+        self._set_point(x)
+        t_set = time.time()
+        for i in range(n_new):
+            self._check_abort_flag()
+            data, snr_data, _, _ = self._read_full()
+            cost = self._accumulate_eval(x, data, snr_data)
+        self.stage_time['remeasure'] += time.time() - t0
+        self.stage_nfev['remeasure'] += n_new
+        self._record_eval('remeasure', x, cost, t_set - t0, time.time() - t_set, 0., time.time() - t0)
+        return cost
+
+    def _full_grid(self, gain: ndarray) -> ndarray:
+        """Gain trace of a sweep of the gain band with another number of points linearly
+        interpolated onto the points of the full fidelity sweep the cost is defined on."""
+        if len(gain) == self.points:
+            return gain
+        return interp(linspace(0., 1., int(self.points)), linspace(0., 1., len(gain)), gain)
+
+    def _func_prescreen(self, x: ndarray) -> float:
+        """Cheap cost function estimate from a low resolution sweep without SNR measurement.
+        The gain cost is evaluated on the frequency grid of the full cost, including its center
+        point weighting, and the omitted SNR term is non-negative. The estimate is not a strict
+        lower bound though: the wider bandwidth sweep is noisier and the gain between its points
+        is interpolated. The rejection margin is set by prescreen_tol."""
+        t0 = time.time()
+        self._set_point(x)
+        self._set_fidelity(self.prescreen_points, self.prescreen_bw)
+        t_set = time.time()
+        gain = self._full_grid(abs(self._read_gain_band() / self.ref_prescreen))
+        t_sweep = time.time()
+        cost = self._gain_cost(gain)
+        self.stage_time['prescreen'] += time.time() - t0
+        self.stage_nfev['prescreen'] += 1
+        self._record_eval('prescreen', x, cost, t_set - t0, t_sweep - t_set, 0., time.time() - t0)
+        return cost
+
+    def _record_eval(self, stage, x, cost, t_set, t_sweep, t_snr, t_total):
+        """Appends a telemetry record: parameters, cost and time spent in each phase."""
+        self.eval_records.append({'stage': stage,
+                                  'target_freq': self.target_freq,
+                                  'generation': 0 if self.di_solver is None else self.di_solver.generation,
+                                  'nfev': self.stage_nfev[stage],
+                                  'bias': x[0],
+                                  'pump': x[1],
+                                  'freq': x[2] if len(x) > 2 else self.target_freq,
+                                  'cost': float(cost),
+                                  't_set': t_set,
+                                  't_sweep': t_sweep,
+                                  't_snr': t_snr,
+                                  't_total': t_total,
+                                  'timestamp': time.time()})
 
     '''
     def _func_min(self,x):
@@ -192,35 +527,58 @@ class IMPATuner():
         return 	-snr
     '''
 
-    def _func_min_vect(self, x: ndarray) -> ndarray | float:
-        """A vectorized version of the cost function that should be
-        passed to the differential evolution optimizer."""
+    def _vectorize(self, func, x: ndarray) -> ndarray | float:
+        """Evaluates func for a single parameters vector or for each row of a 2D array."""
         self._check_abort_flag()
         if len(shape(x)) == 2:
             res = zeros(shape(x)[0])
             for i, val in enumerate(x):
                 self._check_abort_flag()
-                res[i] = self._func_min(val)
+                res[i] = func(val)
             return res
         elif len(shape(x)) == 1:
-            return self._func_min(x)
+            return func(x)
         else:
             raise ValueError('Invalid argument shape!')
 
+    def _func_min_vect(self, x: ndarray) -> ndarray | float:
+        """A vectorized version of the cost function that should be
+        passed to the differential evolution optimizer."""
+        if self.adaptive:
+            self._evict_evals()
+        return self._vectorize(self._func_min, x)
+
+    def _func_prescreen_vect(self, x: ndarray) -> ndarray | float:
+        """A vectorized version of the pre-screen cost function."""
+        return self._vectorize(self._func_prescreen, x)
+
     def find_gain(self, popsize=50,
                   minpopsize=5,
                   tol=0.06,
                   std_tol=1,
                   maxiter=20,
+                  ranges=None,
                   **kwargs):
-        """Gain optimization."""
+        """Gain optimization.
+
+        ranges: Optional (bias, pump power) bounds used instead of bias_range and pump_range.
+        """
 
         # Setup instruments
+        self._aborted = False
         self.bias.setpoint(0.)
-        self.vna.sweep_type('lin')
-        self.vna.num_of_points(self.points)
         self.vna.freq_center_span((self.target_freq, self.target_bw))
-        self.vna.bandwidth(self.bw)
+        self._f_cent = self.target_freq
+        self._fidelity = None
+        if self.segmented:
+            self._set_fidelity(self.points, self.bw, snr=True)
+            self.vna.sweep_type('segm')
+        else:
+            self.vna.sweep_type('lin')
+            self._set_fidelity(self.points, self.bw)
+        self._evals = {}
+        self.stage_time = {'prescreen': 0., 'full': 0., 'remeasure': 0.}
+        self.stage_nfev = {'prescreen': 0, 'full': 0, 'remeasure': 0}
         self.vna.power(self.Ps)
         self.vna.output(True)
         # Measure zero gain reference
@@ -231,11 +589,12 @@ class IMPATuner():
         self.pump.freq(self.target_freq * 2)
         # Optimize gain
         self.vna.soft_trig_arm()
-        if self.target_freq_span == 0:
+        if ranges is None:
             ranges = [self.bias_range, self.pump_range]
         else:
-            ranges = [self.bias_range, self.pump_range,
-                      (self.target_freq - self.target_freq_span / 2, self.target_freq + self.target_freq_span / 2)]
+            ranges = list(ranges)
+        if self.target_freq_span != 0:
+            ranges += [(self.target_freq - self.target_freq_span / 2, self.target_freq + self.target_freq_span / 2)]
         self.di_solver = di.DifferentialEvolutionSolver(self._func_min_vect,
                                                         ranges,
                                                         tol=tol,
@@ -245,8 +604,23 @@ class IMPATuner():
                                                         minpopsize=minpopsize,
                                                         maxiter_conv=maxiter,
                                                         polish=False,
+                                                        prescreen=self._func_prescreen_vect if self.prescreen else None,
+                                                        prescreen_tol=self.prescreen_tol,
+                                                        uncertainty=self._uncertainty if self.adaptive else None,
+                                                        remeasure=self._remeasure if self.adaptive else None,
+                                                        noise_k=self.noise_k,
                                                         **kwargs)
         self.res = self.di_solver.solve()
+        self.generation_records += [dict(gen, target_freq=self.target_freq) for gen in self.di_solver.generation_log]
+        if self.prescreen:
+            print("Pre-screen: {:d} evaluations, {:.1f} s, {:d} trials rejected".format(
+                self.stage_nfev['prescreen'], self.stage_time['prescreen'], self.res.nrejected))
+        print("Full fidelity: {:d} evaluations, {:.1f} s".format(self.stage_nfev['full'],
+                                                                 self.stage_time['full']))
+        if self.adaptive:
+            print("Adaptive averaging: {:d} extra sweeps, {:.1f} s".format(self.stage_nfev['remeasure'],
+                                                                           self.stage_time['remeasure']))
+        self._evals = {}
 
         if len(self.res['x']) > 2:
             op = OperationPoint(G=self.target_gain, Pp=self.res['x'][1], I=self.res['x'][0], Fp=self.res['x'][2] * 2,
@@ -255,11 +629,113 @@ class IMPATuner():
             op = OperationPoint(G=self.target_gain, Pp=self.res['x'][1], I=self.res['x'][0], Fp=self.target_freq * 2,
                                 Fs=self.target_freq)
         self.set_op(op)
-        f_cent, span = self.vna.freq_center_span()
-        op.Gsnr = 20. * log10(self._measure_snr_gain(f_cent + self.detuning))
+        if self.segmented:
+            self.vna.sweep_type('segm')
+            self._f_cent = op.Fs
+            self._set_fidelity(self.points, self.bw, snr=True)
+            op.Gsnr = 20. * log10(self._snr(self.vna.read_segmented_data()[1]) / self.snr_ref)
+            self.vna.sweep_type('lin')
+        else:
+            self._set_fidelity(self.points, self.bw)
+            f_cent, span = self.vna.freq_center_span()
+            op.Gsnr = 20. * log10(self._measure_snr_gain(f_cent + self.detuning))
         self.vna.soft_trig_abort()
         return op, self.res.success
 
+    def gain_map(self, bias_points=21, pump_points=21, f_cent=None, span=None, points=None, bw=None, path=None):
+        """Coarse gain map on the bias_range x pump_range grid.
+
+        Each point is a single short sweep covering the band, so the map can be evaluated
+        for any target frequency inside it.
+
+        Args:
+            f_cent: Map center frequency, target_freq if None. The pump is at 2*f_cent.
+            span: Frequency span, target_bw + target_freq_span + 2*detuning if None.
+            points, bw: VNA number of points and bandwidth, prescreen_points and prescreen_bw if None.
+            path: Optional HDF5 file path to save the map.
+
+        Returns:
+            GainMap
+        """
+        if f_cent is None:
+            f_cent = self.target_freq
+        if span is None:
+            span = self.target_bw + self.target_freq_span + 2 * self.detuning
+        if points is None:
+            points = self.prescreen_points
+        if bw is None:
+            bw = self.prescreen_bw
+        bias = linspace(self.bias_range[0], self.bias_range[1], int(bias_points))
+        pump = linspace(self.pump_range[0], self.pump_range[1], int(pump_points))
+
+        self.vna.sweep_type('lin')
+        self.vna.freq_center_span((f_cent, span))
+        self.vna.num_of_points(int(points))
+        self.vna.bandwidth(bw)
+        self.vna.power(self.Ps)
+        self.vna.output(True)
+        self._fidelity = None
+        self.vna.soft_trig_arm()
+        self.bias.output(False)
+        self.pump.output(False)
+        ref = self.vna.read_data()
+        freq = self.vna.freq_points()
+        self.pump.freq(2 * f_cent)
+        self.pump.output(True)
+        self.bias.output(True)
+        gain = zeros((len(bias), len(pump), len(freq)))
+        t0 = time.time()
+        try:
+            for i, b in enumerate(bias):
+                for j, p in enumerate(pump):
+                    self._check_abort_flag()
+                    self._set_point(array([b, p]))
+                    gain[i, j] = abs(self.vna.read_data() / ref)
+        finally:
+            self.vna.soft_trig_abort()
+        print("Gain map: {:d} sweeps, {:.1f} s".format(len(bias) * len(pump), time.time() - t0))
+        gm = GainMap(bias, pump, freq, gain, 2 * f_cent)
+        if path is not None:
+            gm.save(path)
+        return gm
+
+    def find_gain_mapped(self, gain_map, n_basins=3, **kwargs):
+        """Gain optimization restricted to the best basins of a coarse gain map.
+
+        The map cost is evaluated for target_freq on the whole grid at once. Local minima
+        are ranked and find_gain is run within one grid step around each of the n_basins best.
+        Arguments for find_gain are passed with kwargs.
+
+        Returns:
+            The best operating point and the optimization status. If aborted, the best
+            point of the basins optimized so far and False.
+        """
+        cost = gain_map.cost(self)
+        best = None
+        basins = gain_map.basins(cost, n_basins)
+        for n, (i, j) in enumerate(basins):
+            ranges = gain_map.basin_ranges(i, j)
+            print("Basin {:d}: I = {:.6e} A, Pp = {:.2f} dBm, map cost {:.3g}".format(
+                n + 1, gain_map.bias[i], gain_map.pump[j], cost[i, j]))
+            try:
+                op, status = self.find_gain(ranges=ranges, **kwargs)
+            except di.AbortException:
+                # Aborted before the initial population of the basin was evaluated
+                if best is None:
+                    raise
+            else:
+                if best is None or self.res.fun < best[2]:
+                    best = (op, status, self.res.fun)
+            # The solver returns normally when aborted, the remaining basins are skipped
+            if self._aborted or self._abort:
+                self._abort = False
+                self._aborted = True
+                print("Aborted, {:d} of {:d} basins skipped".format(len(basins) - n - 1, len(basins)))
+                break
+        op, status, fun = best
+        self.set_op(op)
+        return op, status and not self._aborted
+
     # Setup instrument accoding to the operation point
     def set_op(self, op):
         self.bias.setpoint(op.I)
@@ -299,7 +775,23 @@ class IMPATuner():
         self.vna.soft_trig_abort()
         return S21on, S21off, Fpoints
 
-    def snr_snapshot(self, op, span=None, N=None, Ps=None, bw=None, Nmeas=100):
+    def snr_snapshot(self, op, span=None, N=None, Ps=None, bw=None, Nmeas=100, rtol=None, min_meas=10,
+                     spool=None):
+        """Measures SNR with pump off and on accumulating the traces statistics on the fly.
+
+        Args:
+            Nmeas: Maximum number of traces per pump state.
+            rtol: If set, the measurement of a pump state stops as soon as the relative
+                  standard error of the SNR gets below rtol/sqrt(2) at snr_err_percentile
+                  percent of the frequency points, so the SNR gain stored per point has
+                  relative error below rtol there.
+            min_meas: Minimum number of traces per pump state if rtol is set.
+            spool: Optional pair of HDF5 EArrays (on, off), or objects with the same append method,
+                   where the raw traces are appended.
+
+        Returns:
+            TraceStatistics of the pump on and off traces and the frequency points.
+        """
         if span is None:
             span = self.target_bw * 2
         if N is None:
@@ -323,16 +815,25 @@ class IMPATuner():
             self.vna.bandwidth(bw)
 
         self.vna.soft_trig_arm()
-        S21off = zeros((Nmeas, N), dtype=complex)
-        S21on = zeros((Nmeas, N), dtype=complex)
-        for i in range(Nmeas):
-            S21off[i] = self.vna.read_data()
-
+        S21off = self._accumulate_traces(N, Nmeas, rtol, min_meas, None if spool is None else spool[1])
         self.pump.output(1)
-        for i in range(Nmeas):
-            S21on[i] = self.vna.read_data()
+        S21on = self._accumulate_traces(N, Nmeas, rtol, min_meas, None if spool is None else spool[0])
 
         Fpoints = self.vna.freq_points()
         self.vna.soft_trig_abort()
 
         return S21on, S21off, Fpoints
+
+    def _accumulate_traces(self, N, Nmeas, rtol, min_meas, spool):
+        stats = TraceStatistics(N)
+        for i in range(Nmeas):
+            data = self.vna.read_data()
+            stats.update(data)
+            if spool is not None:
+                spool.append(data.reshape(1, len(data)))
+            if rtol is not None and stats.n >= min_meas:
+                # The SNR gain is stored per point, so is its error tested
+                err = percentile(stats.snr_rel_err(), self.snr_err_percentile)
+                if err < rtol / sqrt(2):
+                    break
+        return stats
@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import datetime
+import sqlite3
+import threading
+import numpy as np
+import tables
+
+catalog_file_name = 'catalog.sqlite'
+data_file_name = 'data.h5'
+
+# Run folders created by data_mgmt.default_save_path(): root/YYYY-MM-DD/HH-MM-SS[-name]
+_run_dir_re = re.compile(r'(\d{4}-\d{2}-\d{2})[\\/](\d{2}-\d{2}-\d{2})(?:-([^\\/]+))?$')
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    path TEXT PRIMARY KEY,
+    run_type TEXT,
+    title TEXT,
+    started REAL,
+    mtime REAL,
+    size INTEGER,
+    instruments TEXT,
+    n_rows INTEGER,
+    n_columns INTEGER,
+    row_name TEXT,
+    row_min REAL,
+    row_max REAL,
+    column_name TEXT,
+    column_min REAL,
+    column_max REAL
+);
+CREATE INDEX IF NOT EXISTS runs_type ON runs (run_type, started);
+CREATE TABLE IF NOT EXISTS points (
+    path TEXT REFERENCES runs (path) ON DELETE CASCADE,
+    Fs REAL,
+    Fp REAL,
+    Pp REAL,
+    I REAL,
+    G REAL,
+    Gsnr REAL
+);
+CREATE INDEX IF NOT EXISTS points_fs ON points (Fs);
+CREATE INDEX IF NOT EXISTS points_path ON points (path);
+"""
+
+
+def _range(node: tables.Leaf) -> tuple[float | None, float | None]:
+    if not node.nrows:
+        return None, None
+    data = np.real(node.read())
+    return float(np.min(data)), float(np.max(data))
+
+
+def describe_run(path: str) -> dict:
+    """Metadata of the data file at path used by the catalog.
+
+    The run type is the name part of the run folder, e.g. 'SvsBias' or 'jpa_tuning',
+    or derived from the file structure if the folder has no name.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    st = os.stat(path)
+    desc = {'path': path,
+            'run_type': None,
+            'title': '',
+            'started': st.st_mtime,
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'instruments': None,
+            'n_rows': None,
+            'n_columns': None,
+            'row_name': None,
+            'row_min': None,
+            'row_max': None,
+            'column_name': None,
+            'column_min': None,
+            'column_max': None,
+            'points': []}
+    match = _run_dir_re.search(folder)
+    if match is not None:
+        desc['started'] = datetime.datetime.strptime(match.group(1) + ' ' + match.group(2),
+                                                     '%Y-%m-%d %H-%M-%S').timestamp()
+        desc['run_type'] = match.group(3)
+    with tables.open_file(path, mode='r') as f:
+        desc['title'] = f.title
+        root = f.root
+        instruments = {}
+        if 'segment_table' in root:
+            instruments['vna_segments'] = [{key: float(row[key]) for key in row.dtype.names}
+                                           for row in root.segment_table.read()]
+        if 'metadata' in root:
+            instruments['spectrum_analyzer'] = {key: float(val) for key, val
+                                                in zip(root.metadata.dtype.names, root.metadata[0])}
+        if instruments:
+            desc['instruments'] = json.dumps(instruments)
+        if 'thumbnail' in root:
+            desc['run_type'] = desc['run_type'] or 'jpa_tuning'
+            thumbnail = root.thumbnail.read()
+            desc['points'] = [tuple(float(row[key]) for key in ('Fs', 'Fp', 'Pp', 'I', 'G', 'Gsnr'))
+                              for row in thumbnail]
+            desc['n_rows'] = len(thumbnail)
+            if len(thumbnail):
+                desc['row_name'] = 'Fs'
+                desc['row_min'] = float(np.min(thumbnail['Fs']))
+                desc['row_max'] = float(np.max(thumbnail['Fs']))
+        elif 'data' in root and 'row_coordinate' in root:
+            desc['run_type'] = desc['run_type'] or '2d_sweep'
+            desc['n_rows'] = int(root.row_coordinate.nrows)
+            desc['n_columns'] = int(root.data.shape[-1])
+            desc['row_name'] = root.row_coordinate.title
+            desc['row_min'], desc['row_max'] = _range(root.row_coordinate)
+            if 'column_coordinate' in root:
+                desc['column_name'] = root.column_coordinate.title
+                desc['column_min'], desc['column_max'] = _range(root.column_coordinate)
+        else:
+            desc['run_type'] = desc['run_type'] or 'unknown'
+    return desc
+
+
+class MeasurementCatalog:
+    """SQLite index of the runs under a data root.
+
+    Every data.h5 under the root is described once: run type, start time, file size,
+    instrument metadata, sweep ranges and, for tuning runs, the thumbnail operating
+    points. scan() only opens files which are new or modified since the last scan,
+    and drops the runs which were deleted. watch() rescans periodically in background.
+
+    Args:
+        root: Data root, e.g. the data folder of the IMPA GUI.
+        db_path: Catalog database path. root/catalog.sqlite if None.
+    """
+    def __init__(self, root: str, db_path: str | None = None):
+        self.root = root
+        self.db_path = db_path if db_path is not None else os.path.join(root, catalog_file_name)
+        # The connection is shared with the watcher thread
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._conn.executescript(_schema)
+        self._watcher: threading.Thread | None = None
+        self._stop_watching = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self.stop_watching()
+        with self._lock:
+            self._conn.close()
+
+    def _data_files(self):
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            if data_file_name in file_names:
+                yield os.path.join(dir_path, data_file_name)
+
+    def scan(self) -> dict:
+        """Indexes new and modified runs and removes deleted ones.
+
+        Returns:
+            dict: Number of 'added', 'updated', 'removed' and 'failed' runs.
+        """
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'failed': 0}
+        with self._lock:
+            known = {row['path']: (row['mtime'], row['size'])
+                     for row in self._conn.execute('SELECT path, mtime, size FROM runs')}
+        found = set()
+        for path in self._data_files():
+            found.add(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) == (st.st_mtime, st.st_size):
+                continue
+            try:
+                desc = describe_run(path)
+            except Exception:
+                # E.g. a file being written by a running measurement
+                counts['failed'] += 1
+                continue
+            self._store(desc)
+            counts['updated' if path in known else 'added'] += 1
+        removed = [path for path in known if path not in found]
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM runs WHERE path = ?', [(path,) for path in removed])
+        counts['removed'] = len(removed)
+        return counts
+
+    def _store(self, desc: dict) -> None:
+        points = desc.pop('points')
+        columns = ', '.join(desc.keys())
+        placeholders = ', '.join('?' * len(desc))
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM runs WHERE path = ?', (desc['path'],))
+            self._conn.execute('INSERT INTO runs ({:s}) VALUES ({:s})'.format(columns, placeholders),
+                               tuple(desc.values()))
+            self._conn.executemany('INSERT INTO points (path, Fs, Fp, Pp, I, G, Gsnr) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   [(desc['path'],) + p for p in points])
+
+    def runs(self, run_type: str | None = None,
+             since: float | None = None,
+             until: float | None = None,
+             fs_min: float | None = None,
+             fs_max: float | None = None) -> list[dict]:
+        """Runs matching all the given conditions, newest first.
+
+        Args:
+            run_type: Run type, e.g. 'jpa_tuning' or 'SvsBias'.
+            since: Earliest start time, POSIX timestamp.
+            until: Latest start time, POSIX timestamp.
+            fs_min: Runs with an operating point at the signal frequency of at least fs_min, Hz.
+            fs_max: Runs with an operating point at the signal frequency of at most fs_max, Hz.
+        """
+        conditions = []
+        args = []
+        for cond, val in (('run_type = ?', run_type), ('started >= ?', since), ('started <= ?', until)):
+            if val is not None:
+                conditions += [cond]
+                args += [val]
+        if fs_min is not None or fs_max is not None:
+            conditions += ['path IN (SELECT path FROM points WHERE Fs BETWEEN ? AND ?)']
+            args += [fs_min if fs_min is not None else -np.inf, fs_max if fs_max is not None else np.inf]
+        query = 'SELECT * FROM runs'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY started DESC'
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, args)]
+
+    def points(self, fs_min: float | None = None, fs_max: float | None = None) -> list[dict]:
+        """Operating points of all tuning runs within the signal frequency range, sorted by Fs."""
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(
+                'SELECT * FROM points WHERE Fs BETWEEN ? AND ? ORDER BY Fs',
+                (fs_min if fs_min is not None else -np.inf, fs_max if fs_max is not None else np.inf))]
+
+    def watch(self, interval: float = 30., callback=None) -> None:
+        """Rescans the root every interval seconds in a background thread.
+        callback(counts) is called after each scan which changed the catalog."""
+        if self._watcher is not None:
+            return
+        self._stop_watching.clear()
+
+        def run():
+            while not self._stop_watching.wait(interval):
+                counts = self.scan()
+                if callback is not None and (counts['added'] or counts['updated'] or counts['removed']):
+                    callback(counts)
+
+        self._watcher = threading.Thread(target=run, name='MeasurementCatalog', daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
@@ -0,0 +1,168 @@
+import os
+import numpy as np
+import tables
+
+from .jpa_tuning import OperationPoint, TuningTable
+
+# Operating point columns in the order of OperationPoint.file_str()
+op_columns = ('Fs', 'Fp', 'Pp', 'I', 'G', 'Gsnr')
+
+
+class OperatingPointDescription(tables.IsDescription):
+    Fs = tables.Float64Col(pos=0)
+    Fp = tables.Float64Col(pos=1)
+    Pp = tables.Float64Col(pos=2)
+    I = tables.Float64Col(pos=3)
+    G = tables.Float64Col(pos=4)
+    Gsnr = tables.Float64Col(pos=5)
+    run = tables.StringCol(256, pos=6)
+
+
+class OperatingPointStore:
+    """Database of amplifier operating points indexed by the signal frequency.
+
+    Points are kept in an HDF5 table with a completely sorted index on Fs and mirrored
+    in memory as arrays sorted by Fs, so lookups take O(log n). The store can merge
+    results of many tuning runs: other stores, tuning data files with a thumbnail table
+    and tuning_table.txt files.
+
+    Args:
+        path: HDF5 file path. If None the store lives in memory only.
+        mode: File open mode, 'a' or 'r'.
+    """
+    def __init__(self, path: str | None = None, mode: str = 'a'):
+        self.path = path
+        self.file: tables.File | None = None
+        self.table: tables.Table | None = None
+        self._data = {key: np.zeros(0) for key in op_columns}
+        self._run = np.zeros(0, dtype='S256')
+        if path is None:
+            return
+        if mode == 'r' or os.path.exists(path):
+            self.file = tables.open_file(path, mode=mode)
+            self.table = self.file.root.points
+            self._load()
+        else:
+            self.file = tables.open_file(path, mode='w', title='Operating points')
+            self.table = self.file.create_table(self.file.root, 'points', OperatingPointDescription,
+                                                'Operating points')
+            self.table.cols.Fs.create_csindex()
+
+    def _load(self) -> None:
+        if self.table.cols.Fs.is_indexed:
+            data = self.table.read_sorted('Fs')
+        else:
+            data = np.sort(self.table.read(), order='Fs')
+        self._data = {key: np.array(data[key]) for key in op_columns}
+        self._run = np.array(data['run'])
+
+    def __len__(self) -> int:
+        return len(self._data['Fs'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """Closes the file. In memory lookups are still available."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.table = None
+
+    def add(self, op: OperationPoint, run: str = '') -> None:
+        """Inserts an operating point obtained by the tuning run run."""
+        self.add_many([op], run)
+
+    def add_many(self, ops: list[OperationPoint] | TuningTable, run: str = '') -> None:
+        """Inserts several operating points obtained by the tuning run run."""
+        new = {key: np.array([getattr(op, key) for op in ops], dtype=float) for key in op_columns}
+        if not len(new['Fs']):
+            return
+        new_run = np.full(len(new['Fs']), run.encode(), dtype='S256')
+        if self.table is not None:
+            rows = np.zeros(len(new['Fs']), dtype=self.table.dtype)
+            for key in op_columns:
+                rows[key] = new[key]
+            rows['run'] = new_run
+            self.table.append(rows)
+            self.table.flush()
+        # Keep the memory copy sorted
+        order = np.argsort(new['Fs'], kind='stable')
+        idx = np.searchsorted(self._data['Fs'], new['Fs'][order], side='right')
+        for key in op_columns:
+            self._data[key] = np.insert(self._data[key], idx, new[key][order])
+        self._run = np.insert(self._run, idx, new_run[order])
+
+    def merge(self, path: str, run: str | None = None) -> int:
+        """Merges operating points from another store, a tuning data file with a thumbnail
+        table or a tuning table text file.
+
+        Args:
+            path: File path.
+            run: Run name. The file path if None. Runs stored in another store are kept.
+
+        Returns:
+            int: Number of merged points.
+        """
+        if run is None:
+            run = path
+        if not tables.is_hdf5_file(path):
+            tt = TuningTable([])
+            tt.load(path)
+            self.add_many(tt, run)
+            return len(tt)
+        with tables.open_file(path, mode='r') as f:
+            if 'points' in f.root:
+                data = f.root.points.read()
+                runs = [r.decode() for r in data['run']]
+            else:
+                data = f.root.thumbnail.read()
+                runs = [run] * len(data)
+        for r in set(runs):
+            ops = [OperationPoint(**{key: row[key] for key in op_columns})
+                   for row, row_run in zip(data, runs) if row_run == r]
+            self.add_many(ops, r)
+        return len(data)
+
+    def frequencies(self) -> np.ndarray:
+        """Sorted signal frequencies of all points."""
+        return self._data['Fs']
+
+    def _point(self, i: int) -> OperationPoint:
+        return OperationPoint(**{key: float(self._data[key][i]) for key in op_columns})
+
+    def nearest(self, Fs: float) -> OperationPoint:
+        """Operating point with the closest signal frequency."""
+        if not len(self):
+            raise LookupError('Operating point store is empty')
+        i = np.searchsorted(self._data['Fs'], Fs)
+        if i == len(self) or (i > 0 and Fs - self._data['Fs'][i - 1] <= self._data['Fs'][i] - Fs):
+            i -= 1
+        return self._point(i)
+
+    def interpolate(self, Fs: float) -> OperationPoint:
+        """Operating point at the signal frequency Fs linearly interpolated between the
+        neighbouring points. Points of different runs may belong to different branches of
+        the amplifier response, so those aren't interpolated. Outside the covered range or
+        between points of different runs the nearest point is returned."""
+        if not len(self):
+            raise LookupError('Operating point store is empty')
+        fs = self._data['Fs']
+        i = np.searchsorted(fs, Fs)
+        if i == 0 or i == len(self) or fs[i] == fs[i - 1] or self._run[i] != self._run[i - 1]:
+            return self.nearest(Fs)
+        w = (Fs - fs[i - 1]) / (fs[i] - fs[i - 1])
+        op = OperationPoint(**{key: float((1 - w) * self._data[key][i - 1] + w * self._data[key][i])
+                               for key in op_columns})
+        op.Fs = Fs
+        return op
+
+    def lookup(self, Fs: float, interpolate: bool = False) -> OperationPoint:
+        """Operating point for the signal frequency Fs: the nearest measured one or, if
+        interpolate, the one interpolated within a run, see interpolate()."""
+        if interpolate:
+            return self.interpolate(Fs)
+        return self.nearest(Fs)